@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 语义答案缓存
+
+在工作流入口按查询向量查找相似的历史问题，命中时直接返回缓存的答案，跳过记忆检索、路由、检索、评估与生成：
+- 相似度阈值：查询向量与缓存问题向量的余弦相似度不低于阈值才算命中。
+- 对话上下文：条目带有上下文键（此前对话历史的哈希，会话首轮为空字符串），只在上下文相同的条目中查找，
+  依赖前文的追问（如“它的用法用量是什么？”）不会拿到其他会话的答案。
+- 过期时间：普通答案与网络搜索答案分别设置TTL（网络信息时效性更强）。
+- 容量上限：超过上限时按LRU淘汰。
+- 索引版本：ingest.py 每次修改向量库后递增索引版本，缓存发现版本变化时整体失效。
+- 统计命中率与节省的时间（命中条目原本的端到端耗时之和）。
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_WEB_TTL, ANSWER_CACHE_MAX_ENTRIES,
+    INDEX_VERSION_PATH
+)
+
+def read_index_version(path=INDEX_VERSION_PATH) -> str:
+    """读取当前知识库索引版本，文件不存在时返回空字符串。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def bump_index_version(path=INDEX_VERSION_PATH) -> str:
+    """生成新的索引版本并原子写入，使依赖旧索引的缓存失效。"""
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+class SemanticAnswerCache:
+    """进程内的语义答案缓存。"""
+
+    def __init__(self, threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD, ttl=ANSWER_CACHE_TTL, web_ttl=ANSWER_CACHE_WEB_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, version_path=INDEX_VERSION_PATH):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.web_ttl = web_ttl
+        self.max_entries = max_entries
+        self.version_path = version_path
+        self._entries = OrderedDict()
+        # 归一化向量矩阵及其行对应的键与上下文键；只在增删条目后惰性重建，调整LRU顺序不影响
+        self._matrix = None
+        self._matrix_keys = []
+        self._matrix_contexts = None
+        self._lock = threading.Lock()
+        self._version_mtime = -1
+        self._version = None
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+
+    def _check_index_version(self):
+        """索引版本文件变化（ingest.py 注入过数据）时清空缓存。"""
+        try:
+            mtime = os.stat(self.version_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._version_mtime:
+            return
+        self._version_mtime = mtime
+        version = read_index_version(self.version_path)
+        if self._version is not None and version != self._version and self._entries:
+            print(f"--- 知识库索引版本已变化，清空 {len(self._entries)} 条缓存答案 ---")
+            self._entries.clear()
+            self._matrix = None
+        self._version = version
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, query_embedding, context: str = ""):
+        """
+        在上下文键相同的条目中查找相似问题的缓存答案，返回 (条目, 相似度)；未命中时返回 (None, 最高相似度)。
+        """
+        with self._lock:
+            self.lookups += 1
+            self._check_index_version()
+            self._evict_expired(time.time())
+            if not self._entries:
+                return None, 0.0
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([entry["embedding"] for entry in self._entries.values()])
+                self._matrix_contexts = np.array([entry["context"] for entry in self._entries.values()], dtype=object)
+            query = np.asarray(query_embedding, dtype=np.float32)
+            similarities = self._matrix @ (query / max(np.linalg.norm(query), 1e-12))
+            similarities = np.where(self._matrix_contexts == context, similarities, -np.inf)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None, similarity if np.isfinite(similarity) else 0.0
+            key = self._matrix_keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            return entry, similarity
+
+    def store(self, query: str, query_embedding, response: str, route: str, latency: float, context: str = ""):
+        """缓存一条答案（context 为提问时的上下文键）。网络搜索得到的答案使用较短的TTL。"""
+        ttl = self.web_ttl if route == 'web_search' else self.ttl
+        if ttl <= 0:
+            return
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        now = time.time()
+        key = (context, query)
+        with self._lock:
+            self._check_index_version()
+            self._entries[key] = {
+                "query": query,
+                "context": context,
+                "embedding": embedding / max(np.linalg.norm(embedding), 1e-12),
+                "response": response,
+                "route": route,
+                "latency": latency,
+                "expires_at": now + ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+def context_key(conversation_history) -> str:
+    """由此前的对话历史生成上下文键；没有历史（会话首轮）时为空字符串，不同会话的独立问题可以共享答案。"""
+    if not conversation_history:
+        return ""
+    text = "\n".join(f"{role}: {content}" for role, content in conversation_history)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+_answer_cache = None
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache()
+    return _answer_cache
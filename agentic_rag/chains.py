@@ -5,17 +5,17 @@
 定义了系统中使用的各种LLM链，例如查询路由、查询重写和答案评估。
 """
 
-import torch
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
-from chromadb.utils import embedding_functions
 
+from agentic_rag.embedding_cache import CachedEmbeddingFunction
 from config import (
     LLM_MODEL_NAME, OPENAI_API_BASE,
-    EMBEDDING_PROVIDER, EMBEDDING_API_BASE, EMBEDDING_MODEL_NAME, LOCAL_EMBEDDING_MODEL_PATH
+    EMBEDDING_PROVIDER, EMBEDDING_API_BASE, EMBEDDING_MODEL_NAME, LOCAL_EMBEDDING_MODEL_PATH,
+    EMBEDDING_CACHE_ENABLED, LLM_CACHE_ENABLED, LLM_CACHE_CHAINS
 )
 
 # --- LLM 初始化 ---
@@ -31,8 +31,65 @@ if OPENAI_API_BASE:
 # 使用 config.py 中定义的模型和可选的自定义API地址
 llm = ChatOpenAI(**llm_params)
 
+# --- LLM 调用缓存 ---
+_llm_cache = None
+_chain_llms = {}
+# 通过 enable_llm_cache 临时为其启用缓存的链（例如评估脚本希望所有调用都可复用）
+_forced_cache_chains = set()
+
+def get_llm_cache():
+    """获取进程内共享的持久化LLM缓存（首次调用时创建）。"""
+    global _llm_cache
+    if _llm_cache is None:
+        from agentic_rag.llm_cache import SQLiteLLMCache
+        _llm_cache = SQLiteLLMCache()
+    return _llm_cache
+
+def enable_llm_cache(*chain_names):
+    """为指定的链启用缓存，忽略 LLM_CACHE_CHAINS 中的开关（LLM_CACHE_ENABLED 为False时无效）。"""
+    _forced_cache_chains.update(chain_names)
+    for name in chain_names:
+        _chain_llms.pop(name, None)
+
+def get_chain_llm(chain_name: str):
+    """
+    获取指定链使用的LLM：启用缓存时返回挂载了持久化缓存的副本，否则返回共享的 llm。
+    LangChain 的 stream() 不查询缓存，因此带缓存的副本关闭流式输出，stream() 会退化为一次 invoke。
+    """
+    if not LLM_CACHE_ENABLED or not (LLM_CACHE_CHAINS.get(chain_name) or chain_name in _forced_cache_chains):
+        return llm
+    if chain_name not in _chain_llms:
+        _chain_llms[chain_name] = llm.model_copy(update={"cache": get_llm_cache(), "disable_streaming": True})
+    return _chain_llms[chain_name]
+
+# 进程内共享的嵌入函数实例，避免重复加载模型
+_embedding_function = None
+
 def get_embedding_function():
-    """根据配置获取嵌入模型函数。"""
+    """
+    根据配置获取嵌入模型函数（进程内只创建一次）。
+    启用嵌入缓存时，返回包装了磁盘缓存与LRU缓存的 CachedEmbeddingFunction。
+    """
+    global _embedding_function
+    if _embedding_function is None:
+        base, model_id = _create_embedding_function()
+        _embedding_function = CachedEmbeddingFunction(base, model_id) if EMBEDDING_CACHE_ENABLED else base
+    return _embedding_function
+
+def embed_query_text(text: str) -> list[float]:
+    """
+    将单条查询文本嵌入为向量（纯Python浮点数列表，便于保存在图状态中）。
+    检索时通过 query_embeddings= 传给ChromaDB，避免同一查询在多个集合上被重复嵌入。
+    """
+    embedding_function = get_embedding_function()
+    if hasattr(embedding_function, "embed_documents"):
+        vector = embedding_function.embed_documents([text])[0]
+    else:
+        vector = embedding_function([text])[0]
+    return [float(x) for x in vector]
+
+def _create_embedding_function():
+    """根据配置创建底层嵌入模型，返回 (嵌入函数, 模型ID)。"""
     if EMBEDDING_PROVIDER == 'openai':
         print("--- 使用OpenAI嵌入模型 ---")
         embedding_params = {
@@ -42,15 +99,15 @@ def get_embedding_function():
         api_base = EMBEDDING_API_BASE or OPENAI_API_BASE
         if api_base:
             embedding_params["base_url"] = api_base
-        return OpenAIEmbeddings(**embedding_params)
+        return OpenAIEmbeddings(**embedding_params), f"openai:{api_base or 'default'}:{EMBEDDING_MODEL_NAME}"
     
     elif EMBEDDING_PROVIDER == 'local':
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"--- 使用ChromaDB原生本地嵌入模型: {LOCAL_EMBEDDING_MODEL_PATH} (设备: {device}) ---")
-        return embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=LOCAL_EMBEDDING_MODEL_PATH,
-            device=device
-        )
+        # 延迟导入：只有真正加载本地模型时才需要torch，避免注入脚本的子进程等场景被迫加载torch
+        from agentic_rag.local_embedding import LocalEmbeddingFunction
+        embedding_function = LocalEmbeddingFunction()
+        print(f"--- 使用本地嵌入模型: {LOCAL_EMBEDDING_MODEL_PATH} (设备: {embedding_function.device}, "
+              f"后端: {embedding_function.backend}, 最大长度: {embedding_function.max_seq_length}) ---")
+        return embedding_function, embedding_function.model_id
         
     else:
         raise ValueError(f"未知的嵌入模型提供商: {EMBEDDING_PROVIDER}。请选择 'openai' 或 'local'。")
@@ -59,7 +116,7 @@ def get_embedding_function():
 
 class RouteQuery(BaseModel):
     """根据用户问题决定路由策略。"""
-    datasource: str = Field(description="根据问题类型，从 ‘direct_chunk_search’, ‘hierarchical_search’, ‘web_search’, ‘direct’ 中选择一种最合适的路由策略。")
+    datasource: str = Field(description="根据问题类型，从 ‘direct_chunk_search’, ‘hierarchical_search’, ‘tabular_sql’, ‘web_search’, ‘direct’ 中选择一种最合适的路由策略。")
 
 class RewriteQuery(BaseModel):
     """一个经过优化的、更适合检索的用户问题版本。"""
@@ -69,6 +126,10 @@ class RelevanceGrade(BaseModel):
     """评估答案是否与原始问题相关。"""
     is_relevant: bool = Field(description="布尔值，表示答案是否相关。")
 
+class SQLQuery(BaseModel):
+    """根据表结构为用户问题编写的SQL查询。"""
+    sql: str = Field(description="可直接在DuckDB上执行的单条SELECT语句；问题无法通过这些表回答时为空字符串。")
+
 class DocumentRelevanceGrade(BaseModel):
     """评估一组文档是否与用户问题相关。"""
     is_relevant: bool = Field(description="布尔值，表示这组文档是否包含足够的信息来回答问题。")
@@ -82,16 +143,25 @@ def get_document_relevance_grader_chain():
         ("system", "你是一位信息相关性评估专家。请根据用户问题，判断下面提供的一组文档是否包含足够的相关信息来回答该问题。只需回答‘True’或‘False’。\n{format_instructions}"),
         ("human", "用户问题: {query}\n\n检索到的文档:\n{documents}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
+    return prompt | get_chain_llm("document_grader") | parser
 
 def get_query_router_chain():
     """获取查询路由链（已升级为智能路由）"""
     parser = JsonOutputParser(pydantic_object=RouteQuery)
     prompt = ChatPromptTemplate.from_messages([
-        ("system", "你是一位查询路由专家。请仔细分析用户的问题，并参考下面可能相关的历史记忆，然后根据指南选择最合适的检索策略。\n\n--- 历史记忆 ---\n{memories}\n--- 历史记忆结束 ---\n\n决策指南：\n1. 如果问题是在**查找一个具体的、已知的实体**（例如药品名称、产品型号、公司名、特定术语），这类查询需要最高的查全率，请选择 ‘direct_chunk_search’。\n2. 如果问题是**开放性的、概念性的**（例如‘解释一下什么是RAG’、‘总结一下某某文件的主要内容’），需要先理解文档主旨再找细节，请选择 ‘hierarchical_search’。\n3. 如果问题需要**最新的信息**或广泛的通用知识（例如‘今天天气怎么样’、‘介绍一下最近的AI进展’），请选择 ‘web_search’。\n4. 如果问题是**简单的对话或问候**（例如‘你好’），请选择 ‘direct’。\n\n{format_instructions}"),
+        ("system", "你是一位查询路由专家。请仔细分析用户的问题，并参考下面可能相关的历史记忆，然后根据指南选择最合适的检索策略。\n\n--- 历史记忆 ---\n{memories}\n--- 历史记忆结束 ---\n\n决策指南：\n1. 如果问题是在**查找一个具体的、已知的实体**（例如药品名称、产品型号、公司名、特定术语），这类查询需要最高的查全率，请选择 ‘direct_chunk_search’。\n2. 如果问题是**开放性的、概念性的**（例如‘解释一下什么是RAG’、‘总结一下某某文件的主要内容’），需要先理解文档主旨再找细节，请选择 ‘hierarchical_search’。\n3. 如果问题是对表格数据的**筛选、统计、计数或汇总**（例如‘某生产企业有多少个产品’、‘列出某企业生产的所有胶囊剂’），请选择 ‘tabular_sql’。\n4. 如果问题需要**最新的信息**或广泛的通用知识（例如‘今天天气怎么样’、‘介绍一下最近的AI进展’），请选择 ‘web_search’。\n5. 如果问题是**简单的对话或问候**（例如‘你好’），请选择 ‘direct’。\n\n{format_instructions}"),
+        ("human", "问题: {query}")
+    ]).partial(format_instructions=parser.get_format_instructions())
+    return prompt | get_chain_llm("router") | parser
+
+def get_sql_generator_chain():
+    """获取SQL生成链，用于表格数据的筛选、统计与计数问题。"""
+    parser = JsonOutputParser(pydantic_object=SQLQuery)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "你是一位数据分析专家。请根据下面的表结构，为用户问题编写一条DuckDB SQL查询（只允许SELECT）。列名请使用双引号，文本匹配优先使用 LIKE 或 ILIKE 进行模糊匹配。如果问题无法通过这些表回答，请返回空字符串。\n\n--- 表结构 ---\n{schema}\n--- 表结构结束 ---\n\n{format_instructions}"),
         ("human", "问题: {query}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
+    return prompt | get_chain_llm("sql_generator") | parser
 
 def get_initial_rewriter_chain():
     """获取初始查询重写链"""
@@ -100,7 +170,7 @@ def get_initial_rewriter_chain():
         ("system", "你是一位查询优化专家。请将给定的问题改写成一个更适合在网络搜索引擎或向量数据库中检索的版本，使其更清晰、更具体。\n{format_instructions}"),
         ("human", "原始问题: {query}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
+    return prompt | get_chain_llm("initial_rewriter") | parser
 
 def get_correctional_rewriter_chain():
     """获取修正性查询重写链"""
@@ -109,7 +179,7 @@ def get_correctional_rewriter_chain():
         ("system", "你是一位查询优化专家。用户之前的查询未能得到相关的答案。请分析原始问题和这个不满意的答案，然后将问题改写得更清晰、更具体，以便更好地检索。\n{format_instructions}"),
         ("human", "原始问题: {query}\n不满意的答案: {response}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
+    return prompt | get_chain_llm("correctional_rewriter") | parser
 
 def get_relevance_grader_chain():
 
@@ -119,7 +189,10 @@ def get_relevance_grader_chain():
         ("system", "你是一位信息相关性评估专家。请根据用户问题，判断提供的答案是否相关。只需回答‘True’或‘False’。\n{format_instructions}"),
         ("human", "问题: {query}\n答案: {response}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
+    return prompt | get_chain_llm("answer_grader") | parser
+
+# 摘要提示词版本号：修改下面的摘要提示词时请递增，使持久化的摘要缓存自动失效
+SUMMARIZER_PROMPT_VERSION = "v1"
 
 def get_summarizer_chain():
     """获取文档摘要链"""
@@ -127,7 +200,15 @@ def get_summarizer_chain():
         ("system", "你是一个文档摘要专家。请为以下文档生成一个简洁但全面的摘要，摘要应捕获所有核心主题、关键实体和结论，以便后续能通过摘要判断文档与用户问题的相关性。"),
         ("human", "文档内容:\n\n{document_content}")
     ])
-    return prompt | llm
+    return prompt | get_chain_llm("summarizer")
+
+def get_summary_reducer_chain():
+    """获取摘要合并链（map-reduce 摘要的 reduce 阶段：把同一文件各部分的摘要合并为一份）"""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "你是一个文档摘要专家。以下是同一份文档按顺序排列的各部分摘要，请将它们合并为一份简洁但全面的文档摘要，保留所有核心主题、关键实体和结论，去除重复内容，以便后续能通过摘要判断文档与用户问题的相关性。"),
+        ("human", "各部分摘要:\n\n{document_content}")
+    ])
+    return prompt | get_chain_llm("summary_reducer")
 
 class MemoryToSave(BaseModel):
     """用于存储到长期记忆库的结构化信息。"""
@@ -142,4 +223,4 @@ def get_memory_consolidation_chain():
         ("system", "你是一个记忆提炼专家。请分析以下对话，并从中提取出最值得长期记住的核心信息。如果对话没有包含任何有价值、可供未来参考的信息，请回答‘No valuable information to save’。\n\n{format_instructions}"),
         ("human", "对话历史:\n\n{conversation_history}")
     ]).partial(format_instructions=parser.get_format_instructions())
-    return prompt | llm | parser
\ No newline at end of file
+    return prompt | get_chain_llm("memory_consolidation") | parser
\ No newline at end of file
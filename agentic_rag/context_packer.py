@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 上下文打包
+
+在生成答案前把检索结果整理为受token预算约束的上下文，取代直接把文档列表的Python表示塞进提示词：
+- 统一格式：本地 Document 与网络搜索（Tavily）结果都转换为 "[序号] 来源: ...\\n正文" 的片段。
+- 去重：完全相同与高度相似（字符三元组 Jaccard 相似度不低于阈值）的片段只保留得分最高的一个。
+- 排序：按检索得分（重排序得分或网络搜索得分）降序排列，没有得分时保持检索顺序。
+- 压缩（可选）：用已加载的嵌入模型为片段中的每个句子与问题计算相似度，只保留最相关的几句。
+- 预算：用 tiktoken 计算token数，依次放入片段直到用完预算，最后一个放不下的片段被截断。
+并报告相对于原始上下文节省的token数。
+"""
+
+import re
+import threading
+
+import numpy as np
+
+from config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_TOKENIZER_ENCODING, CONTEXT_NEAR_DUPLICATE_THRESHOLD,
+    CONTEXT_COMPRESSION_ENABLED, CONTEXT_COMPRESSION_SENTENCES
+)
+
+# 截断后剩余预算少于该token数时不再放入片段
+MIN_PASSAGE_TOKENS = 32
+SENTENCE_PATTERN = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]?")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """加载 tiktoken 编码（首次调用时加载）；不可用时返回 None，改用按字符估算。"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER_ENCODING)
+            except Exception as e:
+                print(f"警告: 无法加载 tiktoken 编码 '{CONTEXT_TOKENIZER_ENCODING}' ({e})，将按字符数估算token。")
+                _encoding = False
+    return _encoding or None
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        # 粗略估算：中文约每字一个token，其他字符约每4个一个token
+        cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+        return cjk + (len(text) - cjk + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        while text and count_tokens(text) > max_tokens:
+            text = text[:int(len(text) * 0.9)]
+        return text
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+# --- 统一格式 ---
+
+def to_passages(documents) -> list:
+    """把检索结果转换为 [{"text", "source", "score", "compressible"}, ...]。"""
+    if isinstance(documents, str):
+        return [{"text": documents, "source": "web_search", "score": None, "compressible": True}]
+    if isinstance(documents, dict):
+        # Tavily 返回 {"query": ..., "results": [{"url", "title", "content", "score"}, ...]}
+        documents = documents.get("results") or []
+    passages = []
+    for document in documents or []:
+        if isinstance(document, dict):
+            title = document.get("title")
+            text = document.get("content") or ""
+            passages.append({
+                "text": f"{title}\n{text}" if title else text,
+                "source": document.get("url", "web_search"),
+                "score": document.get("score"),
+                "compressible": True,
+            })
+        elif hasattr(document, "page_content"):
+            metadata = document.metadata or {}
+            passages.append({
+                "text": document.page_content,
+                "source": metadata.get("source", "unknown_source"),
+                "score": metadata.get("rerank_score"),
+                # SQL查询结果是表格，压缩会破坏结构
+                "compressible": metadata.get("data_type") != "sql_result",
+            })
+        else:
+            passages.append({"text": str(document), "source": "unknown_source", "score": None, "compressible": True})
+    return [passage for passage in passages if passage["text"].strip()]
+
+# --- 排序与去重 ---
+
+def _shingles(text: str, n=3) -> set:
+    text = re.sub(r"\s+", "", text)
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def rank_and_deduplicate(passages, threshold=CONTEXT_NEAR_DUPLICATE_THRESHOLD) -> list:
+    """按得分降序排列（没有得分时保持检索顺序），并去除完全相同或高度相似的片段。"""
+    if passages and all(passage["score"] is not None for passage in passages):
+        passages = sorted(passages, key=lambda passage: passage["score"], reverse=True)
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        duplicate = any(
+            len(shingles & other) / max(len(shingles | other), 1) >= threshold for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+# --- 句子级压缩 ---
+
+def compress_passages(passages, query_embedding, max_sentences=CONTEXT_COMPRESSION_SENTENCES) -> list:
+    """每个片段只保留与问题最相似的 max_sentences 个句子（保持原文顺序）。"""
+    from agentic_rag.chains import get_embedding_function
+
+    sentence_lists = [
+        [sentence.strip() for sentence in SENTENCE_PATTERN.findall(passage["text"]) if sentence.strip()]
+        if passage["compressible"] else []
+        for passage in passages
+    ]
+    to_embed = [sentence for sentences in sentence_lists if len(sentences) > max_sentences for sentence in sentences]
+    if not to_embed:
+        return passages
+    embedding_function = get_embedding_function()
+    if hasattr(embedding_function, "embed_documents"):
+        vectors = np.asarray(embedding_function.embed_documents(to_embed), dtype=np.float32)
+    else:
+        vectors = np.asarray(embedding_function(to_embed), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    similarities = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+
+    compressed, offset = [], 0
+    for passage, sentences in zip(passages, sentence_lists):
+        if len(sentences) <= max_sentences:
+            compressed.append(passage)
+            continue
+        scores = similarities[offset:offset + len(sentences)]
+        offset += len(sentences)
+        keep = sorted(np.argsort(-scores)[:max_sentences])
+        compressed.append({**passage, "text": " ".join(sentences[i] for i in keep)})
+    return compressed
+
+# --- 打包 ---
+
+def format_passage(index: int, passage) -> str:
+    return f"[{index}] 来源: {passage['source']}\n{passage['text']}"
+
+def pack_context(documents, query_embedding=None, budget=CONTEXT_TOKEN_BUDGET, compress=CONTEXT_COMPRESSION_ENABLED):
+    """
+    把检索结果打包为上下文文本。
+    返回 (上下文, 统计信息)，统计信息包含原始与打包后的token数及片段数。
+    query_embedding 仅在启用压缩时需要。
+    """
+    original_tokens = count_tokens(str(documents))
+    retrieved = to_passages(documents)
+    passages = rank_and_deduplicate(retrieved)
+    duplicates_removed = len(retrieved) - len(passages)
+    if compress and query_embedding is not None:
+        passages = compress_passages(passages, query_embedding)
+
+    parts, used = [], 0
+    for passage in passages:
+        text = format_passage(len(parts) + 1, passage)
+        tokens = count_tokens(text)
+        remaining = budget - used
+        if tokens > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                break
+            text = truncate_to_tokens(text, remaining)
+            tokens = count_tokens(text)
+        parts.append(text)
+        used += tokens + 1
+
+    context = "\n\n".join(parts)
+    packed_tokens = count_tokens(context)
+    stats = {
+        "original_tokens": original_tokens,
+        "packed_tokens": packed_tokens,
+        "tokens_saved": max(original_tokens - packed_tokens, 0),
+        "passages": len(parts),
+        "duplicates_removed": duplicates_removed,
+    }
+    return context, stats
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 嵌入向量缓存模块
+
+为嵌入模型提供一层磁盘缓存，同一段文本只需嵌入一次：
+- 磁盘层：每个模型一个目录，向量以 float16/float32 紧凑地追加写入一个内存映射文件，
+  SQLite 索引记录 (归一化文本哈希 -> 行号)。写入在 SQLite 事务中完成，多个进程可以安全地共享同一缓存。
+- 内存层：进程内的LRU缓存，重复查询无需访问磁盘。
+- 只有两层都未命中的文本才会被批量送入模型。
+
+CachedEmbeddingFunction 同时实现了 ChromaDB 的嵌入函数接口（__call__）
+和 LangChain 的 Embeddings 接口（embed_documents / embed_query），可用于任一场景。
+"""
+
+import os
+import re
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_DTYPE, EMBEDDING_CACHE_LRU_SIZE
+
+def normalize_text(text: str) -> str:
+    """归一化文本（Unicode NFC、折叠空白），使仅有空白差异的文本共享同一个缓存键。"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def _model_dir_name(model_id: str) -> str:
+    """将模型ID转换为安全的目录名，保留可读前缀并附加哈希以避免冲突。"""
+    readable = re.sub(r"[^0-9A-Za-z_.-]+", "_", model_id)[-48:]
+    return f"{readable}-{hashlib.sha1(model_id.encode('utf-8')).hexdigest()[:8]}"
+
+class EmbeddingStore:
+    """
+    基于内存映射文件的向量存储。
+    向量文件为定长行的原始数组（行数 x 维度），只追加不修改；SQLite 保存键到行号的映射以及向量维度。
+    """
+
+    def __init__(self, model_id: str, root=EMBEDDING_CACHE_PATH, dtype=EMBEDDING_CACHE_DTYPE):
+        self.dir = os.path.join(root, _model_dir_name(model_id))
+        os.makedirs(self.dir, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(self.dir, f"vectors.{self.dtype.name}")
+        self.conn = sqlite3.connect(os.path.join(self.dir, "index.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._mmap = None
+
+    def _dim(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return row[0] if row else None
+
+    def _matrix(self, min_rows):
+        """返回覆盖至少 min_rows 行的只读内存映射；文件增长后重新映射。"""
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            dim = self._dim()
+            rows = os.path.getsize(self.vectors_path) // (dim * self.dtype.itemsize)
+            self._mmap = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(rows, dim))
+        return self._mmap
+
+    def _lookup_rows(self, keys):
+        """查询键对应的行号。SQLite 单条语句的参数数量有限，分批查询。"""
+        found = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self.conn.execute(f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", batch).fetchall())
+        return found
+
+    def get_many(self, keys):
+        """批量读取向量，返回 {键: float32向量}，不存在的键不出现在结果中。"""
+        if not keys:
+            return {}
+        with self._lock:
+            found = self._lookup_rows(keys)
+            if not found:
+                return {}
+            matrix = self._matrix(max(found.values()) + 1)
+            return {key: np.asarray(matrix[row], dtype=np.float32) for key, row in found.items()}
+
+    def _repair_tail(self, row_bytes):
+        """
+        使向量文件与索引一致，返回下一行的行号（须在写事务中调用）。
+        崩溃或写入失败可能在文件末尾留下未登记的行或半行，截断到索引中最大行号之后；
+        文件比索引记录的短时（未落盘的写入），删除指向文件末尾之外的索引项。
+        """
+        file_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        max_row = self.conn.execute("SELECT MAX(row) FROM vectors").fetchone()[0]
+        index_rows = 0 if max_row is None else max_row + 1
+        if file_rows < index_rows:
+            self.conn.execute("DELETE FROM vectors WHERE row >= ?", (file_rows,))
+        rows = min(file_rows, index_rows)
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != rows * row_bytes:
+            self._mmap = None
+            os.truncate(self.vectors_path, rows * row_bytes)
+        return rows
+
+    def put_many(self, keys, vectors):
+        """追加写入一批向量。已存在的键会被忽略（可能由其他进程并发写入）。"""
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        with self._lock:
+            # BEGIN IMMEDIATE 获取写锁，使追加文件与更新索引在多个进程间串行执行
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                dim = self._dim()
+                if dim is None:
+                    dim = vectors.shape[1]
+                    self.conn.execute("INSERT INTO meta (name, value) VALUES ('dim', ?)", (dim,))
+                elif dim != vectors.shape[1]:
+                    raise ValueError(f"嵌入维度 {vectors.shape[1]} 与缓存中的维度 {dim} 不一致")
+                existing = self._lookup_rows(list(keys))
+                new_items = {}
+                for key, vector in zip(keys, vectors):
+                    if key not in existing and key not in new_items:
+                        new_items[key] = vector
+                if new_items:
+                    start_row = self._repair_tail(dim * self.dtype.itemsize)
+                    with open(self.vectors_path, 'ab') as f:
+                        f.write(np.stack(list(new_items.values())).tobytes())
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO vectors (key, row) VALUES (?, ?)",
+                        [(key, start_row + i) for i, key in enumerate(new_items)]
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    带两级缓存的嵌入函数，可包装 ChromaDB 嵌入函数或 LangChain Embeddings。
+    只将缓存未命中的（去重后的）文本批量送入底层模型。
+    """
+
+    def __init__(self, base, model_id: str, store: EmbeddingStore = None, lru_size=EMBEDDING_CACHE_LRU_SIZE):
+        self.base = base
+        self.model_id = model_id
+        self.store = store or EmbeddingStore(model_id)
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _embed_with_model(self, texts):
+        if hasattr(self.base, "embed_documents"):
+            return self.base.embed_documents(texts)
+        return self.base(texts)
+
+    def _lru_get(self, key):
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _lru_put(self, key, vector):
+        if self.lru_size <= 0:
+            return
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def embed(self, texts):
+        """嵌入一批文本，返回与输入对齐的 float32 向量列表。"""
+        keys = [text_key(text) for text in texts]
+        vectors = {}
+        for key in set(keys):
+            vector = self._lru_get(key)
+            if vector is not None:
+                vectors[key] = vector
+        self.memory_hits += sum(1 for key in keys if key in vectors)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        from_disk = self.store.get_many(missing)
+        self.disk_hits += sum(1 for key in keys if key in from_disk)
+        vectors.update(from_disk)
+
+        # 去重后只把真正的未命中送入模型
+        miss_texts = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in miss_texts:
+                miss_texts[key] = text
+        if miss_texts:
+            self.misses += sum(1 for key in keys if key in miss_texts)
+            embedded = np.asarray(self._embed_with_model(list(miss_texts.values())), dtype=np.float32)
+            self.store.put_many(list(miss_texts), embedded)
+            vectors.update(zip(miss_texts, embedded))
+
+        for key in set(keys):
+            self._lru_put(key, vectors[key])
+        return [vectors[key] for key in keys]
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    # --- ChromaDB 嵌入函数接口 ---
+    def __call__(self, input):
+        return [vector.tolist() for vector in self.embed(list(input))]
+
+    # --- LangChain Embeddings 接口 ---
+    def embed_documents(self, texts):
+        return [vector.tolist() for vector in self.embed(list(texts))]
+
+    def embed_query(self, input):
+        """
+        同时兼容两种调用方式：LangChain 传入单个字符串并期望单个向量；
+        ChromaDB 传入文本列表并期望向量列表。
+        """
+        if isinstance(input, str):
+            return self.embed([input])[0].tolist()
+        return self(input)
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
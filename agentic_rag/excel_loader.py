@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 表格（Excel）数据加载模块
+
+以列式、分块的方式加载Excel工作簿，取代逐行 df.iterrows() 的实现：
+- 使用 openpyxl 只读模式流式读取每个工作表，按固定行数分块，内存占用与工作簿大小无关。
+- 以向量化的 pandas 字符串运算批量构建 "列名: 值" 形式的行文本及元数据。
+- 解析后的工作簿以 Parquet 格式缓存（按文件内容哈希命名），未变化的表格无需再次经过 openpyxl；
+  注入清单中已不存在的内容哈希对应的缓存由 prune_cache 清理。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import pandas as pd
+from langchain_core.documents import Document
+
+from config import EXCEL_METADATA_COLUMNS, EXCEL_CHUNK_ROWS, EXCEL_PARQUET_CACHE_PATH
+
+# 缓存格式版本，解析逻辑变化时递增以使旧缓存失效
+CACHE_VERSION = 2
+# Parquet 缓存中用于记录行号的内部列，以及工作表索引文件名
+ROW_COLUMN = "__row__"
+CACHE_INDEX_FILE = "sheets.json"
+
+def _file_hash(file_path, block_size=1 << 20):
+    """分块计算文件内容的SHA-256哈希。"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _cache_dir(content_hash):
+    return os.path.join(EXCEL_PARQUET_CACHE_PATH, f"{content_hash}.v{CACHE_VERSION}")
+
+def _normalize_frame(frame):
+    """将所有单元格统一转换为字符串，空值转换为空字符串（与旧版 str(value) 的行为一致）。"""
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), "").astype(str)
+
+def _header_names(header_row):
+    """
+    生成列名，空表头按 pandas 的约定命名为 'Unnamed: i'，重复的表头与 pandas 一样追加序号（'name.1'），
+    并避开 Parquet 缓存的内部行号列。
+    """
+    seen, names = {}, []
+    for i, name in enumerate(header_row):
+        name = str(name) if name is not None else f"Unnamed: {i}"
+        if name == ROW_COLUMN:
+            name = f"{name}_"
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f"{name}.{count}")
+    return names
+
+# --- 读取：openpyxl 流式分块 ---
+
+def _iter_openpyxl_chunks(file_path, chunk_rows):
+    """使用 openpyxl 只读模式逐个工作表、逐块读取，产出 (工作表名, DataFrame块)。"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = _header_names(header)
+            buffer, row_numbers = [], []
+            for row_number, values in enumerate(rows):
+                if all(value is None for value in values):
+                    continue
+                # 只读模式下各行长度可能不一致，按表头对齐
+                values = tuple(values[:len(columns)]) + (None,) * (len(columns) - len(values))
+                buffer.append(values)
+                row_numbers.append(row_number)
+                if len(buffer) >= chunk_rows:
+                    yield sheet.title, _normalize_frame(pd.DataFrame(buffer, columns=columns, index=row_numbers))
+                    buffer, row_numbers = [], []
+            if buffer:
+                yield sheet.title, _normalize_frame(pd.DataFrame(buffer, columns=columns, index=row_numbers))
+    finally:
+        workbook.close()
+
+def _iter_pandas_chunks(file_path, chunk_rows):
+    """openpyxl 不支持的旧版 .xls 格式，回退到 pandas 读取后再分块。"""
+    sheets = pd.read_excel(file_path, sheet_name=None)
+    for sheet_name, frame in sheets.items():
+        frame = _normalize_frame(frame)
+        for start in range(0, len(frame), chunk_rows):
+            yield sheet_name, frame.iloc[start:start + chunk_rows]
+
+def _iter_source_chunks(file_path, chunk_rows):
+    if os.path.splitext(file_path)[1].lower() == '.xls':
+        return _iter_pandas_chunks(file_path, chunk_rows)
+    return _iter_openpyxl_chunks(file_path, chunk_rows)
+
+# --- Parquet 缓存 ---
+# 每个工作簿缓存为一个目录：每个工作表一个 Parquet 文件（各表列不同），
+# 以及一个按原始顺序记录工作表名的索引文件。索引文件最后写入，它的存在即表示缓存完整可用。
+
+def _iter_cached_chunks(cache_dir, chunk_rows):
+    """从 Parquet 缓存中按批读取，恢复为与首次解析相同的 (工作表名, DataFrame块) 序列。"""
+    import pyarrow.parquet as pq
+
+    with open(os.path.join(cache_dir, CACHE_INDEX_FILE), 'r', encoding='utf-8') as f:
+        sheets = json.load(f)
+    for entry in sheets:
+        parquet_file = pq.ParquetFile(os.path.join(cache_dir, entry["file"]))
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+            frame = batch.to_pandas().set_index(ROW_COLUMN)
+            frame.index.name = None
+            yield entry["sheet"], frame
+
+def _iter_chunks_with_cache_write(file_path, chunk_rows, cache_dir):
+    """
+    解析源文件的同时把每个块追加写入 Parquet 缓存，全部成功后再写入索引文件。
+    缓存只是加速手段：任何缓存写入错误都只会放弃缓存，不影响数据加载。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("警告: 未安装 pyarrow，Excel 解析结果将不会被缓存。")
+        yield from _iter_source_chunks(file_path, chunk_rows)
+        return
+
+    sheets, writers = [], {}
+    cache_ok = True
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        print(f"警告: 无法创建 Excel 缓存目录 {cache_dir}: {e}")
+        cache_ok = False
+    try:
+        for sheet_name, frame in _iter_source_chunks(file_path, chunk_rows):
+            yield sheet_name, frame
+            if not cache_ok:
+                continue
+            try:
+                if sheet_name not in writers:
+                    sheets.append({"sheet": sheet_name, "file": f"{len(sheets)}.parquet"})
+                table = pa.Table.from_pandas(frame.assign(**{ROW_COLUMN: frame.index.astype('int64')}), preserve_index=False)
+                if sheet_name not in writers:
+                    writers[sheet_name] = pq.ParquetWriter(os.path.join(cache_dir, sheets[-1]["file"]), table.schema)
+                writers[sheet_name].write_table(table)
+            except Exception as e:
+                print(f"警告: 写入 Excel 缓存失败，将放弃缓存 {file_path}: {e}")
+                cache_ok = False
+        for writer in writers.values():
+            writer.close()
+        writers = {}
+        if cache_ok:
+            with open(os.path.join(cache_dir, CACHE_INDEX_FILE), 'w', encoding='utf-8') as f:
+                json.dump(sheets, f, ensure_ascii=False)
+    finally:
+        for writer in writers.values():
+            writer.close()
+        if not os.path.exists(os.path.join(cache_dir, CACHE_INDEX_FILE)):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+def prune_cache(content_hashes) -> int:
+    """删除内容哈希不在 content_hashes 中（或缓存格式版本过期）的 Parquet 缓存，返回删除的目录数。"""
+    if not os.path.isdir(EXCEL_PARQUET_CACHE_PATH):
+        return 0
+    keep = {os.path.basename(_cache_dir(content_hash)) for content_hash in content_hashes}
+    removed = 0
+    for name in os.listdir(EXCEL_PARQUET_CACHE_PATH):
+        path = os.path.join(EXCEL_PARQUET_CACHE_PATH, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def iter_excel_frames(file_path, content_hash=None, chunk_rows=EXCEL_CHUNK_ROWS):
+    """
+    逐块产出工作簿中所有工作表的数据，产出 (工作表名, DataFrame块)。
+    DataFrame 的索引为行号（从0开始，不含表头），所有值均已转换为字符串。
+
+    Args:
+        file_path (str): Excel 文件路径。
+        content_hash (str, optional): 文件内容哈希，未提供时自动计算；用作 Parquet 缓存的键。
+        chunk_rows (int): 每块的行数。
+    """
+    content_hash = content_hash or _file_hash(file_path)
+    cache_dir = _cache_dir(content_hash)
+    if os.path.exists(os.path.join(cache_dir, CACHE_INDEX_FILE)):
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            yield from _iter_cached_chunks(cache_dir, chunk_rows)
+            return
+    yield from _iter_chunks_with_cache_write(file_path, chunk_rows, cache_dir)
+
+# --- 向量化构建行文本与元数据 ---
+
+def build_row_texts(frame):
+    """以列为单位拼接 "列名: 值" 文本，返回与 frame 行对齐的字符串 Series。"""
+    texts = None
+    for i, column in enumerate(frame.columns):
+        prefix = f"{column}: " if i == 0 else f"\n{column}: "
+        part = prefix + frame[column]
+        texts = part if texts is None else texts + part
+    if texts is None:
+        return pd.Series("", index=frame.index)
+    return texts
+
+def build_row_metadatas(frame, file_path, sheet_name):
+    """批量构建每行的元数据字典，包含 EXCEL_METADATA_COLUMNS 中出现在该表里的列。"""
+    metadata_columns = [column for column in EXCEL_METADATA_COLUMNS if column in frame.columns]
+    records = frame[metadata_columns].to_dict('records') if metadata_columns else [{} for _ in range(len(frame))]
+    for row_index, record in zip(frame.index.tolist(), records):
+        record.update({"source": file_path, "sheet_name": sheet_name, "row_index": int(row_index), "data_type": "tabular"})
+    return records
+
+def iter_excel_documents(file_path, content_hash=None, chunk_rows=EXCEL_CHUNK_ROWS):
+    """逐条产出工作簿中每一行对应的 Document。"""
+    for sheet_name, frame in iter_excel_frames(file_path, content_hash, chunk_rows):
+        texts = build_row_texts(frame).tolist()
+        metadatas = build_row_metadatas(frame, file_path, sheet_name)
+        for text, metadata in zip(texts, metadatas):
+            yield Document(page_content=text, metadata=metadata)
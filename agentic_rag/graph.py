@@ -6,40 +6,110 @@
 from langgraph.graph import StateGraph, END
 
 from agentic_rag.state import AgentState
-from agentic_rag.nodes import (
-    retrieve_memory_node,
-    consolidate_memory_node,
-    route_query_node,
-    rewrite_query_node,
-    retrieve_documents_node, # new
-    grade_documents_node,    # new
-    generate_response_node,
-    grade_relevance_node,
-    direct_response_node
-)
-
-def build_graph():
-    """构建并返回集成了“自省”能力的、包含内外双循环的LangGraph图。"""
-    workflow = StateGraph(AgentState)
+from agentic_rag import nodes
+from config import RETRIEVAL_FANOUT_ENABLED
 
-    # --- 添加所有节点 ---
+# 图中的节点名称 -> (同步实现, 异步实现)
+NODE_IMPLEMENTATIONS = {
+    # 语义答案缓存
+    "check_answer_cache": (nodes.check_answer_cache_node, nodes.acheck_answer_cache_node),
+    "update_answer_cache": (nodes.update_answer_cache_node, nodes.aupdate_answer_cache_node),
     # 记忆相关
-    workflow.add_node("retrieve_memory", retrieve_memory_node)
-    workflow.add_node("consolidate_memory", consolidate_memory_node)
+    "retrieve_memory": (nodes.retrieve_memory_node, nodes.aretrieve_memory_node),
+    "consolidate_memory": (nodes.consolidate_memory_node, nodes.aconsolidate_memory_node),
     # 核心流程
-    workflow.add_node("route_query", route_query_node)
-    workflow.add_node("rewrite_query", rewrite_query_node)
-    workflow.add_node("retrieve_documents", retrieve_documents_node)
-    workflow.add_node("grade_documents", grade_documents_node)
-    workflow.add_node("generate_response", generate_response_node)
-    workflow.add_node("direct_response", direct_response_node)
+    "route_query": (nodes.route_query_node, nodes.aroute_query_node),
+    "rewrite_query": (nodes.rewrite_query_node, nodes.arewrite_query_node),
+    "retrieve_documents": (nodes.retrieve_documents_node, nodes.aretrieve_documents_node),
+    "grade_documents": (nodes.grade_documents_node, nodes.agrade_documents_node),
+    "switch_route": (nodes.switch_route_node, nodes.aswitch_route_node),
+    "generate_response": (nodes.generate_response_node, nodes.agenerate_response_node),
+    "direct_response": (nodes.direct_response_node, nodes.adirect_response_node),
     # 外部循环评估
-    workflow.add_node("grade_relevance", grade_relevance_node)
+    "grade_relevance": (nodes.grade_relevance_node, nodes.agrade_relevance_node),
+}
+
+# 并发扇出模式下，内循环的“检索->评估->切换策略”由这一个节点完成
+FANOUT_NODE_IMPLEMENTATION = (nodes.fanout_retrieve_node, nodes.afanout_retrieve_node)
+SEQUENTIAL_RETRIEVAL_NODES = ("retrieve_documents", "grade_documents", "switch_route")
+
+# 单次运行的最大步数：覆盖缓存/记忆/路由、三种检索策略的内循环与两次修正性重试的最坏情况
+GRAPH_RECURSION_LIMIT = 40
+
+# 产生最终答案的节点，流式运行时只有这些节点的LLM输出会作为答案token传出
+ANSWER_NODES = ("generate_response", "direct_response")
+STREAM_MODES = ["updates", "messages", "values"]
+
+def _stream_event(mode, chunk):
+    """将LangGraph的流式输出转换为 (事件名, 数据) 列表。"""
+    if mode == "messages":
+        message, metadata = chunk
+        node = metadata.get("langgraph_node")
+        if node in ANSWER_NODES and message.content:
+            return [("token", {"node": node, "text": message.content})]
+        return []
+    if mode == "updates":
+        return [("node", {"node": node, "update": update or {}}) for node, update in chunk.items()]
+    return []
+
+def stream_run(graph, inputs, config=None):
+    """
+    流式运行同步图，依次产出 (事件名, 数据)：
+    - ("node", {"node", "update"}): 某个节点执行完毕及其状态更新；
+    - ("token", {"node", "text"}): 答案节点收到的LLM token；
+    - ("final", 最终状态): 运行结束。
+    """
+    final_state = None
+    for mode, chunk in graph.stream(inputs, config=config, stream_mode=STREAM_MODES):
+        if mode == "values":
+            final_state = chunk
+        yield from _stream_event(mode, chunk)
+    yield "final", final_state
+
+async def astream_run(graph, inputs, config=None):
+    """stream_run 的异步版本，用于 build_graph(async_mode=True) 编译的图。"""
+    final_state = None
+    async for mode, chunk in graph.astream(inputs, config=config, stream_mode=STREAM_MODES):
+        if mode == "values":
+            final_state = chunk
+        for event in _stream_event(mode, chunk):
+            yield event
+    yield "final", final_state
+
+def build_graph(async_mode=False, checkpointer=None, fanout=RETRIEVAL_FANOUT_ENABLED):
+    """
+    构建并返回集成了“自省”能力的、包含内外双循环的LangGraph图。
+
+    Args:
+        async_mode (bool): 为True时使用异步节点编译图，应通过 graph.ainvoke / graph.astream 驱动，
+            多个问题可以在同一个事件循环中并发执行；为False时使用同步节点（graph.invoke）。
+        checkpointer: 可选的LangGraph检查点存储。配置后按 config["configurable"]["thread_id"] 保存会话状态，
+            同一会话的多轮问题共享对话历史（每轮的输入应使用 state.new_turn_input 构造）。
+        fanout (bool): 为True时同时执行所有检索策略并并行评估，按路由优先级取第一个相关结果；
+            为False时按顺序逐个尝试策略。
+    """
+    workflow = StateGraph(AgentState)
+
+    # --- 添加所有节点 ---
+    node_implementations = dict(NODE_IMPLEMENTATIONS)
+    if fanout:
+        for name in SEQUENTIAL_RETRIEVAL_NODES:
+            del node_implementations[name]
+        node_implementations["fanout_retrieve"] = FANOUT_NODE_IMPLEMENTATION
+    for name, (sync_node, async_node) in node_implementations.items():
+        workflow.add_node(name, async_node if async_mode else sync_node)
 
     # --- 定义边 ---
 
-    # 1. 从“回忆”开始
-    workflow.set_entry_point("retrieve_memory")
+    # 0. 先查语义答案缓存，命中则直接结束
+    workflow.set_entry_point("check_answer_cache")
+    workflow.add_conditional_edges(
+        "check_answer_cache",
+        lambda state: "hit" if state.get("answer_cache_hit") else "miss",
+        {"hit": END, "miss": "retrieve_memory"}
+    )
+
+    # 1. 未命中缓存时从“回忆”开始
     workflow.add_edge("retrieve_memory", "route_query")
 
     # 2. “路由”后，对于需要检索的，先“重写查询”
@@ -50,47 +120,52 @@ def build_graph():
             "web_search": "rewrite_query",
             "hierarchical_search": "rewrite_query",
             "direct_chunk_search": "rewrite_query",
+            "tabular_sql": "rewrite_query",
             "direct": "direct_response" # “直接回答”路由，跳过所有检索和生成
         }
     )
     
     # 3. “重写查询”后，开始“内循环”：检索->评估->决策
-    workflow.add_edge("rewrite_query", "retrieve_documents")
-    workflow.add_edge("retrieve_documents", "grade_documents")
+    if fanout:
+        # 扇出节点内部已尝试所有策略，只需根据结果决定生成答案或结束
+        workflow.add_edge("rewrite_query", "fanout_retrieve")
+        workflow.add_conditional_edges(
+            "fanout_retrieve",
+            lambda state: "generate" if state.get("documents_are_relevant") else "fallback",
+            {"generate": "generate_response", "fallback": END}
+        )
+    else:
+        workflow.add_edge("rewrite_query", "retrieve_documents")
+        workflow.add_edge("retrieve_documents", "grade_documents")
 
     # 4. “内循环”的核心决策
     def decide_after_document_grading(state: AgentState):
-        """在评估文档后，决定是生成答案，还是切换策略重试。"""
+        """
+        在评估文档后，决定是生成答案，还是切换策略重试。
+        条件边对状态的修改会被丢弃，策略切换由 switch_route 节点完成。
+        """
         if state.get("documents_are_relevant"):
             print("---决策：文档相关，进入答案生成---")
             return "generate"
         
         print("---决策：文档不相关，尝试切换策略---")
-        tried_routes = state.get("tried_routes", [])
-        available_routes = ['hierarchical_search', 'direct_chunk_search', 'web_search']
-        
-        for next_route in available_routes:
-            if next_route not in tried_routes:
-                print(f"---决策：切换到新策略 '{next_route}'---")
-                # 更新状态以驱动下一次循环
-                new_state = state.copy()
-                new_state['route'] = next_route
-                new_state['tried_routes'] = tried_routes + [next_route]
-                state.update(new_state)
-                return "retry_retrieve"
+        if nodes.next_retrieval_route(state) is not None:
+            return "retry_retrieve"
         
         print("---决策：所有检索策略均失败，无法找到相关文档---")
         return "fallback"
 
-    workflow.add_conditional_edges(
-        "grade_documents",
-        decide_after_document_grading,
-        {
-            "generate": "generate_response",
-            "retry_retrieve": "retrieve_documents", # 回到检索节点，形成循环
-            "fallback": END # 所有策略失败，结束流程
-        }
-    )
+    if not fanout:
+        workflow.add_conditional_edges(
+            "grade_documents",
+            decide_after_document_grading,
+            {
+                "generate": "generate_response",
+                "retry_retrieve": "switch_route", # 切换策略后回到检索节点，形成循环
+                "fallback": END # 所有策略失败，结束流程
+            }
+        )
+        workflow.add_edge("switch_route", "retrieve_documents")
 
     # 5. “外循环”：生成答案 -> 评估答案
     workflow.add_edge("generate_response", "grade_relevance")
@@ -115,14 +190,16 @@ def build_graph():
         "grade_relevance",
         decide_after_answer_grading,
         {
-            "end": "consolidate_memory", # 答案相关或达到最大次数，去“复盘”并形成记忆
+            "end": "update_answer_cache", # 答案相关或达到最大次数，缓存相关的答案后去“复盘”并形成记忆
             "retry": "rewrite_query"     # 答案不相关，重写查询
         }
     )
     
+    workflow.add_edge("update_answer_cache", "consolidate_memory")
+
     # 7. “复盘记忆”后，流程结束
     workflow.add_edge("consolidate_memory", END)
 
     # 编译图
-    graph = workflow.compile()
+    graph = workflow.compile(checkpointer=checkpointer)
     return graph
\ No newline at end of file
@@ -3,12 +3,26 @@
 @desc: 分层检索模块
 
 实现了先检索摘要，再从相关文档中检索具体区块的两步检索策略。
+摘要检索（第1步）默认在内存映射的摘要向量矩阵上完成，不经过Chroma。
+直接区块检索会融合向量检索与词法（BM25）检索的结果。
+精确标识符查询（批准文号、本位码等）可以先通过元数据索引与词法索引直接定位区块，无需嵌入。
+表格数据的筛选、统计类问题通过SQL在表格列式存储上查询。
 """
 
+import os
+
 import chromadb
 from langchain_core.documents import Document
 
-from agentic_rag.chains import get_embedding_function
+from agentic_rag.chains import get_embedding_function, embed_query_text, get_sql_generator_chain
+from agentic_rag.lexical_index import get_lexical_index, is_code_query, reciprocal_rank_fusion
+from agentic_rag.metadata_index import get_metadata_index
+from agentic_rag.summary_index import SummaryIndex
+from agentic_rag.tabular_store import TabularStore, format_query_result
+from config import (
+    LEXICAL_INDEX_ENABLED, LEXICAL_CANDIDATES, METADATA_INDEX_ENABLED, TABULAR_STORAGE_MODE, TABULAR_DB_PATH,
+    SUMMARY_INDEX_ENABLED
+)
 
 # --- 配置 ---
 PERSIST_PATH = "chroma_db"
@@ -21,28 +35,38 @@ client = chromadb.PersistentClient(path=PERSIST_PATH)
 embedding_function = get_embedding_function()
 summary_collection = client.get_collection(SUMMARY_COLLECTION_NAME, embedding_function=embedding_function)
 chunk_collection = client.get_collection(CHUNK_COLLECTION_NAME, embedding_function=embedding_function)
+# 摘要向量索引在首次检索时加载快照
+summary_index = SummaryIndex(summary_collection) if SUMMARY_INDEX_ENABLED else None
 
 
-def hierarchical_retriever(query: str, n_docs=3, n_chunks=5) -> list[Document]:
+def hierarchical_retriever(query: str, n_docs=3, n_chunks=5, query_embedding=None) -> list[Document]:
     """
     执行分层检索。
     1. 在摘要集合中检索，找到最相关的文档。
     2. 在区块集合中，仅从这些相关文档里检索出具体的文本块。
+
+    两个步骤共用同一个查询向量；调用方可传入已计算好的 query_embedding 以避免重复嵌入。
     """
     print("--- 执行分层检索 ---")
+    if query_embedding is None:
+        query_embedding = embed_query_text(query)
     
     # 步骤1: 在摘要层检索，找到最相关的n_docs个文档
     print("--- 步骤1: 检索摘要层 ---")
-    summary_results = summary_collection.query(
-        query_texts=[query],
-        n_results=n_docs,
-    )
-    
-    if not summary_results or not summary_results.get('metadatas') or not summary_results['metadatas'][0]:
-        print("未在摘要层找到相关文档。")
-        return []
+    summary_hits = summary_index.search(query_embedding, n_docs) if summary_index is not None else None
+    if summary_hits is not None:
+        relevant_doc_sources = [source for source, _ in summary_hits]
+    else:
+        summary_results = summary_collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_docs,
+        )
+
+        if not summary_results or not summary_results.get('metadatas') or not summary_results['metadatas'][0]:
+            print("未在摘要层找到相关文档。")
+            return []
 
-    relevant_doc_sources = [meta['source'] for meta in summary_results['metadatas'][0]]
+        relevant_doc_sources = [meta['source'] for meta in summary_results['metadatas'][0]]
     if not relevant_doc_sources:
         print("未在摘要层找到相关文档源。")
         return []
@@ -59,7 +83,7 @@ def hierarchical_retriever(query: str, n_docs=3, n_chunks=5) -> list[Document]:
     }
     
     chunk_results = chunk_collection.query(
-        query_texts=[query],
+        query_embeddings=[query_embedding],
         n_results=n_chunks,
         where=where_filter
     )
@@ -77,26 +101,117 @@ def hierarchical_retriever(query: str, n_docs=3, n_chunks=5) -> list[Document]:
         
     return final_chunks
 
-def direct_chunk_retriever(query: str, n_chunks=5) -> list[Document]:
+def lexical_chunk_retriever(query: str, n_chunks=5) -> list[Document]:
+    """仅使用词法倒排索引（BM25）检索区块，适合批准文号、本位码等精确编码查询。"""
+    index = get_lexical_index()
+    hits = index.search(query, n_results=n_chunks)
+    documents = index.get_documents([doc_id for doc_id, _ in hits])
+    return [
+        Document(page_content=documents[doc_id][0], metadata=documents[doc_id][1])
+        for doc_id, _ in hits if doc_id in documents
+    ]
+
+def exact_match_retriever(query: str, n_chunks=5) -> list[Document]:
+    """
+    精确标识符检索（不经过嵌入模型）：
+    1. 用问题中的编码与完整问题查询元数据索引，命中时按区块ID从区块集合读取原文；
+    2. 问题本身是纯编码时，使用词法索引检索。
+    均未命中时返回空列表，由调用方继续执行向量检索。
+    """
+    if METADATA_INDEX_ENABLED:
+        hits = get_metadata_index().lookup(query, limit=n_chunks)
+        if hits:
+            chunk_ids = [chunk_id for chunk_id, _, _ in hits]
+            results = chunk_collection.get(ids=chunk_ids, include=["documents", "metadatas"])
+            found = {doc_id: (text, metadata) for doc_id, text, metadata in zip(results['ids'], results['documents'], results['metadatas'])}
+            documents = [Document(page_content=found[chunk_id][0], metadata=found[chunk_id][1]) for chunk_id in chunk_ids if chunk_id in found]
+            if documents:
+                print(f"--- 元数据索引精确命中 {len(documents)} 个区块 ({hits[0][1]}: {hits[0][2]}) ---")
+                return documents
+    if LEXICAL_INDEX_ENABLED and is_code_query(query):
+        documents = lexical_chunk_retriever(query, n_chunks=n_chunks)
+        if documents:
+            print(f"--- 纯编码查询，词法索引命中 {len(documents)} 个区块 ---")
+            return documents
+    return []
+
+def direct_chunk_retriever(query: str, n_chunks=5, query_embedding=None) -> list[Document]:
     """
     直接在区块集合中进行检索，用于表格型数据或需要高召回率的场景。
+    启用词法索引时，向量检索与BM25检索的结果按倒数排名融合；纯编码查询只使用词法检索。
     """
     print("--- 执行直接区块检索 ---")
+    lexical_hits = []
+    if LEXICAL_INDEX_ENABLED:
+        lexical_hits = get_lexical_index().search(query, n_results=max(n_chunks, LEXICAL_CANDIDATES))
+        if lexical_hits and is_code_query(query):
+            print("--- 纯编码查询，仅使用词法检索 ---")
+            return lexical_chunk_retriever(query, n_chunks=n_chunks)
+
+    if query_embedding is None:
+        query_embedding = embed_query_text(query)
     chunk_results = chunk_collection.query(
-        query_texts=[query],
+        query_embeddings=[query_embedding],
         n_results=n_chunks,
         # 可选：未来可以增加where过滤器，如 where={"data_type": "tabular"}
     )
 
-    if not chunk_results or not chunk_results.get('documents') or not chunk_results['documents'][0]:
+    dense_hits = {}
+    if chunk_results and chunk_results.get('documents') and chunk_results['documents'][0]:
+        for doc_id, doc_text, metadata in zip(chunk_results['ids'][0], chunk_results['documents'][0], chunk_results['metadatas'][0]):
+            dense_hits[doc_id] = (doc_text, metadata)
+    if not dense_hits and not lexical_hits:
         print("在区块中未找到匹配项。")
         return []
+    if not lexical_hits:
+        return [Document(page_content=text, metadata=metadata) for text, metadata in dense_hits.values()]
 
-    # 将检索结果格式化为LangChain的Document对象
+    # 融合两路排名，词法结果中向量检索未返回的区块从词法索引读取原文
+    fused_ids = reciprocal_rank_fusion([list(dense_hits), [doc_id for doc_id, _ in lexical_hits]])[:n_chunks]
+    lexical_documents = get_lexical_index().get_documents([doc_id for doc_id in fused_ids if doc_id not in dense_hits])
     final_chunks = []
-    for i, doc_text in enumerate(chunk_results['documents'][0]):
-        final_chunks.append(
-            Document(page_content=doc_text, metadata=chunk_results['metadatas'][0][i])
-        )
-        
+    for doc_id in fused_ids:
+        text, metadata = dense_hits.get(doc_id) or lexical_documents.get(doc_id, (None, None))
+        if text is not None:
+            final_chunks.append(Document(page_content=text, metadata=metadata))
+    print(f"--- 融合向量检索 {len(dense_hits)} 条与词法检索 {len(lexical_hits)} 条结果 ---")
     return final_chunks
+
+def tabular_sql_retriever(query: str) -> list[Document]:
+    """
+    表格SQL检索：由LLM根据表结构生成SQL，在表格列式存储的只读连接上执行，
+    把查询结果作为一个文档返回。无法查询或没有结果时返回空列表。
+    """
+    print("--- 执行表格SQL查询 ---")
+    if TABULAR_STORAGE_MODE != "duckdb" or not os.path.exists(TABULAR_DB_PATH):
+        print("未启用表格列式存储或表格数据库不存在。")
+        return []
+    try:
+        store = TabularStore(read_only=True)
+    except Exception as e:
+        print(f"无法打开表格数据库: {e}")
+        return []
+    try:
+        schema = store.describe()
+        if not schema:
+            print("表格数据库中没有数据表。")
+            return []
+        result = get_sql_generator_chain().invoke({"query": query, "schema": schema})
+        sql = (result.get("sql") or "").strip()
+        if not sql:
+            print("--- 问题无法通过表格数据回答 ---")
+            return []
+        print(f"--- 生成的SQL: {sql} ---")
+        columns, rows, truncated = store.query(sql)
+    except Exception as e:
+        print(f"表格SQL查询失败: {e}")
+        return []
+    finally:
+        store.close()
+    if not rows:
+        print("SQL查询没有返回结果。")
+        return []
+    return [Document(
+        page_content=format_query_result(sql, columns, rows, truncated),
+        metadata={"source": "tabular_sql", "sql": sql, "data_type": "sql_result"}
+    )]
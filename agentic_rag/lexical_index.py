@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 词法倒排索引（BM25）
+
+为区块建立持久化的倒排索引，补充稠密向量检索在精确实体/编码查询（药品名称、批准文号、本位码等）上的不足：
+- 分词：中文连续字符切分为字符二元组（bigram），字母数字串（编码、型号）整体作为一个词，统一小写。
+- 存储：SQLite，postings 表按 (词, 区块ID) 存储词频与区块长度，terms 表记录文档频率，
+  docs 表保存区块原文与元数据，因此单独使用词法检索时无需访问向量库。
+- 增量更新：ingest.py 写入区块时同步写入索引，删除旧文件的区块时同步删除。
+- 打分：BM25。文档频率过高的词（例如每一行都有的列名）在有其他查询词时被忽略，避免扫描过长的倒排表。
+
+对已有的向量库补建索引：
+    python -m agentic_rag.lexical_index rebuild
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+
+# 动态地将根目录加入sys.path，以便能导入项目内的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import LEXICAL_INDEX_PATH, BM25_K1, BM25_B, LEXICAL_MAX_DF_RATIO, RRF_K
+
+# 中日韩统一表意文字连续片段，或字母数字片段（允许中间包含 - 与 .，如 "ISO-9001"、"1.5"）
+TOKEN_PATTERN = re.compile(r"[一-鿿]+|[0-9A-Za-z]+(?:[-.][0-9A-Za-z]+)*")
+# 纯编码查询：不含中文与空白的字母数字串，且包含数字
+CODE_QUERY_PATTERN = re.compile(r"^(?=.*\d)[0-9A-Za-z]+(?:[-.][0-9A-Za-z]+)*$")
+SQLITE_MAX_VARIABLES = 500
+
+def tokenize(text: str) -> list:
+    """中文按字符二元组切分（单字片段保留单字），字母数字串整体保留。"""
+    tokens = []
+    for piece in TOKEN_PATTERN.findall(text or ""):
+        if '一' <= piece[0] <= '鿿':
+            if len(piece) == 1:
+                tokens.append(piece)
+            else:
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece.lower())
+    return tokens
+
+def is_code_query(query: str) -> bool:
+    """判断查询是否为纯编码（例如 'H20003263'、'86900123456789'），这类查询只需词法检索。"""
+    return bool(CODE_QUERY_PATTERN.match(query.strip()))
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """倒数排名融合：每个结果在各排名列表中得分 1/(k+名次) 之和，返回按融合得分降序排列的ID列表。"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class LexicalIndex:
+    """基于SQLite的BM25倒排索引。"""
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B, max_df_ratio=LEXICAL_MAX_DF_RATIO):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL, content TEXT NOT NULL, metadata TEXT);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, doc_length INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL NOT NULL);
+        """)
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def _meta(self, name):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _add_meta(self, name, delta):
+        self.conn.execute(
+            "INSERT INTO meta (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, delta)
+        )
+
+    def _delete_locked(self, ids):
+        """在已持有锁与事务的前提下删除区块，并更新文档频率与统计量。"""
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            batch = ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE doc_id IN ({placeholders})", batch).fetchone()
+            if not rows[0]:
+                continue
+            term_counts = self.conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE doc_id IN ({placeholders}) GROUP BY term", batch
+            ).fetchall()
+            self.conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(count, term) for term, count in term_counts])
+            self.conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            self.conn.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})", batch)
+            self._add_meta("doc_count", -rows[0])
+            self._add_meta("total_length", -rows[1])
+        self.conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def upsert(self, ids, documents, metadatas=None):
+        """写入（或替换）一批区块。"""
+        if not ids:
+            return
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(list(ids))
+                postings, term_df, total_length = [], Counter(), 0
+                doc_rows = []
+                for doc_id, text, metadata in zip(ids, documents, metadatas):
+                    counts = Counter(tokenize(text))
+                    length = sum(counts.values())
+                    total_length += length
+                    doc_rows.append((doc_id, length, text, json.dumps(metadata, ensure_ascii=False) if metadata else None))
+                    postings.extend((term, doc_id, tf, length) for term, tf in counts.items())
+                    term_df.update(counts.keys())
+                self.conn.executemany("INSERT INTO docs (doc_id, length, content, metadata) VALUES (?, ?, ?, ?)", doc_rows)
+                self.conn.executemany("INSERT INTO postings (term, doc_id, tf, doc_length) VALUES (?, ?, ?, ?)", postings)
+                self.conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                    term_df.items()
+                )
+                self._add_meta("doc_count", len(doc_rows))
+                self._add_meta("total_length", total_length)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def delete(self, ids):
+        """删除一批区块。"""
+        if not ids:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(list(ids))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def search(self, query: str, n_results=10):
+        """BM25检索，返回按得分降序排列的 [(区块ID, 得分), ...]。"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            doc_count = self._meta("doc_count")
+            if doc_count <= 0:
+                return []
+            avg_length = self._meta("total_length") / doc_count
+            placeholders = ",".join("?" * len(terms))
+            dfs = dict(self.conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", terms).fetchall())
+            if not dfs:
+                return []
+            # 忽略过于常见的词（除非所有命中的词都很常见），只扫描有区分度的倒排表
+            selective = [term for term in dfs if dfs[term] <= self.max_df_ratio * doc_count]
+            scores = Counter()
+            for term in selective or list(dfs):
+                df = dfs[term]
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                for doc_id, tf, doc_length in self.conn.execute(
+                    "SELECT doc_id, tf, doc_length FROM postings WHERE term = ?", (term,)
+                ):
+                    norm = self.k1 * (1 - self.b + self.b * doc_length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(n_results)
+
+    def get_documents(self, ids):
+        """按ID读取区块原文与元数据，返回 {区块ID: (内容, 元数据)}。"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                batch = list(ids[start:start + SQLITE_MAX_VARIABLES])
+                placeholders = ",".join("?" * len(batch))
+                for doc_id, content, metadata in self.conn.execute(
+                    f"SELECT doc_id, content, metadata FROM docs WHERE doc_id IN ({placeholders})", batch
+                ):
+                    found[doc_id] = (content, json.loads(metadata) if metadata else {})
+        return found
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._meta("doc_count"))
+
+    def close(self):
+        self.conn.close()
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+def get_lexical_index() -> LexicalIndex:
+    """获取进程内共享的词法索引。"""
+    global _lexical_index
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            _lexical_index = LexicalIndex()
+    return _lexical_index
+
+# --- 从向量库补建索引 ---
+
+def rebuild_from_collection(chunk_collection, index: LexicalIndex, batch_size=5000):
+    """从区块集合中分批读取全部区块并写入词法索引。"""
+    total = chunk_collection.count()
+    for offset in range(0, total, batch_size):
+        batch = chunk_collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        index.upsert(batch["ids"], batch["documents"], batch["metadatas"])
+        print(f"已索引 {min(offset + batch_size, total)}/{total} 个区块")
+
+def main():
+    parser = argparse.ArgumentParser(description="词法倒排索引工具。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="从向量库的区块集合重建词法索引。")
+    search_parser = subparsers.add_parser("search", help="使用词法索引检索。")
+    search_parser.add_argument("query", type=str)
+    search_parser.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        import chromadb
+        from ingest import PERSIST_PATH, CHUNK_COLLECTION_NAME
+
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(LEXICAL_INDEX_PATH + suffix):
+                os.remove(LEXICAL_INDEX_PATH + suffix)
+        client = chromadb.PersistentClient(path=PERSIST_PATH)
+        rebuild_from_collection(client.get_collection(CHUNK_COLLECTION_NAME), LexicalIndex())
+    else:
+        index = LexicalIndex()
+        start = time.perf_counter()
+        results = index.search(args.query, n_results=args.n)
+        elapsed = (time.perf_counter() - start) * 1000
+        documents = index.get_documents([doc_id for doc_id, _ in results])
+        for doc_id, score in results:
+            print(f"[{score:.3f}] {doc_id}: {documents[doc_id][0][:80]!r}")
+        print(f"检索耗时: {elapsed:.3f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: LLM调用缓存模块
+
+持久化的精确匹配LLM缓存（实现 LangChain 的 BaseCache 接口），挂在 chains.py 中各条链使用的 llm 上。
+系统中的链都以 temperature=0 调用，相同输入的输出可以直接复用：
+- 缓存键为 (模型参数哈希, 提示词哈希)。模型参数包括模型名称、温度等；提示词为渲染后的完整消息列表，
+  任一提示词模板、变量或模型变化都会产生新的键。
+- 存储在SQLite中（WAL模式），按条目数限制大小，超出时按最近访问时间淘汰（LRU）。
+- 同时支持同步与异步调用（异步调用在线程中访问SQLite，不阻塞事件循环）。
+"""
+
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from config import LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES
+
+# 每写入多少条检查一次是否需要淘汰，避免每次写入都执行 COUNT(*)
+EVICT_CHECK_INTERVAL = 100
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class SQLiteLLMCache(BaseCache):
+    """基于SQLite的LLM精确匹配缓存。"""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                llm_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                generations TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL,
+                PRIMARY KEY (llm_hash, prompt_hash)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed_at)")
+        self.conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str):
+        """查询缓存，命中时返回生成结果列表并刷新访问时间，未命中返回None。"""
+        key = (_hash(llm_string), _hash(prompt))
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT generations FROM llm_cache WHERE llm_hash = ? AND prompt_hash = ?", key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE llm_cache SET last_accessed_at = ? WHERE llm_hash = ? AND prompt_hash = ?", (time.time(), *key)
+            )
+            self.conn.commit()
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        """写入一次调用的生成结果。"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (llm_hash, prompt_hash, generations, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (_hash(llm_string), _hash(prompt), dumps(return_val), now, now)
+            )
+            self.conn.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= EVICT_CHECK_INTERVAL:
+                self._writes_since_evict = 0
+                self._evict()
+
+    def _evict(self):
+        """条目数超过上限时，删除最久未被访问的条目。"""
+        if self.max_entries <= 0:
+            return
+        count = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        self.conn.execute(
+            "DELETE FROM llm_cache WHERE rowid IN (SELECT rowid FROM llm_cache ORDER BY last_accessed_at ASC LIMIT ?)",
+            (overflow,)
+        )
+        self.conn.commit()
+        self.evictions += overflow
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+
+    async def alookup(self, prompt: str, llm_string: str):
+        return await asyncio.to_thread(self.lookup, prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val):
+        await asyncio.to_thread(self.update, prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs):
+        await asyncio.to_thread(self.clear)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 本地嵌入模型后端
+
+针对CPU推理优化的 SentenceTransformers 嵌入函数（实现 ChromaDB 的嵌入函数接口）：
+- 按token长度分桶组批：输入先按长度排序，每批的 (条数 x 最长长度) 不超过token预算，减少padding浪费。
+- 可显式设置批大小、推理线程数和最大序列长度。
+- 可选后端：全精度 torch、PyTorch动态量化 int8、ONNX Runtime。
+- 统计吞吐量（texts/sec、tokens/sec），便于比较不同后端。
+
+也可以直接运行本模块，对各后端进行吞吐量对比：
+    python -m agentic_rag.local_embedding --backends torch int8 onnx
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from chromadb.api.types import EmbeddingFunction
+
+# 动态地将根目录加入sys.path，以便能导入项目内的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    LOCAL_EMBEDDING_MODEL_PATH, LOCAL_EMBEDDING_BACKEND, LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_BATCH_TOKENS, LOCAL_EMBEDDING_NUM_THREADS, LOCAL_EMBEDDING_MAX_SEQ_LENGTH
+)
+
+SUPPORTED_BACKENDS = ('torch', 'int8', 'onnx')
+
+class LocalEmbeddingFunction(EmbeddingFunction):
+    """基于 SentenceTransformers 的本地嵌入函数，支持长度分桶组批与多种推理后端。"""
+
+    def __init__(self, model_path=LOCAL_EMBEDDING_MODEL_PATH, device=None, backend=LOCAL_EMBEDDING_BACKEND,
+                 batch_size=LOCAL_EMBEDDING_BATCH_SIZE, batch_tokens=LOCAL_EMBEDDING_BATCH_TOKENS,
+                 num_threads=LOCAL_EMBEDDING_NUM_THREADS, max_seq_length=LOCAL_EMBEDDING_MAX_SEQ_LENGTH):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"未知的本地嵌入后端: {backend}。请选择 {SUPPORTED_BACKENDS} 之一。")
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if backend == 'int8' and device != 'cpu':
+            print("警告: int8 动态量化仅支持CPU，将使用CPU运行。")
+            device = 'cpu'
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+
+        self.model_path = model_path
+        self.device = device
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        if backend == 'onnx':
+            self.model = SentenceTransformer(model_path, device=device, backend='onnx')
+        else:
+            self.model = SentenceTransformer(model_path, device=device)
+        if backend == 'int8':
+            # 对全部线性层做动态量化：权重以int8存储，激活在推理时动态量化
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.max_seq_length = self.model.max_seq_length
+
+        self.total_texts = 0
+        self.total_tokens = 0
+        self.total_seconds = 0.0
+
+    @property
+    def model_id(self) -> str:
+        """用于区分缓存的模型标识：不同后端或最大长度会产生不同的向量。"""
+        return f"local:{self.model_path}:{self.backend}:{self.max_seq_length}"
+
+    def _token_lengths(self, texts):
+        encoded = self.model.tokenizer(list(texts), add_special_tokens=True, truncation=True, max_length=self.max_seq_length)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def _length_bucketed_batches(self, lengths):
+        """按长度排序后组批，每批满足条数上限与token预算，返回索引批次列表。"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches, current, current_max = [], [], 0
+        for i in order:
+            longest = max(current_max, lengths[i])
+            if current and (len(current) >= self.batch_size or longest * (len(current) + 1) > self.batch_tokens):
+                batches.append(current)
+                current, longest = [], lengths[i]
+            current.append(i)
+            current_max = longest
+        if current:
+            batches.append(current)
+        return batches
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+        start = time.perf_counter()
+        lengths = self._token_lengths(texts)
+        embeddings = [None] * len(texts)
+        for batch in self._length_bucketed_batches(lengths):
+            vectors = self.model.encode([texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector
+        self.total_seconds += time.perf_counter() - start
+        self.total_texts += len(texts)
+        self.total_tokens += sum(lengths)
+        return embeddings
+
+    def throughput(self) -> dict:
+        """返回累计吞吐量统计。"""
+        seconds = self.total_seconds or float('inf')
+        return {
+            "backend": self.backend,
+            "texts": self.total_texts,
+            "tokens": self.total_tokens,
+            "seconds": self.total_seconds,
+            "texts_per_sec": self.total_texts / seconds,
+            "tokens_per_sec": self.total_tokens / seconds,
+        }
+
+# --- 后端吞吐量对比 ---
+def benchmark(backends, texts, repeats=1):
+    """依次加载各后端并嵌入同一组文本，打印吞吐量。"""
+    for backend in backends:
+        try:
+            embedding_function = LocalEmbeddingFunction(backend=backend, device='cpu')
+        except Exception as e:
+            print(f"后端 {backend} 加载失败，跳过: {e}")
+            continue
+        embedding_function(texts[:8])  # 预热
+        embedding_function.total_texts = embedding_function.total_tokens = 0
+        embedding_function.total_seconds = 0.0
+        for _ in range(repeats):
+            embedding_function(texts)
+        stats = embedding_function.throughput()
+        print(f"[{backend:5s}] {stats['texts_per_sec']:8.1f} texts/sec, {stats['tokens_per_sec']:10.1f} tokens/sec "
+              f"({stats['texts']} 条, {stats['seconds']:.2f} 秒)")
+
+def main():
+    parser = argparse.ArgumentParser(description="对比本地嵌入模型各后端的CPU吞吐量。")
+    parser.add_argument("--backends", nargs="+", choices=SUPPORTED_BACKENDS, default=list(SUPPORTED_BACKENDS), help="要测试的后端。")
+    parser.add_argument("--file", type=str, default=None, help="测试文本文件，每行一条；不指定时使用内置的合成文本。")
+    parser.add_argument("-n", "--num_texts", type=int, default=256, help="使用合成文本时的条数。")
+    parser.add_argument("--repeats", type=int, default=1, help="重复次数。")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        base = "药品名称: 阿莫西林胶囊\n生产企业: 某某制药有限公司\n批准文号: 国药准字H12345678\n"
+        # 合成长短不一的文本，模拟表格行与长文档区块混合的场景
+        texts = [base * (1 + i % 8) for i in range(args.num_texts)]
+    benchmark(args.backends, texts, args.repeats)
+
+if __name__ == '__main__':
+    main()
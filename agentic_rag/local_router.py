@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 本地快速路由
+
+用已加载的嵌入模型对问题做最近质心分类，替代大部分LLM路由调用：
+- 每个路由策略一个质心（训练样本归一化向量的均值），以余弦相似度的 softmax 作为置信度。
+- 置信度不低于阈值时直接采用本地结果；否则交给LLM路由链，并把LLM的决策写入决策日志。
+- 训练数据来自 evaluation/golden_dataset.csv 与决策日志中LLM做出的路由，刷新模型只需重新训练：
+    python -m agentic_rag.local_router train
+- 查看跳过LLM的比例：
+    python -m agentic_rag.local_router stats
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+# 动态地将根目录加入sys.path，以便能导入项目内的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    LOCAL_ROUTER_MODEL_PATH, LOCAL_ROUTER_CONFIDENCE_THRESHOLD, LOCAL_ROUTER_TEMPERATURE, ROUTER_DECISION_LOG_PATH
+)
+
+ROUTES = ('direct_chunk_search', 'hierarchical_search', 'tabular_sql', 'web_search', 'direct')
+GOLDEN_DATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "evaluation", "golden_dataset.csv")
+# 评估集中的旧路由名称到当前路由策略的映射
+GOLDEN_ROUTE_MAP = {"vectorstore": "hierarchical_search"}
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def current_model_id() -> str:
+    """当前嵌入模型的标识，用于检查路由模型是否与之匹配。"""
+    from agentic_rag.chains import get_embedding_function
+    from config import EMBEDDING_PROVIDER
+    return getattr(get_embedding_function(), "model_id", EMBEDDING_PROVIDER)
+
+class LocalRouter:
+    """最近质心路由模型。模型文件被重新训练后会在下一次预测时自动重新加载。"""
+
+    def __init__(self, model_path=LOCAL_ROUTER_MODEL_PATH, threshold=LOCAL_ROUTER_CONFIDENCE_THRESHOLD,
+                 temperature=LOCAL_ROUTER_TEMPERATURE):
+        self.model_path = model_path
+        self.threshold = threshold
+        self.temperature = temperature
+        self.labels = None
+        self.centroids = None
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        self.local_decisions = 0
+        self.llm_decisions = 0
+
+    def _maybe_reload(self):
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            self.labels = self.centroids = None
+            return
+        if mtime == self._loaded_mtime:
+            return
+        with np.load(self.model_path, allow_pickle=False) as data:
+            model_id = str(data["model_id"])
+            labels, centroids = [str(label) for label in data["labels"]], data["centroids"]
+        self._loaded_mtime = mtime
+        if model_id != current_model_id():
+            print(f"警告: 本地路由模型基于嵌入模型 '{model_id}' 训练，与当前模型不一致，已停用。请重新训练。")
+            self.labels = self.centroids = None
+            return
+        self.labels, self.centroids = labels, centroids
+        print(f"--- 已加载本地路由模型 ({len(labels)} 个类别) ---")
+
+    def predict(self, query_embedding):
+        """返回 (路由, 置信度)；没有可用模型时返回 (None, 0.0)。"""
+        with self._lock:
+            self._maybe_reload()
+            if self.centroids is None:
+                return None, 0.0
+            similarities = self.centroids @ _normalize(query_embedding)
+            logits = (similarities - similarities.max()) / self.temperature
+            probabilities = np.exp(logits) / np.exp(logits).sum()
+            best = int(np.argmax(probabilities))
+            return self.labels[best], float(probabilities[best])
+
+    def record(self, source: str):
+        with self._lock:
+            if source == "local":
+                self.local_decisions += 1
+            else:
+                self.llm_decisions += 1
+
+    def stats(self) -> dict:
+        total = self.local_decisions + self.llm_decisions
+        return {
+            "local_decisions": self.local_decisions,
+            "llm_decisions": self.llm_decisions,
+            "skip_llm_rate": self.local_decisions / total if total else 0.0,
+        }
+
+_router = None
+
+def get_local_router() -> LocalRouter:
+    global _router
+    if _router is None:
+        _router = LocalRouter()
+    return _router
+
+def log_route_decision(query: str, route: str, source: str, confidence: float, log_path=ROUTER_DECISION_LOG_PATH):
+    """追加一条路由决策记录。source 为 'local' 或 'llm'，只有LLM的决策会被用作训练样本。"""
+    record = {"time": time.time(), "query": query, "route": route, "source": source, "confidence": round(confidence, 4)}
+    with open(log_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _read_decision_log(log_path):
+    if not os.path.exists(log_path):
+        return []
+    records = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+# --- 训练 ---
+
+def load_training_examples(golden_path=GOLDEN_DATASET_PATH, log_path=ROUTER_DECISION_LOG_PATH) -> dict:
+    """合并评估集与LLM决策日志，返回 {问题: 路由}。同一问题以日志中最新的LLM决策为准。"""
+    import pandas as pd
+
+    examples = {}
+    if os.path.exists(golden_path):
+        for _, row in pd.read_csv(golden_path).iterrows():
+            route = GOLDEN_ROUTE_MAP.get(row['ideal_route'], row['ideal_route'])
+            if route in ROUTES:
+                examples[row['question']] = route
+    for record in _read_decision_log(log_path):
+        if record.get("source") == "llm" and record.get("route") in ROUTES:
+            examples[record["query"]] = record["route"]
+    return examples
+
+def train(model_path=LOCAL_ROUTER_MODEL_PATH, golden_path=GOLDEN_DATASET_PATH, log_path=ROUTER_DECISION_LOG_PATH):
+    """训练并保存最近质心路由模型。"""
+    from agentic_rag.chains import embed_query_text
+
+    examples = load_training_examples(golden_path, log_path)
+    if not examples:
+        print("没有可用的训练样本。")
+        return
+    questions = list(examples)
+    embeddings = _normalize([embed_query_text(question) for question in questions])
+    routes = np.array([examples[question] for question in questions])
+
+    labels = [route for route in ROUTES if (routes == route).any()]
+    centroids = _normalize([embeddings[routes == label].mean(axis=0) for label in labels])
+
+    # 原子替换，正在运行的服务在下一次预测时加载新模型
+    tmp_path = model_path + ".tmp.npz"
+    np.savez(tmp_path, labels=np.array(labels), centroids=centroids, model_id=np.array(current_model_id()))
+    os.replace(tmp_path, model_path)
+
+    counts = ", ".join(f"{label}: {int((routes == label).sum())}" for label in labels)
+    print(f"--- 本地路由模型已保存到 '{model_path}' ({len(questions)} 条样本; {counts}) ---")
+
+    # 训练集上的准确率与达到置信度阈值的比例，便于调整阈值
+    router = LocalRouter(model_path=model_path)
+    predictions = [router.predict(embedding) for embedding in embeddings]
+    accuracy = np.mean([route == expected for (route, _), expected in zip(predictions, routes)])
+    confident = np.mean([confidence >= router.threshold for _, confidence in predictions])
+    print(f"训练集准确率: {accuracy:.1%}，置信度不低于阈值 {router.threshold} 的比例: {confident:.1%}")
+
+def report_stats(log_path=ROUTER_DECISION_LOG_PATH):
+    """根据决策日志统计跳过LLM的比例。"""
+    records = _read_decision_log(log_path)
+    if not records:
+        print("决策日志为空。")
+        return
+    local = sum(1 for record in records if record.get("source") == "local")
+    print(f"共 {len(records)} 次路由决策，本地路由 {local} 次，LLM路由 {len(records) - local} 次，"
+          f"跳过LLM的比例: {local / len(records):.1%}")
+    for route in ROUTES:
+        route_records = [record for record in records if record.get("route") == route]
+        if route_records:
+            route_local = sum(1 for record in route_records if record.get("source") == "local")
+            print(f"  {route:20s} {len(route_records):6d} 次，其中本地 {route_local} 次")
+
+def main():
+    parser = argparse.ArgumentParser(description="训练本地路由模型或查看路由统计。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="根据评估集与LLM决策日志训练（刷新）本地路由模型。")
+    train_parser.add_argument("--golden", type=str, default=GOLDEN_DATASET_PATH, help="带标注的评估集CSV。")
+    train_parser.add_argument("--log", type=str, default=ROUTER_DECISION_LOG_PATH, help="路由决策日志。")
+    train_parser.add_argument("--output", type=str, default=LOCAL_ROUTER_MODEL_PATH, help="模型文件路径。")
+    stats_parser = subparsers.add_parser("stats", help="统计跳过LLM路由的比例。")
+    stats_parser.add_argument("--log", type=str, default=ROUTER_DECISION_LOG_PATH, help="路由决策日志。")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train(model_path=args.output, golden_path=args.golden, log_path=args.log)
+    else:
+        report_stats(log_path=args.log)
+
+if __name__ == '__main__':
+    main()
@@ -6,58 +6,306 @@
 采用 SQLite + ChromaDB 的混合存储方案：
 - SQLite: 存储记忆的结构化文本和元数据。
 - ChromaDB: 存储记忆的向量嵌入，用于语义检索。
+
+所有操作都通过进程内唯一的 MemoryStore 对象完成：
+- ChromaDB 客户端与集合在进程内只创建一次。
+- SQLite 使用 WAL 模式：读连接来自一个小型连接池，读操作不会被写操作阻塞。
+- 所有写操作（SQLite 与 ChromaDB）都交给单一的写线程串行执行，避免并发会话触发 `database is locked`。
+- 检索命中记忆的访问时间在内存中合并，由写线程在空闲时（或下一次写操作前）批量写入，检索路径上没有写事务。
 """
 
 import os
+import queue
 import sqlite3
 import datetime
-import math
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+import numpy as np
 import chromadb
 
 # 动态地将根目录加入sys.path，以便能导入项目内的模块
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from agentic_rag.chains import get_embedding_function
+from agentic_rag.chains import get_embedding_function, embed_query_text
+from config import MEMORY_CANDIDATE_OVERSAMPLE, MEMORY_TOUCH_FLUSH_INTERVAL
 
 # --- 配置 ---
 DB_PATH = "long_term_memory.sqlite"
 PERSIST_PATH = "chroma_db"
 MEMORY_COLLECTION_NAME = "long_term_memory"
+# 读连接池大小
+READ_POOL_SIZE = 4
+# 等待SQLite锁的超时时间（秒）
+SQLITE_TIMEOUT = 30.0
 
-# --- 数据库初始化与连接 ---
+# --- SQL语句 ---
+# 使用固定的SQL文本，配合长期存活的连接，sqlite3 会复用已编译的语句（prepared statements）
+SQL_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS memories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        type TEXT NOT NULL DEFAULT 'fact',
+        importance INTEGER NOT NULL DEFAULT 5,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_accessed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+SQL_INSERT = "INSERT INTO memories (text, type, importance, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?)"
+SQL_SELECT_CANDIDATES = "SELECT id, text, type, importance, last_accessed_at FROM memories WHERE id IN ({placeholders})"
+SQL_DELETE_BY_ID = "DELETE FROM memories WHERE id = ?"
+SQL_SELECT_RECENT = "SELECT * FROM memories ORDER BY created_at DESC LIMIT ?"
+SQL_TOUCH = "UPDATE memories SET last_accessed_at = ? WHERE id = ?"
 
-def get_db_connection():
-    """获取SQLite数据库连接。"""
-    conn = sqlite3.connect(DB_PATH)
+# --- 评分 ---
+
+def hybrid_scores(distances, importances, last_accessed, now) -> np.ndarray:
+    """
+    向量化计算候选记忆的混合得分：语义分 x (1 + 0.1 x 重要性) x (1 + 0.5 x 新近度分)。
+
+    Args:
+        distances: Chroma返回的L2距离。
+        importances: 重要性评分（1-10）。
+        last_accessed: 最近访问时间（ISO格式字符串或datetime）。
+        now (datetime.datetime): 当前时间。
+    """
+    # a. 语义分 (Chroma的distance是L2距离，转换为0-1的相似度)
+    semantic_scores = 1.0 / (1.0 + np.asarray(distances, dtype=np.float64))
+    # b. 重要性分
+    importance_scores = np.asarray(importances, dtype=np.float64)
+    # c. 热度（新近度）分
+    last_accessed = np.array(last_accessed, dtype='datetime64[us]')
+    hours_since_accessed = np.maximum((np.datetime64(now, 'us') - last_accessed) / np.timedelta64(1, 'h'), 0.0)
+    recency_scores = 1.0 / (1.0 + np.log1p(hours_since_accessed))
+    # d. 最终加权得分
+    # 权重可以根据经验调整
+    return semantic_scores * (1 + 0.1 * importance_scores) * (1 + 0.5 * recency_scores)
+
+# --- 数据库连接 ---
+
+def _connect(db_path):
+    """创建一个配置好的SQLite连接（WAL模式，允许跨线程使用）。"""
+    conn = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL模式下 NORMAL 同步级别依然保证数据库一致性，且不必在每次提交时fsync
+    conn.execute("PRAGMA synchronous=NORMAL")
     return conn
 
+class MemoryStore:
+    """
+    长期记忆存储。进程内通过 get_memory_store() 获取唯一实例。
+    """
+
+    def __init__(self, db_path=DB_PATH, persist_path=PERSIST_PATH, read_pool_size=READ_POOL_SIZE, collection=None,
+                 touch_flush_interval=MEMORY_TOUCH_FLUSH_INTERVAL):
+        """
+        Args:
+            collection: 可选，直接使用给定的ChromaDB集合（例如基准测试中使用预先写入向量的集合）。
+            touch_flush_interval (float): 写线程空闲多少秒后写入合并的访问时间。
+        """
+        self.db_path = db_path
+        self.persist_path = persist_path
+        self._read_pool = queue.Queue()
+        for _ in range(read_pool_size):
+            self._read_pool.put(_connect(db_path))
+        self._write_conn = _connect(db_path)
+        self._write_queue = queue.Queue()
+        self.touch_flush_interval = touch_flush_interval
+        # 待写入的访问时间 {记忆ID: 时间}，同一记忆只保留最新一次
+        self._pending_touches = {}
+        self._touch_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._writer_loop, name="memory-writer", daemon=True)
+        self._writer.start()
+        self._client = None
+        self._collection = collection
+        self._collection_lock = threading.Lock()
+
+    # --- 连接与集合 ---
+
+    @contextmanager
+    def read_connection(self):
+        """从连接池借出一个只用于读取的连接。"""
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
+    @property
+    def collection(self):
+        """进程内共享的ChromaDB记忆集合（首次访问时创建）。"""
+        if self._collection is None:
+            with self._collection_lock:
+                if self._collection is None:
+                    self._client = chromadb.PersistentClient(path=self.persist_path)
+                    self._collection = self._client.get_or_create_collection(
+                        name=MEMORY_COLLECTION_NAME, embedding_function=get_embedding_function()
+                    )
+        return self._collection
+
+    # --- 单一写线程 ---
+
+    def _writer_loop(self):
+        while True:
+            try:
+                func, future = self._write_queue.get(timeout=self.touch_flush_interval)
+            except queue.Empty:
+                self._write_touches()
+                continue
+            # 先写入合并的访问时间，使后续写操作（例如删除）看到一致的数据
+            self._write_touches()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(self._write_conn))
+            except Exception as e:
+                self._write_conn.rollback()
+                future.set_exception(e)
+
+    def _write_touches(self):
+        """在写线程中把合并的访问时间一次性写入。"""
+        with self._touch_lock:
+            touches, self._pending_touches = self._pending_touches, {}
+        if not touches:
+            return
+        try:
+            self._write_conn.executemany(SQL_TOUCH, [(str(accessed), memory_id) for memory_id, accessed in touches.items()])
+            self._write_conn.commit()
+        except Exception as e:
+            self._write_conn.rollback()
+            print(f"更新记忆访问时间失败: {e}")
+
+    def touch(self, memory_ids, accessed_at):
+        """记录记忆被访问，访问时间由写线程稍后批量写入。"""
+        with self._touch_lock:
+            for memory_id in memory_ids:
+                self._pending_touches[memory_id] = accessed_at
+
+    def flush_touches(self):
+        """立即写入合并的访问时间并等待完成。"""
+        self.submit_write(lambda conn: None).result()
+
+    def submit_write(self, func) -> Future:
+        """
+        将写操作提交给写线程串行执行，返回Future。
+        func 接收写连接作为参数；需要结果的调用方等待 Future，不需要的（例如更新访问时间）可以直接返回。
+        """
+        future = Future()
+        self._write_queue.put((func, future))
+        return future
+
+    # --- 核心功能：增、删、查、改 ---
+
+    def initialize(self):
+        """初始化记忆库，如果不存在则创建表和集合。"""
+        def create_table(conn):
+            conn.execute(SQL_CREATE_TABLE)
+            conn.commit()
+        self.submit_write(create_table).result()
+        print(f"SQLite数据库 '{self.db_path}' 已确保存在。")
+        _ = self.collection
+        print(f"ChromaDB集合 '{MEMORY_COLLECTION_NAME}' 已确保存在。")
+
+    def add(self, text: str, type: str = 'fact', importance: int = 5) -> int:
+        """添加一条新的记忆，返回记忆ID。"""
+        def insert(conn):
+            now = str(datetime.datetime.now())
+            cursor = conn.execute(SQL_INSERT, (text, type, importance, now, now))
+            memory_id = cursor.lastrowid
+            conn.commit()
+            # 将向量存入ChromaDB（同样在写线程中执行，保证两个存储的写入顺序一致）
+            self.collection.add(
+                ids=[str(memory_id)],
+                documents=[text],
+                metadatas=[{"type": type, "importance": importance, "sqlite_id": memory_id}]
+            )
+            return memory_id
+        return self.submit_write(insert).result()
+
+    def retrieve(self, query_text: str, top_k: int = 3, query_embedding=None, oversample: int = MEMORY_CANDIDATE_OVERSAMPLE) -> list[dict]:
+        """
+        根据查询，使用混合加权算法检索最相关的记忆。
+        候选记忆的元数据通过一次 IN (...) 查询批量取回，混合得分以NumPy向量化计算，
+        检索开销只与候选数量有关，而与记忆表的总行数无关。
+        """
+        if query_embedding is None:
+            query_embedding = embed_query_text(query_text)
+
+        # 1. 语义检索 (获取比top_k更多的候选，以便重排)
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=top_k * oversample,
+        )
+
+        if not results or not results.get('ids') or not results['ids'][0]:
+            return []
+
+        # 2. 一次性取回全部候选的结构化信息
+        distances = dict(zip((int(id_str) for id_str in results['ids'][0]), results['distances'][0]))
+        ids = list(distances)
+        with self.read_connection() as conn:
+            rows = conn.execute(SQL_SELECT_CANDIDATES.format(placeholders=",".join("?" * len(ids))), ids).fetchall()
+        if not rows:
+            return []
+
+        # 3. 向量化的混合评分与重排序
+        now = datetime.datetime.now()
+        final_scores = hybrid_scores(
+            [distances[row['id']] for row in rows], [row['importance'] for row in rows],
+            [row['last_accessed_at'] for row in rows], now
+        )
+
+        # 按最终得分降序取top_k
+        order = np.argsort(-final_scores, kind='stable')[:top_k]
+        top_memories = [
+            {"id": rows[i]['id'], "text": rows[i]['text'], "type": rows[i]['type'], "score": float(final_scores[i])}
+            for i in order
+        ]
+
+        # 4. 更新被访问记忆的时间戳（在内存中合并，由写线程空闲时批量写入，检索无需等待也不产生写事务）
+        self.touch([mem['id'] for mem in top_memories], now)
+
+        return top_memories
+
+    def delete(self, memory_id: int) -> bool:
+        """根据ID删除一条记忆，返回SQLite中是否存在该记忆。"""
+        def delete(conn):
+            cursor = conn.execute(SQL_DELETE_BY_ID, (memory_id,))
+            conn.commit()
+            self.collection.delete(ids=[str(memory_id)])
+            return cursor.rowcount > 0
+        return self.submit_write(delete).result()
+
+    def view(self, limit: int = 10) -> list[dict]:
+        """查看最近的N条记忆。"""
+        with self.read_connection() as conn:
+            rows = conn.execute(SQL_SELECT_RECENT, (limit,)).fetchall()
+            return [dict(row) for row in rows]
+
+_memory_store = None
+_memory_store_lock = threading.Lock()
+
+def get_memory_store() -> MemoryStore:
+    """获取进程内唯一的记忆存储实例。"""
+    global _memory_store
+    if _memory_store is None:
+        with _memory_store_lock:
+            if _memory_store is None:
+                _memory_store = MemoryStore()
+    return _memory_store
+
+# --- 数据库初始化与连接 ---
+
+def get_db_connection():
+    """获取SQLite数据库连接（WAL模式）。仅用于临时的维护操作，常规读写请使用 get_memory_store()。"""
+    return _connect(DB_PATH)
+
 def initialize_memory_db():
     """初始化记忆库，如果不存在则创建表和集合。"""
     print("--- 初始化长期记忆库 ---")
-    # 1. 初始化SQLite数据库
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS memories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                text TEXT NOT NULL,
-                type TEXT NOT NULL DEFAULT 'fact',
-                importance INTEGER NOT NULL DEFAULT 5,
-                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                last_accessed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        print(f"SQLite数据库 '{DB_PATH}' 已确保存在。")
-
-    # 2. 初始化ChromaDB集合
-    client = chromadb.PersistentClient(path=PERSIST_PATH)
-    # 在创建时就指定嵌入函数
-    collection_embedding_function = get_embedding_function()
-    client.get_or_create_collection(name=MEMORY_COLLECTION_NAME, embedding_function=collection_embedding_function)
-    print(f"ChromaDB集合 '{MEMORY_COLLECTION_NAME}' 已确保存在。")
+    get_memory_store().initialize()
     print("--- 长期记忆库初始化完成 ---")
 
 # --- 核心功能：增、删、查、改 ---
@@ -65,111 +313,31 @@ def initialize_memory_db():
 def add_memory(text: str, type: str = 'fact', importance: int = 5):
     """添加一条新的记忆。"""
     print(f"--- 添加新记忆 (类型: {type}, 重要性: {importance}) ---")
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        now = datetime.datetime.now()
-        cursor.execute(
-            "INSERT INTO memories (text, type, importance, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?)",
-            (text, type, importance, now, now)
-        )
-        memory_id = cursor.lastrowid
-        conn.commit()
-
-    # 将向量存入ChromaDB
-    client = chromadb.PersistentClient(path=PERSIST_PATH)
-    collection = client.get_collection(name=MEMORY_COLLECTION_NAME)
-    collection.add(
-        ids=[str(memory_id)],
-        documents=[text],
-        metadatas=[{"type": type, "importance": importance, "sqlite_id": memory_id}]
-    )
+    memory_id = get_memory_store().add(text, type, importance)
     print(f"记忆已存入，ID: {memory_id}")
 
-def retrieve_memories(query_text: str, top_k: int = 3) -> list[dict]:
-    """根据查询，使用混合加权算法检索最相关的记忆。"""
+def retrieve_memories(query_text: str, top_k: int = 3, query_embedding=None) -> list[dict]:
+    """
+    根据查询，使用混合加权算法检索最相关的记忆。
+    可传入已计算好的 query_embedding，与后续的文档检索共用同一个查询向量。
+    """
     print(f"--- 检索与 '{query_text[:20]}...' 相关的长期记忆 ---")
-    client = chromadb.PersistentClient(path=PERSIST_PATH)
-    collection = client.get_collection(name=MEMORY_COLLECTION_NAME)
-
-    # 1. 语义检索 (获取比top_k更多的候选，以便重排)
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=top_k * 3, 
-    )
-
-    if not results or not results.get('ids') or not results['ids'][0]:
-        return []
-
-    # 2. 混合评分与重排序
-    ranked_memories = []
-    now = datetime.datetime.now()
-    with get_db_connection() as conn:
-        for id_str, distance, meta in zip(results['ids'][0], results['distances'][0], results['metadatas'][0]):
-            cursor = conn.cursor()
-            res = cursor.execute("SELECT * FROM memories WHERE id = ?", (int(id_str),)).fetchone()
-            if not res:
-                continue
-
-            # a. 语义分 (Chroma的distance是L2距离，转换为0-1的相似度)
-            semantic_score = 1.0 / (1.0 + distance)
-
-            # b. 重要性分
-            importance_score = res['importance']
-
-            # c. 热度（新近度）分
-            last_accessed = datetime.datetime.fromisoformat(res['last_accessed_at'])
-            hours_since_accessed = (now - last_accessed).total_seconds() / 3600
-            recency_score = 1.0 / (1.0 + math.log1p(hours_since_accessed))
-
-            # d. 最终加权得分
-            # 权重可以根据经验调整
-            final_score = semantic_score * (1 + 0.1 * importance_score) * (1 + 0.5 * recency_score)
-            
-            ranked_memories.append({
-                "id": res['id'],
-                "text": res['text'],
-                "type": res['type'],
-                "score": final_score
-            })
-
-    # 按最终得分降序排序
-    ranked_memories.sort(key=lambda x: x['score'], reverse=True)
-
-    # 3. 更新被访问记忆的时间戳并返回top_k
-    top_memories = ranked_memories[:top_k]
-    retrieved_ids = [mem['id'] for mem in top_memories]
-    if retrieved_ids:
-        print(f"检索到的Top-{len(retrieved_ids)} 记忆ID: {retrieved_ids}")
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE memories SET last_accessed_at = ? WHERE id IN ({','.join('?'*len(retrieved_ids))})", (now, *retrieved_ids))
-        conn.commit()
-
+    top_memories = get_memory_store().retrieve(query_text, top_k, query_embedding)
+    if top_memories:
+        print(f"检索到的Top-{len(top_memories)} 记忆ID: {[mem['id'] for mem in top_memories]}")
     return top_memories
 
 def delete_memory(memory_id: int):
     """根据ID删除一条记忆。"""
     print(f"--- 删除记忆 ID: {memory_id} ---")
-    # 从SQLite删除
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
-        conn.commit()
-        if cursor.rowcount == 0:
-            print(f"警告：在SQLite中未找到ID为 {memory_id} 的记忆。")
-
-    # 从ChromaDB删除
-    client = chromadb.PersistentClient(path=PERSIST_PATH)
-    collection = client.get_collection(name=MEMORY_COLLECTION_NAME)
-    collection.delete(ids=[str(memory_id)])
+    if not get_memory_store().delete(memory_id):
+        print(f"警告：在SQLite中未找到ID为 {memory_id} 的记忆。")
     print("记忆已从数据库中删除。")
 
 def view_memories(limit: int = 10):
     """查看最近的N条记忆。"""
     print(f"--- 查看最近的 {limit} 条记忆 ---")
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        rows = cursor.execute("SELECT * FROM memories ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
-        return [dict(row) for row in rows]
+    return get_memory_store().view(limit)
 
 # --- 首次运行时可以执行初始化 ---
 if __name__ == '__main__':
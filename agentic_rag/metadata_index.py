@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 精确元数据索引
+
+把表格行区块元数据中的 EXCEL_METADATA_COLUMNS（药品名称、生产企业、批准文号、药品编码、本位码）
+连同区块ID写入带索引的SQLite表，为精确标识符查询提供不经过嵌入模型的快速通道：
+- 键：每个单元格的完整值，以及值中的编码片段（例如 "国药准字H20003263" 同时以 "H20003263" 为键），
+  统一去除空白并转为大写。
+- 查询：从问题中识别编码样式的片段（含数字的长字母数字串，如批准文号、本位码），连同完整问题一起查表，
+  命中时直接返回对应区块，跳过向量检索。
+- 增量更新：ingest.py 写入区块时同步写入，删除旧文件的区块时同步删除。
+
+对已有的向量库补建索引：
+    python -m agentic_rag.metadata_index rebuild
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+# 动态地将根目录加入sys.path，以便能导入项目内的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EXCEL_METADATA_COLUMNS, METADATA_INDEX_PATH
+
+ALNUM_PATTERN = re.compile(r"[0-9A-Za-z]+(?:[-.][0-9A-Za-z]+)*")
+# 编码片段的最小长度，避免把剂量、年份等短数字当作标识符
+MIN_CODE_LENGTH = 6
+SQLITE_MAX_VARIABLES = 500
+
+def normalize_key(value) -> str:
+    """去除空白并转为大写。"""
+    return re.sub(r"\s+", "", str(value)).upper()
+
+def extract_codes(text: str) -> list:
+    """提取文本中编码样式的片段：包含数字、长度不少于 MIN_CODE_LENGTH 的字母数字串。"""
+    return [
+        token.upper() for token in ALNUM_PATTERN.findall(text or "")
+        if len(token) >= MIN_CODE_LENGTH and any(ch.isdigit() for ch in token)
+    ]
+
+def metadata_keys(value) -> set:
+    """单元格值对应的全部查找键。"""
+    key = normalize_key(value)
+    if not key:
+        return set()
+    return {key, *extract_codes(key)}
+
+class MetadataIndex:
+    """基于SQLite的 (查找键 -> 区块ID) 精确匹配索引。"""
+
+    def __init__(self, path=METADATA_INDEX_PATH, columns=EXCEL_METADATA_COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata_index (
+                lookup_key TEXT NOT NULL, column_name TEXT NOT NULL, value TEXT NOT NULL, chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_metadata_index_key ON metadata_index (lookup_key);
+            CREATE INDEX IF NOT EXISTS idx_metadata_index_chunk ON metadata_index (chunk_id);
+        """)
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def _delete_locked(self, ids):
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            batch = ids[start:start + SQLITE_MAX_VARIABLES]
+            self.conn.execute(f"DELETE FROM metadata_index WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+
+    def upsert(self, ids, metadatas):
+        """写入（或替换）一批区块的元数据；不含任何索引列的区块只会被删除旧记录。"""
+        if not ids:
+            return
+        rows = []
+        for chunk_id, metadata in zip(ids, metadatas):
+            for column in self.columns:
+                value = (metadata or {}).get(column)
+                if value is None:
+                    continue
+                rows.extend((key, column, str(value), chunk_id) for key in metadata_keys(value))
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(list(ids))
+                self.conn.executemany(
+                    "INSERT INTO metadata_index (lookup_key, column_name, value, chunk_id) VALUES (?, ?, ?, ?)", rows
+                )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def delete(self, ids):
+        """删除一批区块的元数据。"""
+        if not ids:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(list(ids))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def lookup(self, query: str, limit=10) -> list:
+        """
+        用问题中的编码片段与完整问题查表。
+        返回 [(区块ID, 列名, 值), ...]，编码片段的命中排在前面，同一区块只出现一次。
+        """
+        keys = list(dict.fromkeys(extract_codes(query) + [normalize_key(query)]))
+        keys = [key for key in keys if key]
+        if not keys:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT lookup_key, chunk_id, column_name, value FROM metadata_index "
+                f"WHERE lookup_key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        rows.sort(key=lambda row: keys.index(row[0]))
+        hits, seen = [], set()
+        for _, chunk_id, column, value in rows:
+            if chunk_id not in seen:
+                seen.add(chunk_id)
+                hits.append((chunk_id, column, value))
+        return hits[:limit]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(DISTINCT chunk_id) FROM metadata_index").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+_metadata_index = None
+_metadata_index_lock = threading.Lock()
+
+def get_metadata_index() -> MetadataIndex:
+    """获取进程内共享的元数据索引。"""
+    global _metadata_index
+    with _metadata_index_lock:
+        if _metadata_index is None:
+            _metadata_index = MetadataIndex()
+    return _metadata_index
+
+# --- 从向量库补建索引 ---
+
+def rebuild_from_collection(chunk_collection, index: MetadataIndex, batch_size=5000):
+    """从区块集合中分批读取表格行区块的元数据并写入索引。"""
+    total = chunk_collection.count()
+    for offset in range(0, total, batch_size):
+        batch = chunk_collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+        index.upsert(batch["ids"], batch["metadatas"])
+        print(f"已处理 {min(offset + batch_size, total)}/{total} 个区块")
+
+def main():
+    parser = argparse.ArgumentParser(description="精确元数据索引工具。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="从向量库的区块集合重建元数据索引。")
+    lookup_parser = subparsers.add_parser("lookup", help="用元数据索引查找区块。")
+    lookup_parser.add_argument("query", type=str)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        import chromadb
+        from ingest import PERSIST_PATH, CHUNK_COLLECTION_NAME
+
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(METADATA_INDEX_PATH + suffix):
+                os.remove(METADATA_INDEX_PATH + suffix)
+        client = chromadb.PersistentClient(path=PERSIST_PATH)
+        index = MetadataIndex()
+        rebuild_from_collection(client.get_collection(CHUNK_COLLECTION_NAME), index)
+        print(f"--- 元数据索引共包含 {index.count()} 个区块 ---")
+    else:
+        index = MetadataIndex()
+        start = time.perf_counter()
+        hits = index.lookup(args.query)
+        elapsed = (time.perf_counter() - start) * 1000
+        for chunk_id, column, value in hits:
+            print(f"{chunk_id}  ({column}: {value})")
+        print(f"查找耗时: {elapsed:.3f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 注入时的近重复检测（MinHash + LSH）
+
+文档集中有大量近乎相同的内容（重复的药品说明书、同一制度的不同修订版、每页都有的页眉页脚），
+每一份副本都会被摘要、嵌入并写入向量库。本模块在注入时为文档与区块计算 MinHash 签名，
+用分段LSH（banding）找出候选，再以签名估计的 Jaccard 相似度确认近重复：
+- 近重复的文档不再生成摘要，但仍然切分，其区块逐个参与区块级检测：只差剂量、批准文号的两份说明书，
+  不同的区块会被保留，以免副本独有的信息无法检索；近重复的区块不再嵌入。
+- 只保存一个规范（canonical）向量，副本的来源记录为别名，并写入规范条目元数据的 alias_sources 字段。
+- 新的规范条目先在内存中待定，写入向量库后才登记（register）持久化；处理失败的待定条目被丢弃（discard），
+  已指向它的副本来源记录在 orphaned_sources 中，由调用方重新注入。
+- 签名、LSH分桶与别名持久化在SQLite中，增量注入时与历史数据比对；规范条目被删除时，
+  引用它的副本文件会被重新注入。
+
+表格行不参与检测：只差一个编码的两行文本几乎相同，但代表不同的条目。
+"""
+
+import os
+import zlib
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+from config import (
+    NEAR_DUP_INDEX_PATH, NEAR_DUP_THRESHOLD, NEAR_DUP_SHINGLE_SIZE, MINHASH_NUM_PERM, MINHASH_BANDS
+)
+
+# MinHash 使用的梅森素数与固定随机种子（签名需要在多次运行之间保持一致）
+MERSENNE_PRIME = (1 << 31) - 1
+MINHASH_SEED = 20240601
+SQLITE_MAX_VARIABLES = 500
+
+def shingles(text: str, size=NEAR_DUP_SHINGLE_SIZE) -> set:
+    """去除空白后的字符 n-gram 集合。"""
+    text = "".join(text.split()).lower()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class NearDuplicateIndex:
+    """MinHash签名与LSH分桶的持久化索引。kind 区分 'doc'（文档级）与 'chunk'（区块级）。"""
+
+    def __init__(self, path=NEAR_DUP_INDEX_PATH, threshold=NEAR_DUP_THRESHOLD, num_perm=MINHASH_NUM_PERM,
+                 bands=MINHASH_BANDS):
+        if num_perm % bands:
+            raise ValueError("MINHASH_NUM_PERM 必须能被 MINHASH_BANDS 整除。")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(MINHASH_SEED)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                kind TEXT NOT NULL, item_id TEXT NOT NULL, signature BLOB NOT NULL, PRIMARY KEY (kind, item_id)
+            );
+            CREATE TABLE IF NOT EXISTS lsh_buckets (kind TEXT NOT NULL, bucket TEXT NOT NULL, item_id TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets (kind, bucket);
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets_item ON lsh_buckets (item_id);
+            CREATE TABLE IF NOT EXISTS aliases (
+                kind TEXT NOT NULL, canonical_id TEXT NOT NULL, alias_id TEXT NOT NULL, alias_source TEXT NOT NULL,
+                PRIMARY KEY (kind, alias_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_aliases_canonical ON aliases (canonical_id);
+        """)
+        self.conn.commit()
+        self._lock = threading.Lock()
+        # 本次运行的统计
+        self.checked = {"doc": 0, "chunk": 0}
+        self.duplicates = {"doc": 0, "chunk": 0}
+        self.new_aliases = {"doc": {}, "chunk": {}}
+        # 尚未写入向量库的规范条目：{kind: {item_id: 签名}} 与 {kind: {分桶: {item_id}}}
+        self._pending = {"doc": {}, "chunk": {}}
+        self._pending_buckets = {"doc": {}, "chunk": {}}
+        # 规范条目被丢弃时，已指向它的副本来源（这些来源的内容没有被存储）
+        self.orphaned_sources = set()
+
+    def signature(self, text: str):
+        """计算文本的 MinHash 签名；文本为空时返回 None。"""
+        grams = shingles(text)
+        if not grams:
+            return None
+        hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) & MERSENNE_PRIME for gram in grams), dtype=np.uint64)
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _buckets(self, signature) -> list:
+        return [
+            f"{band}:{hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(self.bands)
+        ]
+
+    def find_or_add(self, kind: str, item_id: str, source: str, text: str):
+        """
+        查找近重复的规范条目（包括本次运行中尚待写入的条目）。找到时记录别名并返回规范条目ID；
+        否则把该条目记为待定的规范条目并返回 None，写入向量库后须调用 register 持久化。
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        buckets = self._buckets(signature)
+        with self._lock:
+            self.checked[kind] += 1
+            candidates = {row[0] for row in self.conn.execute(
+                f"SELECT DISTINCT item_id FROM lsh_buckets WHERE kind = ? AND bucket IN ({','.join('?' * len(buckets))})",
+                [kind, *buckets]
+            )}
+            for bucket in buckets:
+                candidates.update(self._pending_buckets[kind].get(bucket, ()))
+            candidates.discard(item_id)
+            best_id, best_similarity = None, 0.0
+            for candidate in sorted(candidates):
+                candidate_signature = self._pending[kind].get(candidate)
+                if candidate_signature is None:
+                    row = self.conn.execute(
+                        "SELECT signature FROM signatures WHERE kind = ? AND item_id = ?", (kind, candidate)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    candidate_signature = np.frombuffer(row[0], dtype=np.uint32)
+                similarity = float(np.mean(candidate_signature == signature))
+                if similarity > best_similarity:
+                    best_id, best_similarity = candidate, similarity
+
+            if best_id is not None and best_similarity >= self.threshold:
+                self.duplicates[kind] += 1
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO aliases (kind, canonical_id, alias_id, alias_source) VALUES (?, ?, ?, ?)",
+                    (kind, best_id, item_id, source)
+                )
+                self.conn.commit()
+                self.new_aliases[kind].setdefault(best_id, set()).add(source)
+                return best_id
+
+            self._delete_locked([item_id], kind)
+            self.conn.commit()
+            self._pending[kind][item_id] = signature
+            for bucket in buckets:
+                self._pending_buckets[kind].setdefault(bucket, set()).add(item_id)
+            return None
+
+    def _pop_pending_locked(self, kind: str, item_id: str):
+        signature = self._pending[kind].pop(item_id, None)
+        if signature is not None:
+            for bucket in self._buckets(signature):
+                members = self._pending_buckets[kind].get(bucket)
+                if members is not None:
+                    members.discard(item_id)
+                    if not members:
+                        del self._pending_buckets[kind][bucket]
+        return signature
+
+    def register(self, kind: str, ids):
+        """规范条目已写入向量库：把其中待定条目的签名与LSH分桶持久化。"""
+        with self._lock:
+            for item_id in ids:
+                signature = self._pop_pending_locked(kind, item_id)
+                if signature is None:
+                    continue
+                self.conn.execute(
+                    "INSERT INTO signatures (kind, item_id, signature) VALUES (?, ?, ?)",
+                    (kind, item_id, signature.tobytes())
+                )
+                self.conn.executemany(
+                    "INSERT INTO lsh_buckets (kind, bucket, item_id) VALUES (?, ?, ?)",
+                    [(kind, bucket, item_id) for bucket in self._buckets(signature)]
+                )
+            self.conn.commit()
+
+    def discard(self, kind: str, ids):
+        """
+        丢弃处理失败、不会写入向量库的待定条目。已指向它们的副本来源加入 orphaned_sources 并返回，
+        这些来源的内容没有被存储，需要重新注入。
+        """
+        ids = [item_id for item_id in ids if item_id in self._pending[kind]]
+        if not ids:
+            return set()
+        sources = set()
+        for alias_sources in self.alias_sources(kind, ids).values():
+            sources.update(alias_sources)
+        with self._lock:
+            for item_id in ids:
+                self._pop_pending_locked(kind, item_id)
+                self.new_aliases[kind].pop(item_id, None)
+            self._delete_locked(ids, kind)
+            self.conn.commit()
+        self.orphaned_sources.update(sources)
+        return sources
+
+    def alias_sources(self, kind: str, canonical_ids) -> dict:
+        """返回 {规范条目ID: [别名来源, ...]}。"""
+        result = {}
+        canonical_ids = list(canonical_ids)
+        with self._lock:
+            for start in range(0, len(canonical_ids), SQLITE_MAX_VARIABLES):
+                batch = canonical_ids[start:start + SQLITE_MAX_VARIABLES]
+                for canonical_id, source in self.conn.execute(
+                    f"SELECT canonical_id, alias_source FROM aliases WHERE kind = ? AND canonical_id IN ({','.join('?' * len(batch))})",
+                    [kind, *batch]
+                ):
+                    result.setdefault(canonical_id, set()).add(source)
+        return {canonical_id: sorted(sources) for canonical_id, sources in result.items()}
+
+    def dependent_sources(self, ids) -> set:
+        """以这些条目为规范条目的副本来源。规范条目被删除后，这些来源需要重新注入。"""
+        sources = set()
+        for by_kind in (self.alias_sources("doc", ids), self.alias_sources("chunk", ids)):
+            for alias_sources in by_kind.values():
+                sources.update(alias_sources)
+        return sources
+
+    def _delete_locked(self, ids, kind=None):
+        kind_filter = "kind = ? AND " if kind else ""
+        kind_args = [kind] if kind else []
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            batch = list(ids[start:start + SQLITE_MAX_VARIABLES])
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(f"DELETE FROM signatures WHERE {kind_filter}item_id IN ({placeholders})", kind_args + batch)
+            self.conn.execute(f"DELETE FROM lsh_buckets WHERE {kind_filter}item_id IN ({placeholders})", kind_args + batch)
+            self.conn.execute(
+                f"DELETE FROM aliases WHERE {kind_filter}(alias_id IN ({placeholders}) OR canonical_id IN ({placeholders}))",
+                kind_args + batch + batch
+            )
+
+    def delete(self, ids):
+        """删除条目的签名（包括待定条目），以及以它们为别名或规范条目的记录。"""
+        if not ids:
+            return
+        with self._lock:
+            for item_id in ids:
+                for kind in self._pending:
+                    self._pop_pending_locked(kind, item_id)
+            self._delete_locked(list(ids))
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        return {
+            "docs_checked": self.checked["doc"],
+            "doc_duplicates": self.duplicates["doc"],
+            "chunks_checked": self.checked["chunk"],
+            "chunk_duplicates": self.duplicates["chunk"],
+        }
+
+    def close(self):
+        self.conn.close()
+
+def apply_alias_metadata(collection, alias_sources: dict, batch_size=500):
+    """把别名来源写入规范条目的元数据（alias_sources，以 '; ' 分隔）。"""
+    canonical_ids = list(alias_sources)
+    for start in range(0, len(canonical_ids), batch_size):
+        batch = canonical_ids[start:start + batch_size]
+        existing = collection.get(ids=batch, include=["metadatas"])
+        ids, metadatas = [], []
+        for item_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            ids.append(item_id)
+            metadatas.append({**(metadata or {}), "alias_sources": "; ".join(alias_sources[item_id])})
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
@@ -1,18 +1,169 @@
 # -*- coding: utf-8 -*-
 """
 @desc: LangGraph工作流的节点（已集成长期记忆）
+
+每个节点都有同步版本与异步版本（以 a 为前缀）。异步版本使用 ainvoke 调用LLM与网络搜索，
+并将ChromaDB/SQLite/嵌入模型等阻塞操作交给线程池执行，使多个问题可以在同一个事件循环中并发处理。
 """
 
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
 
 from agentic_rag.chains import (
     get_query_router_chain, get_initial_rewriter_chain, get_correctional_rewriter_chain, 
-    get_relevance_grader_chain, get_document_relevance_grader_chain, get_memory_consolidation_chain, llm
+    get_relevance_grader_chain, get_document_relevance_grader_chain, get_memory_consolidation_chain, get_chain_llm,
+    embed_query_text
+)
+from agentic_rag.hierarchical_retriever import (
+    hierarchical_retriever, direct_chunk_retriever, exact_match_retriever, tabular_sql_retriever
 )
-from agentic_rag.hierarchical_retriever import hierarchical_retriever, direct_chunk_retriever
 from agentic_rag.retrievers import get_web_search_tool
+from agentic_rag.local_router import get_local_router, log_route_decision
+from agentic_rag.answer_cache import get_answer_cache, context_key
+from agentic_rag.reranker import get_reranker
+from agentic_rag.context_packer import pack_context
 from agentic_rag.state import AgentState
 from agentic_rag import memory
+from config import (
+    ASYNC_BLOCKING_WORKERS, LOCAL_ROUTER_ENABLED, ANSWER_CACHE_ENABLED, RERANKER_ENABLED, RERANKER_CANDIDATES,
+    CONTEXT_COMPRESSION_ENABLED
+)
+
+# 异步节点中执行阻塞操作（ChromaDB、SQLite、本地嵌入模型）的线程池，同步扇出检索也使用它，并发线程数有上限
+_blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="rag-blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    """在专用线程池中执行阻塞函数，不阻塞事件循环。"""
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, partial(func, *args, **kwargs))
+
+# --- 查询向量复用 ---
+
+def get_query_embedding(state: AgentState, text: str):
+    """
+    从状态中取出查询文本对应的向量，不存在时计算一次。
+    返回 (向量, 更新后的 query_embeddings)，调用方需将后者写回状态。
+    """
+    query_embeddings = dict(state.get("query_embeddings") or {})
+    if text not in query_embeddings:
+        query_embeddings[text] = embed_query_text(text)
+    return query_embeddings[text], query_embeddings
+
+# --- 文档重排序与相关性评估 ---
+# 启用重排序时，本地检索取回更多候选，交由交叉编码器筛选
+RETRIEVAL_N_CHUNKS = RERANKER_CANDIDATES if RERANKER_ENABLED else 5
+
+def rerank_documents(query: str, documents):
+    """
+    本地重排序。返回 (文档, 判定)：判定为 None 表示需要LLM评估。
+    网络搜索结果不是 Document 列表，不参与重排序；SQL查询结果与问题的文本相似度不能反映相关性，也不参与。
+    """
+    if not RERANKER_ENABLED or not all(isinstance(document, Document) for document in documents):
+        return documents, None
+    if any(document.metadata.get("data_type") == "sql_result" for document in documents):
+        return documents, None
+    kept, verdict = get_reranker().filter(query, documents)
+    if verdict is None:
+        print(f"--- 重排序得分不确定，保留 {len(kept)} 个区块交给LLM评估 ---")
+    else:
+        print(f"--- 重排序判定{'相关' if verdict else '不相关'}，跳过LLM评估（保留 {len(kept)}/{len(documents)} 个区块） ---")
+    return kept, verdict
+
+def grade_documents(query: str, documents) -> tuple:
+    """评估一组文档，返回 (用于生成的文档, 是否相关)。"""
+    if not documents:
+        return documents, False
+    documents, verdict = rerank_documents(query, documents)
+    if verdict is not None:
+        return documents, verdict
+    result = get_document_relevance_grader_chain().invoke({"query": query, "documents": documents})
+    return documents, bool(result['is_relevant'])
+
+async def agrade_documents(query: str, documents) -> tuple:
+    """grade_documents 的异步版本"""
+    if not documents:
+        return documents, False
+    documents, verdict = await run_blocking(rerank_documents, query, documents)
+    if verdict is not None:
+        return documents, verdict
+    result = await get_document_relevance_grader_chain().ainvoke({"query": query, "documents": documents})
+    return documents, bool(result['is_relevant'])
+
+# --- 答案流式生成 ---
+# 答案节点以流式方式调用LLM：token到达后立即通过回调传出（graph.stream / astream_events 的 "messages" 模式可以收到），
+# 同时在节点内拼接成完整答案写回状态，供 grade_relevance_node 评估。
+
+def stream_answer(runnable, inputs):
+    """流式调用并拼接完整答案，返回 (答案文本, 首个token耗时秒数)。"""
+    start = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+    for chunk in runnable.stream(inputs):
+        if chunk.content:
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            parts.append(chunk.content)
+    return "".join(parts), time_to_first_token
+
+async def astream_answer(runnable, inputs):
+    """stream_answer 的异步版本"""
+    start = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+    async for chunk in runnable.astream(inputs):
+        if chunk.content:
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            parts.append(chunk.content)
+    return "".join(parts), time_to_first_token
+
+def answer_update(state: AgentState, response: str, time_to_first_token) -> dict:
+    """记录对话历史并构造答案节点的状态更新。"""
+    history = list(state.get("conversation_history") or [])
+    history.append(("AI", response))
+    return {"response": response, "time_to_first_token": time_to_first_token, "conversation_history": history}
+
+# --- 语义答案缓存节点 ---
+
+def check_answer_cache_node(state: AgentState) -> dict:
+    """
+    在流程开始时按查询向量查找语义答案缓存，命中时直接给出答案。
+    缓存按此前的对话历史区分上下文，依赖前文的追问只会命中同一上下文中的答案。
+    """
+    update = {"started_at": time.time(), "answer_cache_hit": False}
+    if not ANSWER_CACHE_ENABLED:
+        return update
+    update["answer_cache_context"] = context_key(state.get("conversation_history"))
+    query_embedding, update["query_embeddings"] = get_query_embedding(state, state["query"])
+    entry, similarity = get_answer_cache().lookup(query_embedding, update["answer_cache_context"])
+    if entry is None:
+        return update
+
+    print(f"--- 命中语义答案缓存 (相似度 {similarity:.3f}，原问题: '{entry['query'][:30]}') ---")
+    history = state.get("conversation_history") or []
+    history = history + [("Human", state["query"]), ("AI", entry["response"])]
+    return {
+        **update,
+        "answer_cache_hit": True,
+        "response": entry["response"],
+        "route": entry["route"],
+        "conversation_history": history,
+    }
+
+def update_answer_cache_node(state: AgentState) -> dict:
+    """答案通过相关性评估后写入语义答案缓存。"""
+    if ANSWER_CACHE_ENABLED and state.get("is_relevant") and state.get("response"):
+        query_embedding, query_embeddings = get_query_embedding(state, state["query"])
+        latency = time.time() - state["started_at"] if state.get("started_at") else 0.0
+        get_answer_cache().store(state["query"], query_embedding, state["response"], state.get("route"), latency,
+                                 state.get("answer_cache_context") or "")
+        return {"query_embeddings": query_embeddings}
+    return {}
 
 # --- 新增：记忆相关节点 ---
 
@@ -20,25 +171,28 @@ def retrieve_memory_node(state: AgentState) -> dict:
     """在流程开始时，根据用户问题检索长期记忆。"""
     print("--- 检索长期记忆 ---")
     query = state["query"]
-    retrieved_memories = memory.retrieve_memories(query)
+    query_embedding, query_embeddings = get_query_embedding(state, query)
+    retrieved_memories = memory.retrieve_memories(query, query_embedding=query_embedding)
     # 将记忆格式化为字符串，以便注入Prompt
     memories_text = "\n".join([mem['text'] for mem in retrieved_memories])
     if not memories_text:
         memories_text = "无相关历史记忆。"
     print(f"检索到的记忆: {memories_text}")
-    return {
+    update = {
         "retrieved_memories": memories_text,
-        "conversation_history": [], # 初始化对话历史
         "correction_attempts": 0, # 初始化重试计数器
+        "query_embeddings": query_embeddings,
     }
+    # 对话历史只在会话的第一轮初始化；配置检查点时，后续轮次沿用检查点中恢复的历史
+    if state.get("conversation_history") is None:
+        update["conversation_history"] = []
+    return update
 
 def consolidate_memory_node(state: AgentState) -> dict:
     """在流程结束时，提炼并存储本次对话的关键信息。"""
     print("--- 复盘并巩固记忆 ---")
-    # 将最终的问答对加入历史
-    history = state["conversation_history"]
-    history.append(("Human", state["query"]))
-    history.append(("AI", state["response"]))
+    # 本轮的问题与最终答案已由路由节点与答案节点记入历史
+    history = state.get("conversation_history") or []
 
     # 格式化历史以供LLM分析
     history_text = "\n".join([f"{role}: {text}" for role, text in history])
@@ -61,23 +215,49 @@ def consolidate_memory_node(state: AgentState) -> dict:
 
 # --- 现有节点改造 ---
 
-def route_query_node(state: AgentState) -> dict:
-    """智能路由节点：仅决策，不执行。"""
-    print("--- 智能路由与调度 ---")
-    query = state["query"]
-    memories = state["retrieved_memories"]
-    
-    router_chain = get_query_router_chain()
-    result = router_chain.invoke({"query": query, "memories": memories})
-    route = result['datasource']
-    print(f"路由决策: {route}")
+def route_locally(state: AgentState):
+    """
+    尝试用本地路由模型决策，复用记忆检索时已计算的查询向量。
+    返回 (路由或None, 置信度, 更新后的 query_embeddings)；置信度不足或没有模型时路由为None。
+    """
+    if not LOCAL_ROUTER_ENABLED:
+        return None, 0.0, state.get("query_embeddings")
+    query_embedding, query_embeddings = get_query_embedding(state, state["query"])
+    router = get_local_router()
+    route, confidence = router.predict(query_embedding)
+    if route is None or confidence < router.threshold:
+        return None, confidence, query_embeddings
+    return route, confidence, query_embeddings
+
+def record_route(state: AgentState, route: str, source: str, confidence: float, query_embeddings) -> dict:
+    """记录路由决策（统计与日志），并构造路由节点的状态更新。"""
+    get_local_router().record(source)
+    log_route_decision(state["query"], route, source, confidence)
+    if source == "local":
+        print(f"路由决策(本地, 置信度 {confidence:.2f}): {route}")
+    else:
+        print(f"路由决策: {route}")
 
     # 记录到对话历史
-    history = state.get("conversation_history", [])
-    history.append(("Human", query))
+    history = list(state.get("conversation_history") or [])
+    history.append(("Human", state["query"]))
 
     # 初始化“已尝试路由”列表
-    return {"route": route, "tried_routes": [route], "conversation_history": history}
+    update = {"route": route, "tried_routes": [route], "conversation_history": history}
+    if query_embeddings is not None:
+        update["query_embeddings"] = query_embeddings
+    return update
+
+def route_query_node(state: AgentState) -> dict:
+    """智能路由节点：仅决策，不执行。本地路由置信度足够时跳过LLM。"""
+    print("--- 智能路由与调度 ---")
+    route, confidence, query_embeddings = route_locally(state)
+    if route is not None:
+        return record_route(state, route, "local", confidence, query_embeddings)
+
+    router_chain = get_query_router_chain()
+    result = router_chain.invoke({"query": state["query"], "memories": state["retrieved_memories"]})
+    return record_route(state, result['datasource'], "llm", confidence, query_embeddings)
 
 def retrieve_documents_node(state: AgentState) -> dict:
     """文档检索节点：根据路由决策执行检索。"""
@@ -85,11 +265,26 @@ def retrieve_documents_node(state: AgentState) -> dict:
     query = state.get("updated_query") or state["query"]
     route = state["route"]
     documents = []
+    updates = {}
 
+    if route == 'tabular_sql':
+        documents = tabular_sql_retriever(query)
+        if documents:
+            return {"documents": documents}
+        print("--- SQL查询无结果，转为直接区块检索 ---")
+        route = updates["route"] = 'direct_chunk_search'
+        updates["tried_routes"] = (state.get("tried_routes") or []) + [route]
+    if route in ['hierarchical_search', 'direct_chunk_search']:
+        # 精确标识符查询（批准文号、本位码等）直接查索引，跳过嵌入与向量检索
+        documents = exact_match_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS)
+        if documents:
+            return {"documents": documents, **updates}
+        # 同一查询文本在内循环的多次策略切换中只嵌入一次
+        query_embedding, updates["query_embeddings"] = get_query_embedding(state, query)
     if route == 'hierarchical_search':
-        documents = hierarchical_retriever(query)
+        documents = hierarchical_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
     elif route == 'direct_chunk_search':
-        documents = direct_chunk_retriever(query)
+        documents = direct_chunk_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
     elif route == 'web_search':
         web_search = get_web_search_tool()
         documents = web_search.invoke({"query": query})
@@ -100,26 +295,37 @@ def retrieve_documents_node(state: AgentState) -> dict:
         web_search = get_web_search_tool()
         documents = web_search.invoke({"query": query})
         # 更新状态以反映实际使用的路由
-        return {"documents": documents, "route": "web_search"}
+        return {**updates, "documents": documents, "route": "web_search"}
 
-    return {"documents": documents}
+    return {"documents": documents, **updates}
 
 def grade_documents_node(state: AgentState) -> dict:
-    """文档相关性评估节点（内循环）"""
+    """文档相关性评估节点（内循环）：先本地重排序筛选，得分不确定时再由LLM评估。"""
     print("--- 评估文档相关性 ---")
     if not state.get("documents"):
         print("--- 未检索到文档，评估为不相关 ---")
         return {"documents_are_relevant": False}
 
-    grader_chain = get_document_relevance_grader_chain()
-    result = grader_chain.invoke({"query": state["query"], "documents": state["documents"]})
-    
-    if result['is_relevant']:
-        print("---" " 文档相关，准备生成答案 ---")
-        return {"documents_are_relevant": True}
+    documents, relevant = grade_documents(state["query"], state["documents"])
+    if relevant:
+        print("--- 文档相关，准备生成答案 ---")
     else:
         print("--- 文档不相关，将触发重试 ---")
-        return {"documents_are_relevant": False}
+    return {"documents": documents, "documents_are_relevant": relevant}
+
+def next_retrieval_route(state: AgentState):
+    """按默认优先级返回下一个尚未尝试的检索策略；都已尝试过时返回 None。"""
+    tried_routes = state.get("tried_routes") or []
+    for route in RETRIEVAL_ROUTE_PRIORITY:
+        if route not in tried_routes:
+            return route
+    return None
+
+def switch_route_node(state: AgentState) -> dict:
+    """切换检索策略节点（内循环）：文档不相关时改用下一个尚未尝试的策略。"""
+    next_route = next_retrieval_route(state)
+    print(f"---决策：切换到新策略 '{next_route}'---")
+    return {"route": next_route, "tried_routes": (state.get("tried_routes") or []) + [next_route]}
 
 def web_search_node(state: AgentState) -> dict:
     """网络搜索节点 (现在被 retrieve_documents_node 调用，但保留以备直接调用)"""
@@ -145,34 +351,44 @@ def rewrite_query_node(state: AgentState) -> dict:
     print(f"重写后的查询: {result['rewritten_query']}")
     return {"updated_query": result['rewritten_query']}
 
-def generate_response_node(state: AgentState) -> dict:
-    """答案生成节点"""
-    print("--- 生成答案 ---")
-    # 使用 updated_query (如果存在)，否则使用原始 query
-    query_for_gen = state.get("updated_query") or state["query"]
+def get_answer_chain():
+    """获取基于上下文的答案生成链"""
     prompt = ChatPromptTemplate.from_messages([
         ("system", "你是一个问答机器人。请根据以下上下文信息来回答用户的问题。\n\n上下文:\n{context}"),
         ("human", "问题: {query}")
     ])
-    chain = prompt | llm
-    response = chain.invoke({"context": state["documents"], "query": query_for_gen})
-    
-    # 记录到对话历史
-    history = state.get("conversation_history", [])
-    history.append(("AI", response.content))
+    return prompt | get_chain_llm("answer")
 
-    return {"response": response.content, "conversation_history": history}
+def build_context(state: AgentState, query: str) -> tuple:
+    """
+    把检索到的文档打包为受token预算约束的上下文，返回 (上下文, 状态更新)。
+    启用句子压缩时需要问题向量（复用状态中已计算的向量）。
+    """
+    updates = {}
+    query_embedding = None
+    if CONTEXT_COMPRESSION_ENABLED:
+        query_embedding, updates["query_embeddings"] = get_query_embedding(state, query)
+    context, stats = pack_context(state["documents"], query_embedding=query_embedding)
+    print(f"--- 上下文打包: {stats['passages']} 个片段（去重 {stats['duplicates_removed']} 个），"
+          f"{stats['original_tokens']} -> {stats['packed_tokens']} tokens，节省 {stats['tokens_saved']} ---")
+    updates["context_stats"] = stats
+    return context, updates
+
+def generate_response_node(state: AgentState) -> dict:
+    """答案生成节点"""
+    print("--- 生成答案 ---")
+    # 使用 updated_query (如果存在)，否则使用原始 query
+    query_for_gen = state.get("updated_query") or state["query"]
+    context, updates = build_context(state, query_for_gen)
+    chain = get_answer_chain()
+    response, time_to_first_token = stream_answer(chain, {"context": context, "query": query_for_gen})
+    return {**answer_update(state, response, time_to_first_token), **updates}
 
 def direct_response_node(state: AgentState) -> dict:
     """直接回答节点"""
     print("--- 直接回答 ---")
-    response = llm.invoke(state["query"])
-    
-    # 记录到对话历史
-    history = state.get("conversation_history", [])
-    history.append(("AI", response.content))
-
-    return {"response": response.content, "documents": [], "conversation_history": history}
+    response, time_to_first_token = stream_answer(get_chain_llm("answer"), state["query"])
+    return {**answer_update(state, response, time_to_first_token), "documents": []}
 
 def grade_relevance_node(state: AgentState) -> dict:
     """答案相关性评估节点（外循环）"""
@@ -186,3 +402,288 @@ def grade_relevance_node(state: AgentState) -> dict:
         print("--- 答案不相关，将触发重写 ---")
         attempts = state.get("correction_attempts", 0) + 1
         return {"is_relevant": False, "correction_attempts": attempts}
+
+
+# --- 异步节点 ---
+# 与上面的同步节点一一对应，供 build_graph(async_mode=True) 使用。
+
+async def acheck_answer_cache_node(state: AgentState) -> dict:
+    """check_answer_cache_node 的异步版本"""
+    return await run_blocking(check_answer_cache_node, state)
+
+async def aupdate_answer_cache_node(state: AgentState) -> dict:
+    """update_answer_cache_node 的异步版本"""
+    return await run_blocking(update_answer_cache_node, state)
+
+async def aretrieve_memory_node(state: AgentState) -> dict:
+    """retrieve_memory_node 的异步版本：查询嵌入与记忆检索都是阻塞操作，整体交给线程池执行。"""
+    return await run_blocking(retrieve_memory_node, state)
+
+async def aconsolidate_memory_node(state: AgentState) -> dict:
+    """consolidate_memory_node 的异步版本"""
+    print("--- 复盘并巩固记忆 ---")
+    history = state.get("conversation_history") or []
+    history_text = "\n".join([f"{role}: {text}" for role, text in history])
+
+    consolidation_chain = get_memory_consolidation_chain()
+    try:
+        result = await consolidation_chain.ainvoke({"conversation_history": history_text})
+        if isinstance(result, list) and result:
+            result = result[0]
+        if isinstance(result, dict) and result.get("text") and "No valuable information" not in result.get("text"):
+            await run_blocking(memory.add_memory, text=result["text"], type=result["type"], importance=result["importance"])
+    except Exception as e:
+        # 如果记忆提炼失败，不影响主流程
+        print(f"记忆提炼失败: {e}")
+
+    return {}
+
+async def aroute_query_node(state: AgentState) -> dict:
+    """route_query_node 的异步版本"""
+    print("--- 智能路由与调度 ---")
+    route, confidence, query_embeddings = await run_blocking(route_locally, state)
+    if route is not None:
+        return await run_blocking(record_route, state, route, "local", confidence, query_embeddings)
+
+    result = await get_query_router_chain().ainvoke({"query": state["query"], "memories": state["retrieved_memories"]})
+    return await run_blocking(record_route, state, result['datasource'], "llm", confidence, query_embeddings)
+
+async def aretrieve_documents_node(state: AgentState) -> dict:
+    """retrieve_documents_node 的异步版本：本地检索交给线程池，网络搜索使用 ainvoke。"""
+    print(f"--- 文档检索 (策略: {state['route']}) ---")
+    query = state.get("updated_query") or state["query"]
+    route = state["route"]
+    documents = []
+    updates = {}
+
+    if route == 'tabular_sql':
+        documents = await run_blocking(tabular_sql_retriever, query)
+        if documents:
+            return {"documents": documents}
+        print("--- SQL查询无结果，转为直接区块检索 ---")
+        route = updates["route"] = 'direct_chunk_search'
+        updates["tried_routes"] = (state.get("tried_routes") or []) + [route]
+    if route in ['hierarchical_search', 'direct_chunk_search']:
+        documents = await run_blocking(exact_match_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS)
+        if documents:
+            return {"documents": documents, **updates}
+        query_embedding, updates["query_embeddings"] = await run_blocking(get_query_embedding, state, query)
+    if route == 'hierarchical_search':
+        documents = await run_blocking(hierarchical_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'direct_chunk_search':
+        documents = await run_blocking(direct_chunk_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'web_search':
+        documents = await get_web_search_tool().ainvoke({"query": query})
+
+    # 如果本地检索无果，则回退到网络搜索
+    if route in ["hierarchical_search", "direct_chunk_search"] and not documents:
+        print("--- 本地检索无结果，自动转为网络搜索 ---")
+        documents = await get_web_search_tool().ainvoke({"query": query})
+        return {**updates, "documents": documents, "route": "web_search"}
+
+    return {"documents": documents, **updates}
+
+async def agrade_documents_node(state: AgentState) -> dict:
+    """grade_documents_node 的异步版本"""
+    print("--- 评估文档相关性 ---")
+    if not state.get("documents"):
+        print("--- 未检索到文档，评估为不相关 ---")
+        return {"documents_are_relevant": False}
+
+    documents, relevant = await agrade_documents(state["query"], state["documents"])
+    if relevant:
+        print("--- 文档相关，准备生成答案 ---")
+    else:
+        print("--- 文档不相关，将触发重试 ---")
+    return {"documents": documents, "documents_are_relevant": relevant}
+
+async def aweb_search_node(state: AgentState) -> dict:
+    """web_search_node 的异步版本"""
+    print("--- 网络搜索 ---")
+    documents = await get_web_search_tool().ainvoke({"query": state["updated_query"]})
+    return {"documents": documents}
+
+async def aswitch_route_node(state: AgentState) -> dict:
+    """switch_route_node 的异步版本（只修改状态，无阻塞操作）"""
+    return switch_route_node(state)
+
+async def arewrite_query_node(state: AgentState) -> dict:
+    """rewrite_query_node 的异步版本"""
+    print("--- 重写查询 ---")
+    query = state["query"]
+    last_response = state.get("response")
+
+    if last_response:
+        result = await get_correctional_rewriter_chain().ainvoke({"query": query, "response": last_response})
+    else:
+        result = await get_initial_rewriter_chain().ainvoke({"query": query})
+
+    print(f"重写后的查询: {result['rewritten_query']}")
+    return {"updated_query": result['rewritten_query']}
+
+async def agenerate_response_node(state: AgentState) -> dict:
+    """generate_response_node 的异步版本"""
+    print("--- 生成答案 ---")
+    query_for_gen = state.get("updated_query") or state["query"]
+    context, updates = await run_blocking(build_context, state, query_for_gen)
+    response, time_to_first_token = await astream_answer(get_answer_chain(), {"context": context, "query": query_for_gen})
+    return {**answer_update(state, response, time_to_first_token), **updates}
+
+async def adirect_response_node(state: AgentState) -> dict:
+    """direct_response_node 的异步版本"""
+    print("--- 直接回答 ---")
+    response, time_to_first_token = await astream_answer(get_chain_llm("answer"), state["query"])
+    return {**answer_update(state, response, time_to_first_token), "documents": []}
+
+async def agrade_relevance_node(state: AgentState) -> dict:
+    """grade_relevance_node 的异步版本"""
+    print("--- 评估最终答案相关性 ---")
+    result = await get_relevance_grader_chain().ainvoke({"query": state["query"], "response": state["response"]})
+    if result['is_relevant']:
+        print("答案相关，流程结束。")
+        return {"is_relevant": True}
+    print("--- 答案不相关，将触发重写 ---")
+    attempts = state.get("correction_attempts", 0) + 1
+    return {"is_relevant": False, "correction_attempts": attempts}
+
+
+# --- 并发扇出检索 ---
+# 可选模式（RETRIEVAL_FANOUT_ENABLED）：不再逐个尝试检索策略，而是同时执行所有候选策略并并行评估，
+# 按路由优先级取第一个被评估为相关的结果，其余策略尚未开始的检索/评估被跳过。
+# 内循环的延迟由最慢的单个策略决定，而不是各策略耗时之和。
+
+# 检索策略的默认优先级（路由选中的策略总是排在最前面）
+RETRIEVAL_ROUTE_PRIORITY = ['hierarchical_search', 'direct_chunk_search', 'web_search']
+
+def fanout_routes(route: str) -> list:
+    """路由选中的策略优先，其余按默认优先级排列。"""
+    return [route] + [r for r in RETRIEVAL_ROUTE_PRIORITY if r != route]
+
+def retrieve_and_grade(route: str, query: str, grade_query: str, query_embedding, stop=None) -> tuple:
+    """
+    执行单个检索策略并评估结果，返回 (文档, 是否相关)。
+    stop（threading.Event）被设置时（已选出结果），跳过尚未开始的检索与评估，直接返回 ([], False)。
+    """
+    if stop is not None and stop.is_set():
+        return [], False
+    if route == 'hierarchical_search':
+        documents = hierarchical_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'direct_chunk_search':
+        documents = direct_chunk_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'tabular_sql':
+        documents = tabular_sql_retriever(query)
+    else:
+        documents = get_web_search_tool().invoke({"query": query})
+    if stop is not None and stop.is_set():
+        return [], False
+    return grade_documents(grade_query, documents)
+
+async def aretrieve_and_grade(route: str, query: str, grade_query: str, query_embedding, stop=None) -> tuple:
+    """retrieve_and_grade 的异步版本"""
+    if stop is not None and stop.is_set():
+        return [], False
+    if route == 'hierarchical_search':
+        documents = await run_blocking(hierarchical_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'direct_chunk_search':
+        documents = await run_blocking(direct_chunk_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS, query_embedding=query_embedding)
+    elif route == 'tabular_sql':
+        documents = await run_blocking(tabular_sql_retriever, query)
+    else:
+        documents = await get_web_search_tool().ainvoke({"query": query})
+    if stop is not None and stop.is_set():
+        return [], False
+    return await agrade_documents(grade_query, documents)
+
+def fanout_update(routes, winner, documents, query_embeddings) -> dict:
+    if winner is None:
+        print("--- 所有检索策略均未找到相关文档 ---")
+        return {"documents": [], "documents_are_relevant": False, "tried_routes": routes, "query_embeddings": query_embeddings}
+    print(f"--- 采用策略 '{winner}' 的检索结果 ---")
+    return {
+        "documents": documents,
+        "route": winner,
+        "documents_are_relevant": True,
+        "tried_routes": routes,
+        "query_embeddings": query_embeddings,
+    }
+
+# 与 retrieve_documents_node 一致：只有本地区块类策略先查精确匹配索引
+EXACT_MATCH_ROUTES = ('hierarchical_search', 'direct_chunk_search')
+
+def fanout_retrieve_node(state: AgentState) -> dict:
+    """
+    并发扇出检索节点：各策略在共享的有界线程池中同时检索并评估。
+    选出结果后通知其余策略停止：尚未开始的检索与评估会被跳过，已在执行的单次调用（如网络搜索）无法中断，其结果被丢弃。
+    """
+    routes = fanout_routes(state["route"])
+    print(f"--- 并发检索与评估 (策略: {', '.join(routes)}) ---")
+    query = state.get("updated_query") or state["query"]
+    # 精确标识符查询命中且相关时，无需扇出；结果归属于路由选中的策略
+    if state["route"] in EXACT_MATCH_ROUTES:
+        documents = exact_match_retriever(query, n_chunks=RETRIEVAL_N_CHUNKS)
+        if documents:
+            documents, relevant = grade_documents(state["query"], documents)
+            if relevant:
+                return fanout_update([state["route"]], state["route"], documents, state.get("query_embeddings") or {})
+    query_embedding, query_embeddings = get_query_embedding(state, query)
+
+    stop = threading.Event()
+    futures = [
+        _blocking_executor.submit(retrieve_and_grade, route, query, state["query"], query_embedding, stop)
+        for route in routes
+    ]
+    winner, documents = None, []
+    try:
+        # 按优先级依次等待：高优先级策略失败后，低优先级策略往往已经完成
+        for route, future in zip(routes, futures):
+            try:
+                route_documents, relevant = future.result()
+            except Exception as e:
+                print(f"策略 '{route}' 执行失败: {e}")
+                continue
+            if relevant:
+                winner, documents = route, route_documents
+                break
+            print(f"--- 策略 '{route}' 的文档不相关 ---")
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+    return fanout_update(routes, winner, documents, query_embeddings)
+
+async def afanout_retrieve_node(state: AgentState) -> dict:
+    """
+    fanout_retrieve_node 的异步版本。选定结果后通知其余策略停止并取消其协程：
+    在途的异步调用（LLM评估、网络搜索）随协程取消；已交给线程池的阻塞调用会执行完毕，但其后续阶段被跳过。
+    """
+    routes = fanout_routes(state["route"])
+    print(f"--- 并发检索与评估 (策略: {', '.join(routes)}) ---")
+    query = state.get("updated_query") or state["query"]
+    if state["route"] in EXACT_MATCH_ROUTES:
+        documents = await run_blocking(exact_match_retriever, query, n_chunks=RETRIEVAL_N_CHUNKS)
+        if documents:
+            documents, relevant = await agrade_documents(state["query"], documents)
+            if relevant:
+                return fanout_update([state["route"]], state["route"], documents, state.get("query_embeddings") or {})
+    query_embedding, query_embeddings = await run_blocking(get_query_embedding, state, query)
+
+    stop = threading.Event()
+    tasks = [asyncio.create_task(aretrieve_and_grade(route, query, state["query"], query_embedding, stop)) for route in routes]
+    winner, documents = None, []
+    try:
+        for route, task in zip(routes, tasks):
+            try:
+                route_documents, relevant = await task
+            except Exception as e:
+                print(f"策略 '{route}' 执行失败: {e}")
+                continue
+            if relevant:
+                winner, documents = route, route_documents
+                break
+            print(f"--- 策略 '{route}' 的文档不相关 ---")
+    finally:
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return fanout_update(routes, winner, documents, query_embeddings)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 本地重排序模块
+
+检索后处理阶段：用本地交叉编码器（cross-encoder，默认在CPU上运行）为每个 (问题, 区块) 对打分，
+只保留得分最高且超过阈值的前 n 个区块，并据此判断检索结果是否相关：
+- 最高分不低于接受阈值：直接判定为相关，无需LLM评估；
+- 最高分低于拒绝阈值：直接判定为不相关；
+- 介于两者之间：结果不确定，交给LLM文档评估链判断。
+"""
+
+import threading
+
+from config import (
+    RERANKER_MODEL_PATH, RERANKER_DEVICE, RERANKER_BATCH_SIZE, RERANKER_MAX_LENGTH, RERANKER_TOP_N,
+    RERANKER_KEEP_THRESHOLD, RERANKER_ACCEPT_THRESHOLD, RERANKER_REJECT_THRESHOLD
+)
+
+class LocalReranker:
+    """基于 SentenceTransformers CrossEncoder 的重排序器。"""
+
+    def __init__(self, model_path=RERANKER_MODEL_PATH, device=RERANKER_DEVICE, batch_size=RERANKER_BATCH_SIZE,
+                 max_length=RERANKER_MAX_LENGTH, top_n=RERANKER_TOP_N, keep_threshold=RERANKER_KEEP_THRESHOLD,
+                 accept_threshold=RERANKER_ACCEPT_THRESHOLD, reject_threshold=RERANKER_REJECT_THRESHOLD):
+        from sentence_transformers import CrossEncoder
+
+        print(f"--- 加载本地重排序模型: {model_path} (设备: {device}) ---")
+        # 单输出的交叉编码器默认以 sigmoid 激活，得分范围为 0~1
+        self.model = CrossEncoder(model_path, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.top_n = top_n
+        self.keep_threshold = keep_threshold
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.ambiguous = 0
+
+    def score(self, query: str, documents) -> list:
+        """为每个文档打分，返回与输入对齐的得分列表。"""
+        if not documents:
+            return []
+        pairs = [(query, document.page_content) for document in documents]
+        # 模型推理不是线程安全的，多个并发请求串行执行
+        with self._lock:
+            scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def filter(self, query: str, documents):
+        """
+        重排序并筛选文档。
+        返回 (保留的文档, 判定)：判定为 True（相关）、False（不相关）或 None（不确定，需LLM评估）。
+        保留的文档按得分降序排列，得分写入 metadata['rerank_score']。
+        """
+        scores = self.score(query, documents)
+        if not scores:
+            return [], False
+        ranked = sorted(zip(documents, scores), key=lambda item: item[1], reverse=True)
+        for document, score in ranked:
+            document.metadata = {**(document.metadata or {}), "rerank_score": round(score, 4)}
+        best = ranked[0][1]
+
+        if best >= self.accept_threshold:
+            self.accepted += 1
+            return [document for document, score in ranked[:self.top_n] if score >= self.keep_threshold], True
+        if best < self.reject_threshold:
+            self.rejected += 1
+            return [], False
+        # 不确定：保留未被明确排除的前 n 个文档，交给LLM评估
+        self.ambiguous += 1
+        return [document for document, score in ranked[:self.top_n] if score >= self.reject_threshold], None
+
+    def stats(self) -> dict:
+        total = self.accepted + self.rejected + self.ambiguous
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "ambiguous": self.ambiguous,
+            "skip_llm_rate": (self.accepted + self.rejected) / total if total else 0.0,
+        }
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> LocalReranker:
+    """获取进程内共享的重排序器（首次调用时加载模型）。"""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = LocalReranker()
+    return _reranker
@@ -4,7 +4,7 @@
 
 该状态在图的节点之间传递，并随着每个节点的执行而更新。
 """
-from typing import List, TypedDict, Optional
+from typing import Dict, List, TypedDict, Optional
 
 class AgentState(TypedDict):
     """
@@ -20,6 +20,13 @@ class AgentState(TypedDict):
         error (Optional[str]): 工作流中发生的任何错误。
         retrieved_memories (Optional[List[str]]): 从长期记忆库中检索到的相关记忆。
         conversation_history (List): 存储当前对话的交互历史。
+        query_embeddings (Dict[str, List[float]]): 本次运行中已计算的查询向量（查询文本 -> 向量），
+            记忆、摘要与区块检索共用，同一查询文本只嵌入一次。
+        time_to_first_token (Optional[float]): 最近一次生成答案时，从调用LLM到收到首个token的耗时（秒）。
+        started_at (float): 本轮开始处理的时间戳，用于计算缓存答案节省的时间。
+        answer_cache_hit (bool): 本轮答案是否来自语义答案缓存。
+        answer_cache_context (str): 本轮提问时的对话上下文键（此前对话历史的哈希），语义答案缓存按它区分上下文。
+        context_stats (Optional[Dict]): 最近一次生成答案时的上下文打包统计（原始与打包后的token数、节省的token数等）。
     """
     query: str
     updated_query: str
@@ -33,3 +40,37 @@ class AgentState(TypedDict):
     correction_attempts: int
     tried_routes: List[str]
     documents_are_relevant: bool
+    query_embeddings: Dict[str, List[float]]
+    time_to_first_token: Optional[float]
+    started_at: float
+    answer_cache_hit: bool
+    answer_cache_context: str
+    context_stats: Optional[Dict]
+
+def new_turn_input(query: str) -> dict:
+    """
+    构造一轮新问题的图输入。
+
+    配置了检查点（checkpointer）时，同一会话（thread_id）的状态会在多轮之间保留。
+    除对话历史外，上一轮的中间结果（答案、重写后的查询、重试次数等）都需要重置，
+    否则会影响本轮的路由与重写逻辑。
+    """
+    return {
+        "query": query,
+        "updated_query": None,
+        "documents": [],
+        "response": None,
+        "route": None,
+        "is_relevant": None,
+        "error": None,
+        "retrieved_memories": None,
+        "correction_attempts": 0,
+        "tried_routes": [],
+        "documents_are_relevant": None,
+        "query_embeddings": {},
+        "time_to_first_token": None,
+        "started_at": None,
+        "answer_cache_hit": False,
+        "answer_cache_context": "",
+        "context_stats": None,
+    }
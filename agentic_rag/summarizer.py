@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 异步摘要生成模块
+
+数据注入时的文档摘要是LLM（网络）密集型任务，本模块使用 asyncio + ainvoke 并发调用摘要链，并提供：
+- 并发上限：同时在途的请求数不超过配置值。
+- 速率限制：基于令牌桶的每分钟token限额。
+- 失败重试：指数退避加随机抖动。
+- map-reduce：多页文档先按页面分组并发生成分组摘要，再合并为一份文档摘要。
+"""
+
+import time
+import random
+import asyncio
+import threading
+
+from agentic_rag.chains import get_summarizer_chain, get_summary_reducer_chain
+from config import (
+    SUMMARY_MAX_CONCURRENCY, SUMMARY_TOKENS_PER_MINUTE,
+    SUMMARY_MAX_RETRIES, SUMMARY_RETRY_BASE_DELAY, SUMMARY_MAP_GROUP_CHARS
+)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """加载 tiktoken 编码（首次调用时加载一次）；不可用时返回 None（离线时不会在每次估算时重试下载）。"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"警告: 无法加载 tiktoken 编码 'cl100k_base' ({e})，摘要限速将按字符数估算token。")
+                _encoding = False
+    return _encoding or None
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数，优先使用tiktoken，不可用时按字符数粗略估算（对中文偏保守）。"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def group_texts(texts, max_chars=SUMMARY_MAP_GROUP_CHARS, separator="\n\n") -> list:
+    """把相邻的文本按顺序合并为不超过 max_chars 的分组（单个文本超长时独占一组）。"""
+    groups, current, length = [], [], 0
+    for text in texts:
+        if current and length + len(separator) + len(text) > max_chars:
+            groups.append(separator.join(current))
+            current, length = [], 0
+        length += (len(separator) if current else 0) + len(text)
+        current.append(text)
+    if current:
+        groups.append(separator.join(current))
+    return groups
+
+class AsyncTokenRateLimiter:
+    """
+    令牌桶速率限制器：桶容量为每分钟的token上限，按秒匀速补充。
+    单次请求超过桶容量时按桶容量计，避免永远无法获取。
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.available = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        if self.capacity <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+class AsyncSummarizer:
+    """并发、限速、带重试的异步摘要生成器。摘要链在实例内只构建一次。"""
+
+    def __init__(self, max_concurrency=SUMMARY_MAX_CONCURRENCY, tokens_per_minute=SUMMARY_TOKENS_PER_MINUTE,
+                 max_retries=SUMMARY_MAX_RETRIES, retry_base_delay=SUMMARY_RETRY_BASE_DELAY):
+        self.chain = get_summarizer_chain()
+        self.reducer_chain = get_summary_reducer_chain()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = AsyncTokenRateLimiter(tokens_per_minute)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.llm_calls = 0
+        self.retries = 0
+
+    async def summarize(self, document_content: str, reduce=False) -> str:
+        """为一段文档内容生成摘要（reduce为True时合并多段摘要）；重试耗尽后抛出最后一次的异常。"""
+        chain = self.reducer_chain if reduce else self.chain
+        tokens = estimate_tokens(document_content)
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire(tokens)
+                try:
+                    self.llm_calls += 1
+                    result = await chain.ainvoke({"document_content": document_content})
+                    return result.content
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    self.retries += 1
+                    delay = self.retry_base_delay * (2 ** attempt) * (1 + random.random())
+                    print(f"摘要请求失败（第 {attempt + 1} 次），{delay:.1f} 秒后重试: {e}")
+                    await asyncio.sleep(delay)
+
+    async def summarize_pages(self, pages, summarize=None, max_chars=SUMMARY_MAP_GROUP_CHARS) -> str:
+        """
+        map-reduce 摘要：相邻页面合并为分组后并发生成分组摘要（并发受实例的信号量约束），
+        再把分组摘要合并为一份摘要；合并输入仍超过 max_chars 时分轮合并。
+        文档只有一个分组时只调用一次LLM。
+        summarize 可替换为带缓存的协程函数，签名与 self.summarize 相同。
+        """
+        summarize = summarize or self.summarize
+        groups = group_texts(pages, max_chars)
+        summaries = await asyncio.gather(*(summarize(group) for group in groups))
+        while len(summaries) > 1:
+            groups = group_texts(summaries, max_chars)
+            if len(groups) == len(summaries) and len(groups) > 1:
+                # 每个摘要都已超长无法再合并分组，退化为两两合并，保证轮次收敛
+                groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = await asyncio.gather(*(summarize(group, reduce=True) for group in groups))
+        return summaries[0] if summaries else ""
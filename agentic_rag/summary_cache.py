@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 摘要缓存模块
+
+持久化的LLM摘要缓存，存储在 chroma_db 旁的 SQLite 文件中。
+缓存键为 (文档内容哈希, 模型名称, 摘要提示词版本)：内容、模型或提示词任一变化都会产生新的键，
+因此重建索引（例如更换嵌入模型）时，未变化的文档不需要再调用LLM。
+缓存按条目数限制大小，超出时按最近访问时间淘汰（LRU），并统计命中率。
+"""
+
+import time
+import sqlite3
+import hashlib
+
+from config import SUMMARY_CACHE_PATH, SUMMARY_CACHE_MAX_ENTRIES
+
+def content_hash(text: str) -> str:
+    """计算文档内容的SHA-256哈希。"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class SummaryCache:
+    """基于SQLite的摘要缓存。"""
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path)
+        # WAL模式 + NORMAL同步级别，避免每次写入都触发完整的fsync
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, model, prompt_version)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_accessed ON summaries (last_accessed_at)")
+        self.conn.commit()
+
+    def get(self, text: str, model: str, prompt_version: str):
+        """查询缓存，命中时返回摘要并刷新访问时间，未命中返回None。"""
+        key = (content_hash(text), model, prompt_version)
+        row = self.conn.execute(
+            "SELECT summary FROM summaries WHERE content_hash = ? AND model = ? AND prompt_version = ?", key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE summaries SET last_accessed_at = ? WHERE content_hash = ? AND model = ? AND prompt_version = ?",
+            (time.time(), *key)
+        )
+        self.conn.commit()
+        return row[0]
+
+    def put(self, text: str, model: str, prompt_version: str, summary: str):
+        """写入一条摘要。"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO summaries (content_hash, model, prompt_version, summary, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (content_hash(text), model, prompt_version, summary, now, now)
+        )
+        self.conn.commit()
+
+    def evict(self):
+        """条目数超过上限时，删除最久未被访问的条目。返回删除的条目数。"""
+        if self.max_entries <= 0:
+            return 0
+        count = self.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return 0
+        self.conn.execute(
+            "DELETE FROM summaries WHERE rowid IN (SELECT rowid FROM summaries ORDER BY last_accessed_at ASC LIMIT ?)",
+            (overflow,)
+        )
+        self.conn.commit()
+        self.evictions += overflow
+        return overflow
+
+    def stats(self) -> dict:
+        """返回本次运行的命中统计以及缓存中的条目总数。"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0],
+        }
+
+    def close(self):
+        """执行淘汰并关闭连接。"""
+        self.evict()
+        self.conn.close()
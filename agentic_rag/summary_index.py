@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 内存摘要向量索引
+
+摘要集合每个文档只有一个向量，规模很小，分层检索第1步通过Chroma查询时，查询本身的固定开销远大于计算量。
+本模块把摘要向量放入一个连续的、按行归一化的 float32 矩阵，第1步只需一次矩阵-向量乘法加 argpartition：
+- 快照：矩阵保存为 .npy 文件并以内存映射方式加载，多个服务进程共享同一份页缓存；
+  行对应的摘要ID与来源保存在同名 .json 文件中。ingest.py 注入完成后写入快照。
+- 刷新：快照记录生成时的知识库索引版本（ingest.py 每次修改向量库后递增），
+  检索时发现版本变化就从摘要集合重新生成快照。
+- 相似度为余弦相似度；查询向量维度与快照不一致（例如更换了嵌入模型）时返回 None，由调用方回退到Chroma查询。
+
+对比与Chroma查询的耗时：
+    python -m agentic_rag.summary_index bench
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+# 动态地将根目录加入sys.path，以便能导入项目内的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agentic_rag.answer_cache import read_index_version
+from config import SUMMARY_INDEX_PATH, INDEX_VERSION_PATH
+
+def write_snapshot(summary_collection, path=SUMMARY_INDEX_PATH, batch_size=5000, version_path=INDEX_VERSION_PATH) -> int:
+    """从摘要集合分批读取向量，归一化后原子写入快照，返回向量数。"""
+    version = read_index_version(version_path)
+    ids, sources, blocks = [], [], []
+    total = summary_collection.count()
+    for offset in range(0, total, batch_size):
+        batch = summary_collection.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas"])
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        sources.extend((metadata or {}).get("source", item_id) for item_id, metadata in zip(batch["ids"], batch["metadatas"]))
+        blocks.append(np.asarray(batch["embeddings"], dtype=np.float32))
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # 多个进程可能同时重建，临时文件按进程区分，最后以 os.replace 原子替换
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(path + ".npy" + suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix))
+    with open(path + ".json" + suffix, 'w', encoding='utf-8') as f:
+        json.dump({"version": version, "ids": ids, "sources": sources}, f, ensure_ascii=False)
+    os.replace(path + ".npy" + suffix, path + ".npy")
+    os.replace(path + ".json" + suffix, path + ".json")
+    return len(ids)
+
+class SummaryIndex:
+    """基于内存映射快照的摘要向量索引。"""
+
+    def __init__(self, summary_collection, path=SUMMARY_INDEX_PATH, version_path=INDEX_VERSION_PATH):
+        self.summary_collection = summary_collection
+        self.path = path
+        self.version_path = version_path
+        self.matrix = None
+        self.ids = []
+        self.sources = []
+        self._version = None
+        self._version_mtime = -1
+        self._lock = threading.Lock()
+
+    def _load_snapshot(self) -> bool:
+        """加载与当前索引版本一致的快照；快照不存在、已过期或不完整时返回 False。"""
+        try:
+            with open(self.path + ".json", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(self.path + ".npy", mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if meta.get("version") != read_index_version(self.version_path) or len(matrix) != len(meta["ids"]):
+            return False
+        self.matrix, self.ids, self.sources = matrix, meta["ids"], meta["sources"]
+        self._version = meta["version"]
+        return True
+
+    def _refresh_locked(self):
+        """索引版本文件变化时重新加载快照，快照过期则先从摘要集合重建。"""
+        try:
+            mtime = os.stat(self.version_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._version_mtime and self.matrix is not None:
+            return
+        self._version_mtime = mtime
+        if self.matrix is not None and self._version == read_index_version(self.version_path):
+            return
+        if not self._load_snapshot():
+            start = time.perf_counter()
+            count = write_snapshot(self.summary_collection, self.path, version_path=self.version_path)
+            print(f"--- 已重建摘要向量快照: {count} 个向量，耗时 {time.perf_counter() - start:.2f} 秒 ---")
+            self._load_snapshot()
+
+    def refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    def search(self, query_embedding, n_results=3):
+        """
+        返回余弦相似度最高的 n_results 个摘要 [(来源, 相似度), ...]。
+        快照不可用或维度不一致时返回 None。
+        """
+        with self._lock:
+            self._refresh_locked()
+            matrix, sources = self.matrix, self.sources
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if matrix is None or matrix.ndim != 2 or matrix.shape[1] != query.shape[0]:
+            return None
+        if not len(matrix):
+            return []
+        scores = matrix @ (query / max(np.linalg.norm(query), 1e-12))
+        n_results = min(n_results, len(scores))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+        return [(sources[i], float(scores[i])) for i in top]
+
+# --- 与Chroma查询对比 ---
+
+def benchmark(summary_collection, n_queries=200, n_results=3, seed=0):
+    """用扰动后的摘要向量作为查询，对比Chroma查询与内存索引的耗时及前n个结果的重合率。"""
+    index = SummaryIndex(summary_collection)
+    index.refresh()
+    if index.matrix is None or not len(index.matrix):
+        print("摘要集合为空，无法进行对比。")
+        return
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(index.matrix), size=n_queries)
+    queries = np.asarray(index.matrix[rows]) + rng.normal(0, 0.05, size=(n_queries, index.matrix.shape[1])).astype(np.float32)
+
+    chroma_times, numpy_times, overlaps = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        chroma_result = summary_collection.query(query_embeddings=[query.tolist()], n_results=n_results, include=["metadatas"])
+        chroma_times.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        numpy_result = index.search(query, n_results)
+        numpy_times.append((time.perf_counter() - start) * 1000)
+        chroma_sources = {metadata.get("source") for metadata in chroma_result["metadatas"][0]}
+        overlaps.append(len(chroma_sources & {source for source, _ in numpy_result}) / max(len(chroma_sources), 1))
+
+    print(f"摘要向量: {len(index.matrix)} 个，维度 {index.matrix.shape[1]}，查询 {n_queries} 次，取前 {n_results} 个")
+    for name, times in (("Chroma", chroma_times), ("NumPy", numpy_times)):
+        print(f"  {name:<7} 平均 {np.mean(times):.3f} ms, p50 {np.percentile(times, 50):.3f} ms, "
+              f"p99 {np.percentile(times, 99):.3f} ms")
+    print(f"  加速 {np.mean(chroma_times) / max(np.mean(numpy_times), 1e-9):.1f} 倍，前 {n_results} 个结果重合率 {np.mean(overlaps):.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="内存摘要向量索引工具。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="从向量库的摘要集合重新生成快照。")
+    bench_parser = subparsers.add_parser("bench", help="对比Chroma查询与内存索引的耗时。")
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("-n", type=int, default=3)
+    args = parser.parse_args()
+
+    import chromadb
+    from ingest import PERSIST_PATH, SUMMARY_COLLECTION_NAME
+
+    client = chromadb.PersistentClient(path=PERSIST_PATH)
+    summary_collection = client.get_collection(SUMMARY_COLLECTION_NAME)
+    if args.command == "rebuild":
+        print(f"--- 摘要向量快照共包含 {write_snapshot(summary_collection)} 个向量 ---")
+    else:
+        benchmark(summary_collection, n_queries=args.queries, n_results=args.n)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 表格列式存储（DuckDB）
+
+表格存储模式（TABULAR_STORAGE_MODE = "duckdb"）下，Excel 的每个工作表写入一张带类型列的 DuckDB 表，
+取代“每行既作为摘要、又作为区块各嵌入一次”的做法：
+- 类型：工作表写完后按列推断类型（整数、浮点数、时间戳，其余为字符串）。EXCEL_METADATA_COLUMNS 中的
+  标识符列始终保留为字符串，避免编码丢失前导零。
+- 向量：每行只在区块集合中保存一个向量，且只嵌入 TABULAR_EMBED_COLUMNS 中的文本列；区块原文仍为整行文本。
+- 查询：筛选、统计、计数类问题由LLM根据表结构生成SQL，在只读连接上执行，不扫描向量也不嵌入任何行。
+
+DuckDB 同一时刻只允许一个进程以读写方式打开数据库，查询方在每次查询时短暂打开只读连接，
+注入进行中无法打开时视为没有结果，由调用方回退到其他检索策略。
+"""
+
+import re
+import json
+import hashlib
+import threading
+
+from config import EXCEL_METADATA_COLUMNS, TABULAR_DB_PATH, TABULAR_SQL_MAX_ROWS
+
+CATALOG_TABLE = "tabular_tables"
+ROW_INDEX_COLUMN = "_row_index"
+# 只允许单条查询语句
+READ_ONLY_SQL_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+def quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def table_name_for(source: str, sheet_name: str) -> str:
+    """工作表对应的表名（由来源与工作表名哈希得到，避免中文与特殊字符）。"""
+    return "t_" + hashlib.sha1(f"{source}|{sheet_name}".encode('utf-8')).hexdigest()[:16]
+
+def unique_columns(columns) -> list:
+    """列名去重（重复的表头追加序号），并避开内部行号列。"""
+    seen, names = {}, []
+    for column in columns:
+        name = str(column)
+        if name == ROW_INDEX_COLUMN:
+            name = f"{name}_"
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f"{name}.{count}")
+    return names
+
+class TabularStore:
+    """基于DuckDB的表格行存储。"""
+
+    def __init__(self, path=TABULAR_DB_PATH, read_only=False):
+        import duckdb
+
+        self.path = path
+        self.read_only = read_only
+        # SQL由LLM生成，禁止访问数据库以外的文件
+        self.conn = duckdb.connect(path, read_only=read_only, config={"enable_external_access": False})
+        if not read_only:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+                    table_name VARCHAR PRIMARY KEY, source VARCHAR NOT NULL, sheet_name VARCHAR NOT NULL,
+                    columns VARCHAR NOT NULL, row_count BIGINT NOT NULL
+                )
+            """)
+        self._lock = threading.Lock()
+
+    # --- 写入 ---
+
+    def begin_sheet(self, source: str, sheet_name: str, columns) -> str:
+        """为工作表创建字符串类型的暂存表，返回最终表名。已存在的同名表会被替换。"""
+        table = table_name_for(source, sheet_name)
+        self._drop_table(table)
+        column_defs = ", ".join(f"{quote_identifier(column)} VARCHAR" for column in unique_columns(columns))
+        self.conn.execute(f"CREATE TABLE {table}__staging ({ROW_INDEX_COLUMN} BIGINT, {column_defs})")
+        return table
+
+    def append(self, table: str, frame):
+        """追加一块行数据（DataFrame 的索引为行号，所有值均为字符串）。"""
+        staged = frame.copy()
+        staged.columns = unique_columns(frame.columns)
+        staged.insert(0, ROW_INDEX_COLUMN, frame.index.astype("int64"))
+        self.conn.register("_tabular_chunk", staged)
+        try:
+            self.conn.execute(f"INSERT INTO {table}__staging SELECT * FROM _tabular_chunk")
+        finally:
+            self.conn.unregister("_tabular_chunk")
+
+    def _infer_type(self, staging: str, column: str) -> str:
+        """推断一列的类型：所有非空值都能无损转换时使用该类型，否则为字符串。"""
+        if column in EXCEL_METADATA_COLUMNS:
+            return "VARCHAR"
+        quoted = quote_identifier(column)
+        non_empty = self.conn.execute(f"SELECT COUNT(*) FROM {staging} WHERE {quoted} <> ''").fetchone()[0]
+        if not non_empty:
+            return "VARCHAR"
+        # DuckDB 会把 '1.5' 四舍五入转换为整数，整数列需按格式严格判断；带前导零的数字串（编码）保留为字符串
+        conditions = {
+            "BIGINT": f"NOT regexp_full_match({quoted}, '-?[0-9]{{1,18}}') OR regexp_matches({quoted}, '^-?0[0-9]')",
+            "DOUBLE": f"TRY_CAST({quoted} AS DOUBLE) IS NULL OR regexp_matches({quoted}, '^-?0[0-9]')",
+            "TIMESTAMP": f"TRY_CAST({quoted} AS TIMESTAMP) IS NULL",
+        }
+        for column_type, condition in conditions.items():
+            failures = self.conn.execute(
+                f"SELECT COUNT(*) FROM {staging} WHERE {quoted} <> '' AND ({condition})"
+            ).fetchone()[0]
+            if failures == 0:
+                return column_type
+        return "VARCHAR"
+
+    def finish_sheet(self, table: str, source: str, sheet_name: str):
+        """推断列类型，把暂存表转换为最终表并登记到目录表。"""
+        staging = f"{table}__staging"
+        columns = [row[0] for row in self.conn.execute(f"DESCRIBE {staging}").fetchall()][1:]
+        column_types = [(column, self._infer_type(staging, column)) for column in columns]
+        selects = ", ".join(
+            f"CAST(NULLIF({quote_identifier(column)}, '') AS {column_type}) AS {quote_identifier(column)}"
+            for column, column_type in column_types
+        )
+        self.conn.execute(f"CREATE TABLE {table} AS SELECT {ROW_INDEX_COLUMN}, {selects} FROM {staging}")
+        self.conn.execute(f"DROP TABLE {staging}")
+        row_count = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?)",
+            [table, source, sheet_name, json.dumps(column_types, ensure_ascii=False), row_count]
+        )
+        return row_count
+
+    def _drop_table(self, table: str):
+        self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        self.conn.execute(f"DROP TABLE IF EXISTS {table}__staging")
+        self.conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE table_name = ?", [table])
+
+    def drop_source(self, source: str) -> int:
+        """删除某个源文件的全部工作表，返回删除的表数。"""
+        tables = [row[0] for row in self.conn.execute(
+            f"SELECT table_name FROM {CATALOG_TABLE} WHERE source = ?", [source]
+        ).fetchall()]
+        for table in tables:
+            self._drop_table(table)
+        return len(tables)
+
+    # --- 查询 ---
+
+    def tables(self) -> list:
+        """返回目录中的全部表：[{table_name, source, sheet_name, columns, row_count}, ...]。"""
+        try:
+            rows = self.conn.execute(
+                f"SELECT table_name, source, sheet_name, columns, row_count FROM {CATALOG_TABLE} ORDER BY source, sheet_name"
+            ).fetchall()
+        except Exception:
+            return []
+        return [
+            {"table_name": table, "source": source, "sheet_name": sheet, "columns": json.loads(columns), "row_count": count}
+            for table, source, sheet, columns, count in rows
+        ]
+
+    def describe(self) -> str:
+        """生成供LLM编写SQL使用的表结构说明。"""
+        lines = []
+        for table in self.tables():
+            lines.append(f"表 {table['table_name']}（来源: {table['source']}，工作表: {table['sheet_name']}，共 {table['row_count']} 行）")
+            for column, column_type in table["columns"]:
+                lines.append(f"  - {quote_identifier(column)} {column_type}")
+        return "\n".join(lines)
+
+    def query(self, sql: str, max_rows=TABULAR_SQL_MAX_ROWS):
+        """执行只读查询，返回 (列名列表, 行列表, 是否被截断)。"""
+        sql = sql.strip().rstrip(";").strip()
+        if not READ_ONLY_SQL_PATTERN.match(sql) or ";" in sql:
+            raise ValueError(f"只允许单条 SELECT 查询: {sql}")
+        with self._lock:
+            cursor = self.conn.execute(f"SELECT * FROM ({sql}) AS result LIMIT {int(max_rows) + 1}")
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        return columns, rows[:max_rows], len(rows) > max_rows
+
+    def close(self):
+        self.conn.close()
+
+def format_query_result(sql: str, columns, rows, truncated: bool) -> str:
+    """把查询结果渲染为文本，作为生成答案的上下文。"""
+    lines = [f"SQL查询: {sql}", f"查询结果（{len(rows)} 行{'，已截断' if truncated else ''}）:"]
+    lines.append(" | ".join(columns))
+    for row in rows:
+        lines.append(" | ".join("" if value is None else str(value) for value in row))
+    return "\n".join(lines)
@@ -46,3 +46,219 @@ LOCAL_EMBEDDING_MODEL_PATH = "BAAI/bge-m3"
 # 在加载Excel文件时，指定哪些列应该被提取为文档的元数据。
 # 这些列的值将作为键值对存储在向量库中，用于后续的过滤或更精确的检索。
 EXCEL_METADATA_COLUMNS = ["药品名称", "生产企业", "批准文号", "药品编码", "本位码"]
+# 分块读取Excel时每块的行数。大表按块流式读取，内存占用只与块大小相关。
+EXCEL_CHUNK_ROWS = 5000
+# Excel解析结果的Parquet缓存目录（按文件内容哈希命名），未变化的表格无需再次解析。
+# 注意：该目录位于 chroma_db 之外，`ingest.py --full` 重建向量库时缓存依然有效。
+EXCEL_PARQUET_CACHE_PATH = os.path.join(".cache", "excel")
+
+# --- 数据注入：摘要生成配置 ---
+# 摘要生成是网络/LLM密集型任务，使用asyncio并发调用，而不是按CPU核数开进程。
+# 同时在途的摘要请求上限
+SUMMARY_MAX_CONCURRENCY = 8
+# 每分钟token上限（按提示词长度估算），用于匹配LLM服务的速率限制；设为0表示不限速
+SUMMARY_TOKENS_PER_MINUTE = 200000
+# 摘要请求失败时的最大重试次数，以及指数退避的初始等待秒数
+SUMMARY_MAX_RETRIES = 5
+SUMMARY_RETRY_BASE_DELAY = 1.0
+# 文本切分所用的进程数（切分是CPU密集型任务，但开销很小，少量进程即可）
+INGEST_SPLIT_PROCESSES = 2
+# 持久化摘要缓存（SQLite），键为 (文档内容哈希, 模型名称, 摘要提示词版本)。
+# 更换嵌入模型或调整切分参数后重建索引时，无需再次调用LLM生成摘要。
+SUMMARY_CACHE_PATH = "summary_cache.sqlite"
+# 摘要缓存的最大条目数，超出后按最近最少使用（LRU）淘汰；设为0表示不限制
+SUMMARY_CACHE_MAX_ENTRIES = 200000
+# 摘要粒度："file" 时同一文件的全部页面（如PDF加载器逐页产出的文档）只生成一份摘要：
+# 先把相邻页面合并为分组并发生成分组摘要（map），再合并为一份文件摘要（reduce）；
+# "page" 时每页单独生成一份摘要。修改后请使用 `python ingest.py --full` 重建知识库。
+SUMMARY_MODE = "file"
+# map 阶段每个页面分组的最大字符数；reduce 阶段的输入超过该长度时分轮合并
+SUMMARY_MAP_GROUP_CHARS = 20000
+
+# --- 嵌入缓存配置 ---
+# 启用后，相同文本（归一化后）只会被嵌入一次：注入、记忆写入和重复查询都会复用缓存中的向量。
+EMBEDDING_CACHE_ENABLED = True
+# 嵌入缓存的磁盘目录（每个模型一个子目录）
+EMBEDDING_CACHE_PATH = os.path.join(".cache", "embeddings")
+# 磁盘上的向量精度：'float16' 占用一半空间，'float32' 保留完整精度
+EMBEDDING_CACHE_DTYPE = "float16"
+# 进程内LRU缓存的向量条数
+EMBEDDING_CACHE_LRU_SIZE = 10000
+
+# --- 本地嵌入模型（CPU）性能配置 (当 EMBEDDING_PROVIDER = 'local') ---
+# 推理后端: 'torch'（全精度）、'int8'（PyTorch动态量化，仅CPU）、'onnx'（ONNX Runtime，需要安装 optimum[onnxruntime]）
+LOCAL_EMBEDDING_BACKEND = "torch"
+# 每个批次的最大文本条数
+LOCAL_EMBEDDING_BATCH_SIZE = 32
+# 每个批次的最大token数（条数 x 批内最长文本的token数）。输入先按长度分桶，短文本可以组成更大的批次，减少padding浪费
+LOCAL_EMBEDDING_BATCH_TOKENS = 16384
+# 推理线程数，0 表示使用 PyTorch 默认值
+LOCAL_EMBEDDING_NUM_THREADS = 0
+# 最大序列长度（token）。bge-m3 默认 8192，但大多数区块远短于此；调小可显著降低长文本的计算量
+LOCAL_EMBEDDING_MAX_SEQ_LENGTH = 1024
+
+# --- 长期记忆检索配置 ---
+# 语义检索的候选过采样倍数：从向量库取回 top_k * 该倍数 条候选，再按语义、重要性与新近度的混合得分重排
+MEMORY_CANDIDATE_OVERSAMPLE = 3
+# 检索命中记忆的访问时间先在内存中合并，写线程空闲该秒数后（或下一次写操作前）以一次批量UPDATE写入，
+# 避免每次检索都提交一次写事务
+MEMORY_TOUCH_FLUSH_INTERVAL = 1.0
+
+# --- 异步执行配置 ---
+# 异步图中执行阻塞操作（ChromaDB、SQLite、本地嵌入模型）的线程数
+ASYNC_BLOCKING_WORKERS = 8
+
+# --- HTTP 服务配置 (server.py) ---
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+# uvicorn 工作进程数。每个进程各自加载一次嵌入模型与向量库集合
+SERVER_WORKERS = 1
+# 每个工作进程同时执行的图运行数上限，超出的请求排队等待
+SERVER_MAX_CONCURRENT_RUNS = 4
+# 每个工作进程的排队请求数上限，队列已满时直接返回 503
+SERVER_MAX_QUEUED_REQUESTS = 32
+# 请求在队列中的最长等待时间（秒），超时返回 503
+SERVER_QUEUE_TIMEOUT = 60
+# 会话状态的检查点存储: 'memory'（进程内，仅适用于单个工作进程）或 'sqlite'（需要安装 langgraph-checkpoint-sqlite，可在多个工作进程间共享）
+SERVER_CHECKPOINTER = "memory"
+SERVER_CHECKPOINT_PATH = "checkpoints.sqlite"
+
+# --- 答案流式输出 ---
+# 命令行（main.py）是否逐token打印答案。关闭时等待整个流程结束后再打印最终答案
+CLI_STREAM_RESPONSE = True
+
+# --- 并发扇出检索 ---
+# 启用后，内循环同时执行 hierarchical / direct_chunk / web 三种检索策略并并行评估相关性，
+# 按路由优先级取第一个相关结果并取消其余任务。延迟更低，但每个问题都会调用网络搜索和多次评估。
+RETRIEVAL_FANOUT_ENABLED = False
+
+# --- 本地快速路由 ---
+# 启用后，先用嵌入模型的最近质心分类器判断路由，置信度不足时才调用LLM路由链
+# 训练/刷新模型: python -m agentic_rag.local_router train
+LOCAL_ROUTER_ENABLED = True
+LOCAL_ROUTER_MODEL_PATH = "local_router.npz"
+# 本地路由的置信度阈值（0~1），低于该值时交给LLM决策
+LOCAL_ROUTER_CONFIDENCE_THRESHOLD = 0.8
+# 将余弦相似度转换为置信度的 softmax 温度，越小则置信度越“尖锐”
+LOCAL_ROUTER_TEMPERATURE = 0.05
+# 路由决策日志（JSON Lines）。LLM做出的决策会作为本地路由的训练样本
+ROUTER_DECISION_LOG_PATH = "router_decisions.jsonl"
+
+# --- 语义答案缓存 ---
+# 启用后，工作流入口先按查询向量查找相似的历史问题，命中时直接返回缓存的答案。
+# 缓存按此前的对话历史区分上下文：会话首轮的独立问题在各会话间共享，依赖前文的追问不会命中其他会话的答案
+ANSWER_CACHE_ENABLED = True
+# 命中所需的最低余弦相似度。阈值过低可能把不同的问题（例如不同药品）当成同一个问题
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+# 缓存答案的有效期（秒）
+ANSWER_CACHE_TTL = 24 * 3600
+# 网络搜索得到的答案的有效期（秒），网络信息时效性更强
+ANSWER_CACHE_WEB_TTL = 600
+# 每个进程缓存的答案条数上限，超出时按LRU淘汰
+ANSWER_CACHE_MAX_ENTRIES = 2000
+# 知识库索引版本文件。ingest.py 每次修改向量库后更新该版本，缓存的答案随之失效
+INDEX_VERSION_PATH = os.path.join(".cache", "index_version")
+
+# --- LLM 调用缓存 ---
+# 系统中的链都以 temperature=0 调用，启用后相同输入（模型参数 + 渲染后的消息）的结果会被持久化复用
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "llm_cache.sqlite"
+# 缓存条目数上限，超出时按最近访问时间淘汰
+LLM_CACHE_MAX_ENTRIES = 100000
+# 各条链是否启用缓存。
+# 'answer'（答案生成与直接回答）默认关闭：启用后该链不再逐token流式输出，而是一次性返回完整答案。
+# 'evaluation' 为 evaluation.py 中 Ragas 评估使用的LLM。
+LLM_CACHE_CHAINS = {
+    "router": True,
+    "initial_rewriter": True,
+    "correctional_rewriter": True,
+    "document_grader": True,
+    "answer_grader": True,
+    "summarizer": True,
+    "summary_reducer": True,
+    "memory_consolidation": True,
+    "sql_generator": True,
+    "answer": False,
+    "evaluation": True,
+}
+
+# --- 本地重排序 ---
+# 启用后，本地检索先取回更多候选区块，由交叉编码器逐个打分，只保留高分区块；
+# 只有得分不确定时才调用LLM评估文档相关性
+RERANKER_ENABLED = True
+RERANKER_MODEL_PATH = "BAAI/bge-reranker-v2-m3"
+RERANKER_DEVICE = "cpu"
+RERANKER_BATCH_SIZE = 16
+# 每个 (问题, 区块) 对的最大token数
+RERANKER_MAX_LENGTH = 512
+# 启用重排序时，每次本地检索取回的候选区块数
+RERANKER_CANDIDATES = 20
+# 重排序后最多保留的区块数
+RERANKER_TOP_N = 5
+# 得分（0~1）低于该值的区块被丢弃
+RERANKER_KEEP_THRESHOLD = 0.3
+# 最高分不低于该值时直接判定为相关，跳过LLM评估
+RERANKER_ACCEPT_THRESHOLD = 0.7
+# 最高分低于该值时直接判定为不相关，跳过LLM评估
+RERANKER_REJECT_THRESHOLD = 0.05
+
+# --- 词法倒排索引（BM25） ---
+# 启用后，ingest.py 同步维护区块的倒排索引，直接区块检索将BM25结果与向量检索结果按RRF融合；
+# 纯编码查询（如批准文号、本位码）只走词法检索
+LEXICAL_INDEX_ENABLED = True
+# 索引文件位于向量库目录中，`ingest.py --full` 重建向量库时一并重建
+LEXICAL_INDEX_PATH = os.path.join("chroma_db", "lexical_index.sqlite")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 文档频率超过总区块数该比例的词被视为常用词，查询中有其他词时忽略
+LEXICAL_MAX_DF_RATIO = 0.2
+# 词法检索的候选数
+LEXICAL_CANDIDATES = 20
+# 倒数排名融合（RRF）的平滑常数
+RRF_K = 60
+
+# --- 精确元数据索引 ---
+# 启用后，ingest.py 把表格行的 EXCEL_METADATA_COLUMNS 连同区块ID写入索引；
+# 本地检索前先用问题中的编码（批准文号、本位码等）查表，命中时跳过嵌入与向量检索
+METADATA_INDEX_ENABLED = True
+METADATA_INDEX_PATH = os.path.join("chroma_db", "metadata_index.sqlite")
+
+# --- 表格列式存储 ---
+# "duckdb"：Excel 行写入 DuckDB 带类型列的表，每行只在区块集合中嵌入一次，并支持SQL统计查询；
+# "chroma"：旧模式，每行同时作为摘要和区块嵌入两次
+TABULAR_STORAGE_MODE = "duckdb"
+TABULAR_DB_PATH = os.path.join("chroma_db", "tabular.duckdb")
+# 表格行只嵌入这些文本列（不存在于表中的列会被忽略；为空或都不存在时嵌入整行）
+TABULAR_EMBED_COLUMNS = ["药品名称", "生产企业"]
+# SQL查询结果返回给LLM的最大行数
+TABULAR_SQL_MAX_ROWS = 50
+
+# --- 上下文打包 ---
+# 生成答案时上下文（检索片段）的token预算
+CONTEXT_TOKEN_BUDGET = 3000
+# 计算token数使用的 tiktoken 编码（无法加载时按字符数估算）
+CONTEXT_TOKENIZER_ENCODING = "cl100k_base"
+# 字符三元组 Jaccard 相似度不低于该值的片段视为重复
+CONTEXT_NEAR_DUPLICATE_THRESHOLD = 0.85
+# 是否把片段压缩为与问题最相似的几个句子（需要为句子计算嵌入）
+CONTEXT_COMPRESSION_ENABLED = False
+CONTEXT_COMPRESSION_SENTENCES = 3
+
+# --- 注入时近重复检测 ---
+# 启用后，与已注入内容近乎相同的文档不再摘要与嵌入、区块不再嵌入，只保存一个规范向量并记录别名来源
+NEAR_DUP_ENABLED = True
+NEAR_DUP_INDEX_PATH = os.path.join("chroma_db", "near_dup.sqlite")
+# 估计的 Jaccard 相似度不低于该值视为近重复
+NEAR_DUP_THRESHOLD = 0.9
+# 字符 n-gram 的长度
+NEAR_DUP_SHINGLE_SIZE = 5
+# MinHash 签名长度与LSH分段数（每段行数 = 签名长度 / 分段数）
+MINHASH_NUM_PERM = 64
+MINHASH_BANDS = 16
+
+# --- 内存摘要向量索引 ---
+# 启用后，分层检索第1步在内存映射的归一化摘要向量矩阵上计算余弦相似度，不再查询Chroma；
+# 第2步仍在区块集合中按来源过滤检索
+SUMMARY_INDEX_ENABLED = True
+# 快照文件前缀（生成 .npy 与 .json 两个文件），ingest.py 注入完成后写入，索引版本变化时自动重建
+SUMMARY_INDEX_PATH = os.path.join("chroma_db", "summary_index")
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 长期记忆检索延迟基准测试
+
+在临时目录中构造不同规模的记忆表（SQLite + ChromaDB，使用随机向量，不加载嵌入模型），
+分别测量批量向量化检索（当前实现）与逐条查询SQLite的旧实现的检索延迟，观察延迟随表规模的变化。
+两种实现都包含访问时间的更新：旧实现在检索中同步执行 UPDATE 并提交，当前实现把访问时间合并后交给写线程，
+批量检索的计时结束后会等待合并的访问时间写入完成（单独报告该耗时）。
+
+用法:
+    python ./evaluation/benchmark_memory.py --sizes 1000 10000 100000
+"""
+import sys
+import os
+import math
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+
+import numpy as np
+import chromadb
+
+# --- 路径处理 ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agentic_rag.memory import MemoryStore, MEMORY_COLLECTION_NAME, SQL_CREATE_TABLE, SQL_INSERT
+
+DIM = 64
+CHROMA_BATCH_SIZE = 4096
+
+def build_store(workdir, size, rng):
+    """写入 size 条随机记忆，返回使用该数据的 MemoryStore。"""
+    db_path = os.path.join(workdir, "memory.sqlite")
+    client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+    collection = client.get_or_create_collection(MEMORY_COLLECTION_NAME, embedding_function=None)
+
+    store = MemoryStore(db_path=db_path, persist_path=workdir, collection=collection)
+    now = datetime.datetime.now()
+    rows = []
+    for i in range(size):
+        accessed = str(now - datetime.timedelta(hours=float(rng.integers(0, 24 * 365))))
+        rows.append((f"记忆 {i}", "fact", int(rng.integers(1, 11)), accessed, accessed))
+
+    def insert_all(conn):
+        conn.execute(SQL_CREATE_TABLE)
+        conn.executemany(SQL_INSERT, rows)
+        conn.commit()
+    store.submit_write(insert_all).result()
+
+    embeddings = rng.standard_normal((size, DIM)).astype(np.float32)
+    for start in range(0, size, CHROMA_BATCH_SIZE):
+        end = min(start + CHROMA_BATCH_SIZE, size)
+        collection.add(ids=[str(i + 1) for i in range(start, end)], embeddings=embeddings[start:end])
+    return store
+
+def legacy_retrieve(store, query_embedding, top_k):
+    """旧实现：对每个候选单独执行一次 SELECT，在Python循环中计算得分，并同步更新访问时间。"""
+    results = store.collection.query(query_embeddings=[query_embedding], n_results=top_k * 3)
+    ranked = []
+    now = datetime.datetime.now()
+    with store.read_connection() as conn:
+        for id_str, distance in zip(results['ids'][0], results['distances'][0]):
+            res = conn.execute("SELECT * FROM memories WHERE id = ?", (int(id_str),)).fetchone()
+            if not res:
+                continue
+            last_accessed = datetime.datetime.fromisoformat(res['last_accessed_at'])
+            hours = (now - last_accessed).total_seconds() / 3600
+            score = (1.0 / (1.0 + distance)) * (1 + 0.1 * res['importance']) * (1 + 0.5 / (1.0 + math.log1p(hours)))
+            ranked.append((score, res['id']))
+    ranked.sort(reverse=True)
+    top = ranked[:top_k]
+    retrieved_ids = [memory_id for _, memory_id in top]
+    if retrieved_ids:
+        def touch(conn):
+            conn.execute(f"UPDATE memories SET last_accessed_at = ? WHERE id IN ({','.join('?'*len(retrieved_ids))})", (str(now), *retrieved_ids))
+            conn.commit()
+        store.submit_write(touch).result()
+    return top
+
+def measure(func, queries):
+    """返回每次调用的平均与P95延迟（毫秒）。"""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+def main():
+    parser = argparse.ArgumentParser(description="长期记忆检索延迟随记忆表规模变化的基准测试。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="记忆表规模。")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模下的查询次数。")
+    parser.add_argument("--top_k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'规模':>10} | {'批量检索 平均/P95 (ms)':>24} | {'访问时间写入 (ms)':>16} | {'逐条检索 平均/P95 (ms)':>24}")
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="memory_bench_")
+        try:
+            store = build_store(workdir, size, rng)
+            queries = [rng.standard_normal(DIM).astype(np.float32).tolist() for _ in range(args.queries)]
+            batched = measure(lambda q: store.retrieve("", args.top_k, query_embedding=q), queries)
+            start = time.perf_counter()
+            store.flush_touches()
+            flush_ms = (time.perf_counter() - start) * 1000
+            legacy = measure(lambda q: legacy_retrieve(store, q, args.top_k), queries)
+            print(f"{size:>10} | {batched[0]:>11.2f} / {batched[1]:<10.2f} | {flush_ms:>16.2f} | {legacy[0]:>11.2f} / {legacy[1]:<10.2f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
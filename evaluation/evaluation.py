@@ -27,7 +27,8 @@ from agentic_rag.nodes import (
     grade_relevance_node
 )
 # 导入项目中已配置好的llm和embedding function，用于传递给Ragas
-from agentic_rag.chains import llm, get_embedding_function
+from agentic_rag.chains import get_chain_llm, get_embedding_function, enable_llm_cache, get_llm_cache
+from config import LLM_CACHE_CHAINS, LLM_CACHE_ENABLED
 
 # --- 全局配置 ---
 DATASET_PATH = os.path.join(os.path.dirname(__file__), "golden_dataset.csv")
@@ -112,7 +113,7 @@ def evaluate_generator_and_retriever():
         return
 
     # 我们将评估所有需要从本地知识库检索的场景
-    rag_questions_df = df[df['ideal_route'].isin(['vectorstore', 'direct_chunk_search', 'hierarchical_search'])].copy()
+    rag_questions_df = df[df['ideal_route'].isin(['vectorstore', 'direct_chunk_search', 'hierarchical_search', 'tabular_sql'])].copy()
     if rag_questions_df.empty:
         print("数据集中没有找到需要本地检索的问题，跳过生成评估ảng")
         return
@@ -172,7 +173,7 @@ def evaluate_generator_and_retriever():
         result = evaluate(
             dataset=dataset,
             metrics=[faithfulness, answer_relevancy, context_recall],
-            llm=llm,
+            llm=get_chain_llm("evaluation"),
             embeddings=get_embedding_function(),
         )
         print(result)
@@ -185,8 +186,13 @@ def evaluate_generator_and_retriever():
 
 def main():
     """主函数，按顺序执行所有评估。"""
+    # 评估时所有链（包括答案生成）都使用LLM缓存：数据与提示词未变化时，重复运行评估不会产生任何LLM调用
+    enable_llm_cache(*LLM_CACHE_CHAINS)
     evaluate_router()
     evaluate_generator_and_retriever()
+    if LLM_CACHE_ENABLED:
+        stats = get_llm_cache().stats()
+        print(f"\nLLM缓存: 命中 {stats['hits']} 次，未命中（实际调用LLM） {stats['misses']} 次")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 兼容OpenAI API的本地桩LLM服务
+
+用于在没有真实模型服务的情况下测试 server.py 和工作流图（包括并发与流式输出）：
+- /v1/chat/completions: 根据提示词中的输出格式说明返回固定的JSON（路由、重写、相关性评估、记忆提炼），
+  其余请求返回一段固定答案；支持 stream=true 的流式响应。
+- /v1/embeddings: 返回由文本哈希生成的确定性向量（当 EMBEDDING_PROVIDER = 'openai' 时使用）。
+
+用法:
+    python ./evaluation/stub_llm_server.py --port 8765 --route direct_chunk_search --delay 0.2
+    OPENAI_API_KEY=stub OPENAI_API_BASE=http://127.0.0.1:8765/v1 python server.py
+"""
+
+import json
+import time
+import hashlib
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+STUB_ANSWER = "这是桩LLM服务返回的测试答案，用于验证流式输出与并发处理。"
+EMBEDDING_DIM = 32
+STREAM_CHUNK_CHARS = 4
+
+def stub_embedding(text: str):
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [byte / 255.0 for byte in digest[:EMBEDDING_DIM]]
+
+def stub_completion(messages, route: str) -> str:
+    """根据提示词中的JSON字段名判断是哪一条链，返回对应的固定输出。"""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    if '"rewritten_query"' in prompt:
+        return json.dumps({"rewritten_query": messages[-1].get("content", "")}, ensure_ascii=False)
+    if '"datasource"' in prompt:
+        return json.dumps({"datasource": route})
+    if '"is_relevant"' in prompt:
+        return json.dumps({"is_relevant": True})
+    if '"sql"' in prompt:
+        # 桩服务不理解表结构，返回空查询使检索回退到直接区块检索
+        return json.dumps({"sql": ""})
+    if '"importance"' in prompt:
+        return json.dumps({"text": "No valuable information to save", "type": "fact", "importance": 1})
+    return STUB_ANSWER
+
+class StubHandler(BaseHTTPRequestHandler):
+    route = "direct_chunk_search"
+    delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        for i, piece in enumerate(pieces + [None]):
+            delta = {} if piece is None else {"content": piece}
+            if i == 0:
+                delta["role"] = "assistant"
+            chunk = {
+                "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if piece is None else None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.delay / max(len(pieces), 1))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"]
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            return self._send_json({
+                "object": "list", "model": "stub",
+                "data": [{"object": "embedding", "index": i, "embedding": stub_embedding(str(text))} for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        content = stub_completion(request.get("messages", []), self.route)
+        if request.get("stream"):
+            return self._send_stream(content)
+        time.sleep(self.delay)
+        self._send_json({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+def main():
+    parser = argparse.ArgumentParser(description="兼容OpenAI API的本地桩LLM服务。")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--route", type=str, default="direct_chunk_search",
+                        choices=["direct_chunk_search", "hierarchical_search", "tabular_sql", "web_search", "direct"], help="路由链返回的策略。")
+    parser.add_argument("--delay", type=float, default=0.0, help="每次补全的模拟延迟（秒）。")
+    args = parser.parse_args()
+
+    StubHandler.route = args.route
+    StubHandler.delay = args.delay
+    print(f"--- 桩LLM服务运行于 http://{args.host}:{args.port}/v1 ---")
+    ThreadingHTTPServer((args.host, args.port), StubHandler).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,25 @@
 """
 @desc: 数据注入脚本（已升级为并行与批处理模式）
 
-本脚本使用多进程并行处理文档，并通过批处理方式存入数据库，以提升注入效率。
+本脚本以流式管道处理文档：摘要生成通过 asyncio 并发调用LLM（带并发上限、速率限制与重试），
+文本切分交给一个小型进程池，结果通过批处理方式存入数据库，以提升注入效率。
+默认以增量模式运行：通过持久化的清单文件（manifest）记录每个源文件的大小、修改时间、
+内容哈希及其产出的摘要/区块ID，仅处理新增或变更的文件，并清理已删除文件的向量。
+使用 `--full` 参数可删除旧库并全量重建。
 """
 
 import os
+import json
+import time
 import shutil
+import hashlib
+import asyncio
+import argparse
 import multiprocessing
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-import pandas as pd
 import chromadb
-from langchain_core.documents import Document
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
@@ -22,57 +31,573 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # 在加载其他模块前，先加载配置，确保环境变量等设置生效
 import config
-from agentic_rag.chains import get_embedding_function, get_summarizer_chain
-from config import EXCEL_METADATA_COLUMNS
+from agentic_rag.chains import get_embedding_function
+from agentic_rag.excel_loader import (
+    iter_excel_documents, iter_excel_frames, build_row_texts, build_row_metadatas, prune_cache as prune_excel_cache
+)
+from agentic_rag.chains import SUMMARIZER_PROMPT_VERSION
+from agentic_rag.summarizer import AsyncSummarizer
+from agentic_rag.summary_cache import SummaryCache
+from agentic_rag.answer_cache import bump_index_version
+from agentic_rag.summary_index import write_snapshot
+from agentic_rag.lexical_index import LexicalIndex
+from agentic_rag.metadata_index import MetadataIndex
+from agentic_rag.near_dedup import NearDuplicateIndex, apply_alias_metadata
+from config import (
+    LLM_MODEL_NAME, SUMMARY_MAX_CONCURRENCY, INGEST_SPLIT_PROCESSES, LEXICAL_INDEX_ENABLED, METADATA_INDEX_ENABLED,
+    TABULAR_STORAGE_MODE, TABULAR_EMBED_COLUMNS, NEAR_DUP_ENABLED, SUMMARY_MODE, SUMMARY_INDEX_ENABLED
+)
 
 # --- 配置 ---
 DATA_PATH = "data"
 PERSIST_PATH = "chroma_db"
 SUMMARY_COLLECTION_NAME = "doc_summaries"
 CHUNK_COLLECTION_NAME = "doc_chunks"
+# 增量注入清单：记录每个已注入文件的指纹及其产出的向量ID
+MANIFEST_PATH = os.path.join(PERSIST_PATH, "ingest_manifest.json")
+MANIFEST_VERSION = 1
+# 定义一个合理的批次大小
+CHROMA_BATCH_SIZE = 4096
+# 流式管道参数：写入批次大小决定了内存峰值，在途任务上限为各阶段之间队列的背压窗口
+WRITE_BATCH_SIZE = 512
+MAX_PENDING_DOCS_PER_PROCESS = 4
+# 加载线程每次从加载器中拉取的文档数
+LOAD_BATCH_SIZE = 64
+# 文本切分参数
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+LOADER_MAP = {'.pdf': PyPDFLoader, '.txt': TextLoader, '.md': UnstructuredMarkdownLoader, '.docx': UnstructuredWordDocumentLoader, '.doc': UnstructuredWordDocumentLoader}
+EXCEL_EXTENSIONS = ['.xlsx', '.xls']
 
-# --- 工作函数：用于并行处理 ---
-def process_document_worker(doc):
-    """
-    对单个文档进行摘要生成和文本切分的工作函数。
-    注意：为了避免多进程中的序列化问题，此函数内部会自行初始化所需的链和分割器。
-    """
-    summarizer_chain = get_summarizer_chain()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    
-    doc_content = doc.page_content
+# --- 工作函数：切分进程 ---
+# 分割器在每个切分进程中只初始化一次（通过进程池的 initializer），而不是每个文档重建一次。
+_text_splitter = None
+
+def init_split_worker():
+    """切分进程的初始化函数。"""
+    global _text_splitter
+    # 记录区块在页面中的起始字符位置（start_index），用于生成稳定的区块ID
+    _text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+
+def split_document_worker(doc):
+    """将单个文档切分为区块，返回 (区块文本列表, 区块元数据列表)。"""
+    if _text_splitter is None:
+        init_split_worker()
+    splits = _text_splitter.split_documents([doc])
+    return [split.page_content for split in splits], [split.metadata for split in splits]
+
+def get_doc_source(doc):
+    """生成文档的唯一来源标识，作为摘要ID及区块ID的前缀。"""
     doc_source = doc.metadata.get('source', 'unknown_source')
+    if 'sheet_name' in doc.metadata:
+        doc_source = f"{doc_source}_{doc.metadata['sheet_name']}"
     if 'row_index' in doc.metadata:
         doc_source = f"{doc_source}_row_{doc.metadata['row_index']}"
+    if 'page' in doc.metadata:
+        doc_source = f"{doc_source}_page_{doc.metadata['page']}"
+    return doc_source
 
-    try:
-        # 1. 根据数据类型智能生成摘要
-        doc_type = doc.metadata.get('data_type', 'narrative') # 默认为叙事型
-        summary = ""
+def make_chunk_ids(doc_source, chunk_metadatas):
+    """
+    生成稳定且唯一的区块ID：叙事型文档为 "{文件}_page_{页码}_offset_{页内起始字符}"（没有页码时省略页码部分），
+    其余（表格行）为 "{来源}_chunk_{序号}"。
+    """
+    ids, seen = [], set()
+    for i, metadata in enumerate(chunk_metadatas):
+        start = metadata.get('start_index', -1)
+        if metadata.get('data_type') != 'narrative' or start < 0:
+            chunk_id = f"{doc_source}_chunk_{i}"
+        else:
+            page = f"_page_{metadata['page']}" if 'page' in metadata else ""
+            chunk_id = f"{metadata.get('source', doc_source)}{page}_offset_{start}"
+        if chunk_id in seen:
+            chunk_id = f"{chunk_id}_{i}"
+        seen.add(chunk_id)
+        ids.append(chunk_id)
+    return ids
+
+def group_pages_by_file(documents):
+    """
+    文件级摘要模式下，把同一文件相邻产出的叙事型文档（如PDF的各页）合并为一个页面列表产出；
+    表格行等其他文档原样逐个产出。
+    """
+    pages = []
+    for doc in documents:
+        if doc.metadata.get('data_type', 'narrative') != 'narrative':
+            yield doc
+            continue
+        if pages and pages[0].metadata.get('source') != doc.metadata.get('source'):
+            yield pages
+            pages = []
+        pages.append(doc)
+    if pages:
+        yield pages
+
+async def split_document(doc, split_executor):
+    """切分单个文档。短文档（例如表格行）只会切分出它自身，直接在主进程中切分以免去进程间传输的开销。"""
+    if len(doc.page_content) <= CHUNK_SIZE:
+        return split_document_worker(doc)
+    return await asyncio.get_running_loop().run_in_executor(split_executor, split_document_worker, doc)
+
+# --- 工作协程：摘要与切分 ---
+async def process_document_worker(doc, summarizer, split_executor, summary_cache, near_dup=None):
+    """
+    对单个文档并发地进行摘要生成和文本切分。
+    叙事型文档先查询持久化摘要缓存，未命中时才调用LLM。
+    启用近重复检测时，与已注入文档近乎相同的叙事型文档只记录别名、不再生成摘要（摘要为None），
+    但仍然切分，其区块在写入时逐个做区块级检测，副本中不同的区块会被保留。
+    """
+    doc_content = doc.page_content
+    file_path = doc.metadata.get('source', 'unknown_source')
+    doc_source = get_doc_source(doc)
+    doc_type = doc.metadata.get('data_type', 'narrative') # 默认为叙事型
+    is_duplicate = (near_dup is not None and doc_type == 'narrative'
+                    and near_dup.find_or_add("doc", doc_source, file_path, doc_content) is not None)
+
+    async def summarize():
+        if is_duplicate:
+            return None
+        # 根据数据类型智能生成摘要
         if doc_type == 'narrative':
-            # 对叙事型文档，调用LLM生成摘要
-            summary = summarizer_chain.invoke({"document_content": doc_content}).content
-        elif doc_type == 'tabular':
-            # 对表格型数据，直接使用原文作为摘要，免除LLM调用
-            summary = doc_content
-        
-        summary_metadata = {"source": doc_source}
-
-        # 2. 切分区块（对于表格行，通常只切分出它自身）
-        splits = text_splitter.split_documents([doc])
-        chunk_docs = [split.page_content for split in splits]
-        chunk_metadatas = [split.metadata for split in splits]
-        chunk_ids = [f"{doc_source}_chunk_{i}" for i in range(len(splits))]
-
-        return (doc_source, summary, summary_metadata, chunk_ids, chunk_docs, chunk_metadatas)
+            # 对叙事型文档，优先复用缓存中的摘要，否则调用LLM生成并写入缓存
+            summary = summary_cache.get(doc_content, LLM_MODEL_NAME, SUMMARIZER_PROMPT_VERSION)
+            if summary is None:
+                summary = await summarizer.summarize(doc_content)
+                summary_cache.put(doc_content, LLM_MODEL_NAME, SUMMARIZER_PROMPT_VERSION, summary)
+            return summary
+        # 对表格型数据，直接使用原文作为摘要，免除LLM调用
+        return doc_content
+
+    try:
+        summary, (chunk_docs, chunk_metadatas) = await asyncio.gather(summarize(), split_document(doc, split_executor))
+        summary_metadata = None if summary is None else {"source": doc_source}
+        if summary is not None and 'page' in doc.metadata:
+            # 摘要按页存储，但区块的 source 是文件路径，分层检索按 source 定位区块
+            summary_metadata = {"source": file_path, "page": doc.metadata['page']}
+        chunk_ids = make_chunk_ids(doc_source, chunk_metadatas)
+        return (file_path, doc_source, summary, summary_metadata, chunk_ids, chunk_docs, chunk_metadatas)
     except Exception as e:
         print(f"处理文档 {doc_source} 时出错: {e}")
+        if near_dup is not None:
+            # 规范条目不会被写入，不能再作为后续副本的别名目标
+            near_dup.discard("doc", [doc_source])
+        return None
+
+async def process_file_worker(pages, summarizer, split_executor, summary_cache, near_dup=None):
+    """
+    文件级摘要模式：同一文件的全部页面只生成一份摘要（分组map-reduce，分组摘要与合并结果都写入摘要缓存），
+    各页分别切分。摘要ID为文件路径，区块ID由文件、页码与页内偏移组成。
+    与已注入文件近乎相同的文件只跳过摘要，各页照常切分并做区块级检测。
+    """
+    file_path = pages[0].metadata.get('source', 'unknown_source')
+    page_texts = [page.page_content for page in pages]
+    is_duplicate = (near_dup is not None
+                    and near_dup.find_or_add("doc", file_path, file_path, "\n\n".join(page_texts)) is not None)
+
+    async def cached_summarize(content, reduce=False):
+        prompt_version = f"{SUMMARIZER_PROMPT_VERSION}-reduce" if reduce else SUMMARIZER_PROMPT_VERSION
+        summary = summary_cache.get(content, LLM_MODEL_NAME, prompt_version)
+        if summary is None:
+            summary = await summarizer.summarize(content, reduce=reduce)
+            summary_cache.put(content, LLM_MODEL_NAME, prompt_version, summary)
+        return summary
+
+    async def summarize():
+        if is_duplicate:
+            return None
+        return await summarizer.summarize_pages(page_texts, cached_summarize)
+
+    try:
+        summary, *splits = await asyncio.gather(summarize(), *(split_document(page, split_executor) for page in pages))
+        chunk_docs = [text for texts, _ in splits for text in texts]
+        chunk_metadatas = [metadata for _, metadatas in splits for metadata in metadatas]
+        summary_metadata = None if summary is None else {"source": file_path, "pages": len(pages)}
+        chunk_ids = make_chunk_ids(file_path, chunk_metadatas)
+        return (file_path, file_path, summary, summary_metadata, chunk_ids, chunk_docs, chunk_metadatas)
+    except Exception as e:
+        print(f"处理文件 {file_path} 时出错: {e}")
+        if near_dup is not None:
+            near_dup.discard("doc", [file_path])
         return None
 
+# --- 增量注入：清单管理 ---
+def compute_file_hash(file_path, block_size=1 << 20):
+    """分块计算文件内容的SHA-256哈希，避免一次性读入大文件。"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def load_manifest():
+    """读取注入清单，不存在或版本不匹配时返回空清单。"""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"警告：读取注入清单失败，将按全新注入处理: {e}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("files", {})
+
+def save_manifest(files):
+    """原子地写入注入清单（先写临时文件再替换）。"""
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def diff_against_manifest(file_paths, manifest):
+    """
+    将当前文件列表与清单比对，返回 (待处理文件, 未变更文件的清单条目, 已删除文件)。
+    大小和修改时间均未变的文件直接视为未变更；否则再比对内容哈希，仅“touch”过的文件不会被重新处理。
+    """
+    to_process, unchanged = {}, {}
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        entry = manifest.get(file_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged[file_path] = entry
+            continue
+        content_hash = compute_file_hash(file_path)
+        if entry and entry["hash"] == content_hash:
+            unchanged[file_path] = {**entry, "size": stat.st_size, "mtime": stat.st_mtime}
+            continue
+        to_process[file_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": content_hash}
+    removed = [path for path in manifest if path not in unchanged and path not in to_process]
+    return to_process, unchanged, removed
+
+def delete_ids_in_batches(collection, ids):
+    """分批从集合中删除指定ID。"""
+    for i in range(0, len(ids), CHROMA_BATCH_SIZE):
+        collection.delete(ids=ids[i:i + CHROMA_BATCH_SIZE])
+
+def delete_chunks(chunk_ids, chunk_collection, lexical_index=None, metadata_index=None):
+    """从区块集合及词法、元数据索引中删除指定区块。"""
+    delete_ids_in_batches(chunk_collection, chunk_ids)
+    if lexical_index is not None:
+        lexical_index.delete(chunk_ids)
+    if metadata_index is not None:
+        metadata_index.delete(chunk_ids)
+
+# --- 流式管道：有界队列与批量写入 ---
+class ChromaBatchSink:
+    """
+    批量“嵌入并写入”的汇聚端。
+    摘要与区块分别累积到批次大小后写入ChromaDB（嵌入在写入时完成），
+    同时记录每个源文件产出的ID，供更新注入清单使用。
+    """
+
+    def __init__(self, summary_collection, chunk_collection, batch_size=WRITE_BATCH_SIZE, lexical_index=None,
+                 metadata_index=None, near_dup=None):
+        self.summary_collection = summary_collection
+        self.chunk_collection = chunk_collection
+        self.lexical_index = lexical_index
+        self.metadata_index = metadata_index
+        self.near_dup = near_dup
+        self.batch_size = batch_size
+        self.file_ids = {}
+        # 加载或处理失败的文件：不写入清单，已写入的向量在管道结束后删除
+        self.failed_paths = set()
+        self.summary_count = 0
+        self.chunk_count = 0
+        self.skipped_summaries = 0
+        self.skipped_chunks = 0
+        # 写入（含嵌入）的累计耗时，用于估算近重复检测节省的时间
+        self.write_seconds = 0.0
+        self._summaries = ([], [], [])
+        self._chunks = ([], [], [])
+
+    def add(self, result):
+        """接收一个文档的处理结果并放入缓冲区。"""
+        file_path, doc_source, summary, summary_metadata, chunk_ids, chunk_docs, chunk_metadatas = result
+        ids = self.file_ids.setdefault(file_path, {"summary_ids": [], "chunk_ids": []})
+        # 近重复条目的ID同样记入清单，文件变化时据此清理别名记录
+        ids["summary_ids"].append(doc_source)
+        ids["chunk_ids"].extend(chunk_ids)
+
+        if summary is None:
+            self.skipped_summaries += 1
+        else:
+            self._append(self._summaries, [doc_source], [summary], [summary_metadata])
+        for chunk_id, chunk_doc, chunk_metadata in zip(chunk_ids, chunk_docs, chunk_metadatas):
+            if (self.near_dup is not None and chunk_metadata.get('data_type') != 'tabular'
+                    and self.near_dup.find_or_add("chunk", chunk_id, file_path, chunk_doc) is not None):
+                self.skipped_chunks += 1
+                continue
+            self._append(self._chunks, [chunk_id], [chunk_doc], [chunk_metadata])
+
+    def mark_failed(self, file_path):
+        """记录加载或处理失败的文件。"""
+        self.failed_paths.add(file_path)
+
+    def is_full(self):
+        return len(self._summaries[0]) >= self.batch_size or len(self._chunks[0]) >= self.batch_size
+
+    def flush(self, final=False):
+        """写入已攒满一批的缓冲区；final为True时写入全部剩余数据。"""
+        start = time.perf_counter()
+        if final or len(self._summaries[0]) >= self.batch_size:
+            summary_ids = list(self._summaries[0])
+            self.summary_count += self._flush(self.summary_collection, self._summaries)
+            if self.near_dup is not None:
+                # 规范条目写入成功后才登记签名，写入失败时副本不会指向一个没有向量的条目
+                self.near_dup.register("doc", summary_ids)
+        if final or len(self._chunks[0]) >= self.batch_size:
+            chunk_ids = list(self._chunks[0])
+            if self.lexical_index is not None:
+                # 区块同步写入词法倒排索引与元数据索引（须在 _flush 清空缓冲区之前）
+                self.lexical_index.upsert(*self._chunks)
+            if self.metadata_index is not None:
+                self.metadata_index.upsert(self._chunks[0], self._chunks[2])
+            self.chunk_count += self._flush(self.chunk_collection, self._chunks)
+            if self.near_dup is not None:
+                self.near_dup.register("chunk", chunk_ids)
+        self.write_seconds += time.perf_counter() - start
+
+    @staticmethod
+    def _append(buffer, ids, documents, metadatas):
+        buffer[0].extend(ids)
+        buffer[1].extend(documents)
+        buffer[2].extend(metadatas)
+
+    @staticmethod
+    def _flush(collection, buffer):
+        """使用upsert写入并清空缓冲区，使中断后重跑不会因ID已存在而失败。"""
+        ids, documents, metadatas = buffer
+        if not ids:
+            return 0
+        count = len(ids)
+        collection.upsert(ids=list(ids), documents=list(documents), metadatas=list(metadatas))
+        for part in buffer:
+            part.clear()
+        return count
+
+# --- 表格列式存储模式 ---
+def write_tabular_rows(frame, file_path, sheet_name, chunk_collection, embedding_function, lexical_index=None,
+                       metadata_index=None, batch_size=WRITE_BATCH_SIZE, written_ids=None):
+    """
+    把一块表格行写入区块集合（每行一个向量）及词法、元数据索引，返回区块ID列表。
+    区块原文为整行文本，向量只由 TABULAR_EMBED_COLUMNS 中的列生成。
+    提供 written_ids 时，每批写入前先把该批ID登记到其中，写入中途失败时调用方据此删除已写入的部分。
+    """
+    texts = build_row_texts(frame).tolist()
+    metadatas = build_row_metadatas(frame, file_path, sheet_name)
+    # 与 get_doc_source 生成的ID格式一致，旧模式下注入的区块会被直接覆盖
+    ids = [f"{file_path}_{sheet_name}_row_{metadata['row_index']}_chunk_0" for metadata in metadatas]
+    embed_columns = [column for column in TABULAR_EMBED_COLUMNS if column in frame.columns]
+    embed_texts = build_row_texts(frame[embed_columns]).tolist() if embed_columns else texts
+
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        if written_ids is not None:
+            written_ids.extend(ids[start:end])
+        chunk_collection.upsert(
+            ids=ids[start:end], documents=texts[start:end], metadatas=metadatas[start:end],
+            embeddings=embedding_function(embed_texts[start:end])
+        )
+        if lexical_index is not None:
+            lexical_index.upsert(ids[start:end], texts[start:end], metadatas[start:end])
+        if metadata_index is not None:
+            metadata_index.upsert(ids[start:end], metadatas[start:end])
+    return ids
+
+def ingest_tabular_files(file_paths, file_hashes, chunk_collection, embedding_function, lexical_index=None,
+                         metadata_index=None):
+    """
+    表格存储模式下注入Excel文件：每个工作表写入DuckDB中一张带类型列的表，
+    每行只在区块集合中嵌入一次，不再写入摘要集合。
+    返回 ({文件路径: {"summary_ids": [], "chunk_ids": [...]}}, 写入的行数)。
+    """
+    from agentic_rag.tabular_store import TabularStore
+
+    store = TabularStore()
+    file_ids, row_count = {}, 0
+    try:
+        for file_path in tqdm(file_paths, desc="写入表格"):
+            chunk_ids, table, current_sheet = [], None, None
+            try:
+                for sheet_name, frame in iter_excel_frames(file_path, file_hashes.get(file_path)):
+                    if sheet_name != current_sheet:
+                        if table is not None:
+                            store.finish_sheet(table, file_path, current_sheet)
+                        table, current_sheet = store.begin_sheet(file_path, sheet_name, frame.columns), sheet_name
+                    store.append(table, frame)
+                    write_tabular_rows(
+                        frame, file_path, sheet_name, chunk_collection, embedding_function, lexical_index, metadata_index,
+                        written_ids=chunk_ids
+                    )
+                if table is not None:
+                    store.finish_sheet(table, file_path, current_sheet)
+            except Exception as e:
+                # 不写入清单，并删除已写入的表与区块，下次运行时整体重试，而不是以部分内容留在库中
+                print(f"写入表格文件 {file_path} 失败: {e}")
+                store.drop_source(file_path)
+                delete_chunks(chunk_ids, chunk_collection, lexical_index, metadata_index)
+                continue
+            file_ids[file_path] = {"summary_ids": [], "chunk_ids": chunk_ids}
+            row_count += len(chunk_ids)
+    finally:
+        # 关闭连接，释放DuckDB的写锁，使查询方可以打开数据库
+        store.close()
+    return file_ids, row_count
+
+def drop_tabular_sources(file_paths):
+    """删除已删除或已变更文件在表格列式存储中的表。"""
+    from agentic_rag.tabular_store import TabularStore
+
+    store = TabularStore()
+    try:
+        dropped = sum(store.drop_source(path) for path in file_paths)
+    finally:
+        store.close()
+    if dropped:
+        print(f"--- 已删除 {dropped} 张旧的表格数据表 ---")
+
+def find_dependent_files(near_dup, stale_paths, manifest, unchanged):
+    """
+    找出引用了待删除规范条目的未变更文件（它们的副本没有单独的向量），
+    需要与待删除文件一起重新注入。返回这些文件路径。
+    """
+    dependents, pending = [], list(stale_paths)
+    while pending:
+        stale_ids = [item_id for path in pending for key in ("summary_ids", "chunk_ids") for item_id in manifest[path].get(key, [])]
+        pending = [path for path in near_dup.dependent_sources(stale_ids) if path in unchanged and path not in dependents]
+        dependents.extend(pending)
+    return dependents
+
+def discard_failed_files(sink, summary_collection, chunk_collection, lexical_index=None, metadata_index=None,
+                         near_dup=None):
+    """
+    删除加载或处理失败的文件已写入的摘要与区块，并把它们移出 sink.file_ids，
+    使这些文件不写入清单、下次运行时整体重试，而不是以部分内容留在库中。
+    启用近重复检测时，以这些条目（或被丢弃的待定条目）为规范条目的副本文件一并重试。
+    """
+    failed = set(sink.failed_paths)
+    if near_dup is not None:
+        failed.update(path for path in near_dup.orphaned_sources if path in sink.file_ids)
+    pending = sorted(failed)
+    while pending:
+        ids = [item_id for path in pending for key in ("summary_ids", "chunk_ids")
+               for item_id in sink.file_ids.get(path, {}).get(key, [])]
+        pending = []
+        if near_dup is not None and ids:
+            pending = sorted(path for path in near_dup.dependent_sources(ids) if path in sink.file_ids and path not in failed)
+            failed.update(pending)
+
+    print(f"--- {len(failed)} 个文件加载或处理失败（或引用了失败文件的内容），删除其已写入的向量，下次运行时重试 ---")
+    for path in sorted(failed):
+        ids = sink.file_ids.pop(path, None)
+        if not ids:
+            continue
+        delete_ids_in_batches(summary_collection, ids["summary_ids"])
+        delete_chunks(ids["chunk_ids"], chunk_collection, lexical_index, metadata_index)
+        if near_dup is not None:
+            near_dup.delete(ids["summary_ids"] + ids["chunk_ids"])
+
+def report_near_duplicates(sink, near_dup, summary_collection, chunk_collection):
+    """把新增的别名写入规范条目的元数据，并报告近重复检测节省的向量数、索引大小与嵌入时间。"""
+    for kind, collection in (("doc", summary_collection), ("chunk", chunk_collection)):
+        canonical_ids = list(near_dup.new_aliases[kind])
+        if canonical_ids:
+            apply_alias_metadata(collection, near_dup.alias_sources(kind, canonical_ids))
+
+    stats = near_dup.stats()
+    print(f"近重复检测: 检查 {stats['docs_checked']} 份文档、{stats['chunks_checked']} 个区块，"
+          f"跳过 {sink.skipped_summaries} 份文档的摘要、{sink.skipped_chunks} 个区块。")
+    if not (sink.skipped_summaries or sink.skipped_chunks):
+        return
+    written = sink.summary_count + sink.chunk_count
+    skipped = sink.skipped_summaries + sink.skipped_chunks
+    sample = chunk_collection.get(limit=1, include=["embeddings"])
+    dim = len(sample["embeddings"][0]) if sample["ids"] else 0
+    seconds = sink.write_seconds / written * skipped if written else 0.0
+    print(f"  节省约 {skipped} 个向量（约 {skipped * dim * 4 / 1024 / 1024:.1f} MB 向量数据），"
+          f"约 {seconds:.1f} 秒嵌入与写入时间，{sink.skipped_summaries} 次摘要调用。")
+
+async def run_pipeline(documents, sink, split_executor, max_pending):
+    """
+    运行“加载 -> 摘要/切分 -> 批量写入”的流式管道，返回处理的文档数。
+    文件级摘要模式（SUMMARY_MODE = "file"）下，同一文件的各页合并为一个工作项，按文件计数。
+
+    各阶段之间通过有界队列连接：写入变慢时结果队列会填满，工作协程随之阻塞，
+    进而使文档队列填满、加载线程暂停，从而形成端到端的背压。
+    加载器与数据库写入都是阻塞调用，放在线程中执行，不会阻塞事件循环中的LLM请求。
+    """
+    summarizer = AsyncSummarizer()
+    summary_cache = SummaryCache()
+    num_workers = SUMMARY_MAX_CONCURRENCY + INGEST_SPLIT_PROCESSES * MAX_PENDING_DOCS_PER_PROCESS
+    doc_queue = asyncio.Queue(maxsize=max_pending)
+    result_queue = asyncio.Queue(maxsize=max_pending)
+    processed = 0
+
+    async def produce():
+        iterator = group_pages_by_file(documents) if SUMMARY_MODE == "file" else iter(documents)
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(iterator, LOAD_BATCH_SIZE)))
+            if not batch:
+                break
+            for doc in batch:
+                await doc_queue.put(doc)
+        for _ in range(num_workers):
+            await doc_queue.put(None)
+
+    async def work():
+        while (doc := await doc_queue.get()) is not None:
+            worker = process_file_worker if isinstance(doc, list) else process_document_worker
+            file_path = (doc[0] if isinstance(doc, list) else doc).metadata.get('source', 'unknown_source')
+            # 结果与所属文件一起传递：失败的结果（None）不能与队列的结束标记混淆
+            await result_queue.put((file_path, await worker(doc, summarizer, split_executor, summary_cache, sink.near_dup)))
+
+    async def close_results(workers):
+        await asyncio.gather(*workers)
+        await result_queue.put(None)
+
+    async def consume():
+        nonlocal processed
+        with tqdm(desc="摘要、切分与写入") as progress:
+            while (item := await result_queue.get()) is not None:
+                processed += 1
+                progress.update(1)
+                file_path, result = item
+                if result is None:
+                    sink.mark_failed(file_path)
+                    continue
+                sink.add(result)
+                if sink.is_full():
+                    await asyncio.to_thread(sink.flush)
+        await asyncio.to_thread(sink.flush, True)
+
+    workers = [asyncio.create_task(work()) for _ in range(num_workers)]
+    tasks = [asyncio.create_task(produce()), asyncio.create_task(close_results(workers)), asyncio.create_task(consume()), *workers]
+    try:
+        # 任一阶段出错时立即停止整个管道，避免其他阶段因队列阻塞而永远等待
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        cache_stats = summary_cache.stats()
+        summary_cache.close()
+
+    print(f"摘要LLM调用 {summarizer.llm_calls} 次（平均每份文档 {summarizer.llm_calls / max(processed, 1):.2f} 次），"
+          f"其中重试 {summarizer.retries} 次。")
+    print(f"摘要缓存: 命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次 "
+          f"(命中率 {cache_stats['hit_rate']:.1%})，当前 {cache_stats['entries']} 条，本次淘汰 {cache_stats['evictions']} 条。")
+    return processed
+
 # --- 主逻辑 ---
-def main():
+def main(full_rebuild=False):
     """
     主函数：执行并行化和批处理的数据注入流程。
+
+    Args:
+        full_rebuild (bool): 为True时删除旧数据库并全量重建；否则仅处理新增、变更和删除的文件。
     """
     print("---" + " 开始并行化数据注入流程" + " ---")
     try:
@@ -90,122 +615,198 @@ def main():
     except ImportError:
         print("\n警告: 未安装 PyTorch。无法进行 GPU 诊断。\n")
 
-    if os.path.exists(PERSIST_PATH):
+    if full_rebuild and os.path.exists(PERSIST_PATH):
         print(f"正在删除旧的数据库 '{PERSIST_PATH}'...")
         shutil.rmtree(PERSIST_PATH)
 
-    # 1. 加载所有文档
+    # 1. 扫描文件并与清单比对
     if not os.path.exists(DATA_PATH) or not os.listdir(DATA_PATH):
         print(f"错误：数据目录 '{DATA_PATH}' 不存在或为空。")
         return
-    documents = load_documents_from_directory(DATA_PATH)
-    if not documents:
-        print("未能成功加载任何文档。" )
-        return
-    print(f"\n成功加载 {len(documents)} 份原始文档/数据行。" )
-
-    # 2. 并行处理所有文档
-    all_summaries, all_summary_metadatas, all_summary_ids = [], [], []
-    all_chunks, all_chunk_metadatas, all_chunk_ids = [], [], []
-
-    # 创建进程池
-    num_processes = max(1, os.cpu_count() - 1) # 留一个核心给主进程
-    print(f"---" + " 使用 " + f"{num_processes}" + " 个进程并行处理文档" + " ---")
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # 使用imap_unordered来获取进度条
-        results = list(tqdm(pool.imap_unordered(process_document_worker, documents), total=len(documents), desc="摘要与切分"))
-
-    # 3. 收集处理结果
-    for result in results:
-        if result:
-            doc_source, summary, summary_metadata, chunk_ids, chunk_docs, chunk_metadatas = result
-            all_summary_ids.append(doc_source)
-            all_summaries.append(summary)
-            all_summary_metadatas.append(summary_metadata)
-            all_chunk_ids.extend(chunk_ids)
-            all_chunks.extend(chunk_docs)
-            all_chunk_metadatas.extend(chunk_metadatas)
-
-    if not all_summary_ids or not all_chunk_ids:
-        print("未能成功处理任何文档，注入中止。" )
+    manifest = load_manifest()
+    to_process, unchanged, removed = diff_against_manifest(list_supported_files(DATA_PATH), manifest)
+    print(f"文件比对结果: 新增/变更 {len(to_process)} 个, 未变更 {len(unchanged)} 个, 已删除 {len(removed)} 个。")
+    if not to_process and not removed:
+        print("知识库已是最新，无需注入。")
         return
 
-    # 4. 批量存入数据库（分批次）
-    print("--- 开始批量存入向量数据库 ---")
     embedding_function = get_embedding_function()
     client = chromadb.PersistentClient(path=PERSIST_PATH)
-    
-    # 定义一个合理的批次大小
-    CHROMA_BATCH_SIZE = 4096
-
-    # 批量存入摘要
     summary_collection = client.get_or_create_collection(SUMMARY_COLLECTION_NAME, embedding_function=embedding_function)
-    total_summaries = len(all_summary_ids)
-    print(f"正在分批存入 {total_summaries} 条摘要...")
-    for i in tqdm(range(0, total_summaries, CHROMA_BATCH_SIZE), desc="存入摘要"):
-        end_i = min(i + CHROMA_BATCH_SIZE, total_summaries)
-        summary_collection.add(
-            ids=all_summary_ids[i:end_i],
-            documents=all_summaries[i:end_i],
-            metadatas=all_summary_metadatas[i:end_i]
-        )
-
-    # 批量存入区块
     chunk_collection = client.get_or_create_collection(CHUNK_COLLECTION_NAME, embedding_function=embedding_function)
-    total_chunks = len(all_chunk_ids)
-    print(f"正在分批存入 {total_chunks} 个区块...")
-    for i in tqdm(range(0, total_chunks, CHROMA_BATCH_SIZE), desc="存入区块"):
-        end_i = min(i + CHROMA_BATCH_SIZE, total_chunks)
-        chunk_collection.add(
-            ids=all_chunk_ids[i:end_i],
-            documents=all_chunks[i:end_i],
-            metadatas=all_chunk_metadatas[i:end_i]
-        )
+    lexical_index = LexicalIndex() if LEXICAL_INDEX_ENABLED else None
+    if lexical_index is not None and lexical_index.count() == 0 and unchanged:
+        print("警告：词法索引为空但存在未变更的文件，请运行 `python -m agentic_rag.lexical_index rebuild` 补建索引。")
+    metadata_index = MetadataIndex() if METADATA_INDEX_ENABLED else None
+    near_dup = NearDuplicateIndex() if NEAR_DUP_ENABLED else None
+
+    # 2. 清理已删除或已变更文件的旧摘要与区块
+    stale_paths = removed + [path for path in to_process if path in manifest]
+    if near_dup is not None and stale_paths:
+        dependents = find_dependent_files(near_dup, stale_paths, manifest, unchanged)
+        if dependents:
+            print(f"--- {len(dependents)} 个未变更文件引用了将被删除的规范条目，将重新注入 ---")
+            for path in dependents:
+                entry = unchanged.pop(path)
+                to_process[path] = {key: entry[key] for key in ("size", "mtime", "hash")}
+            stale_paths += dependents
+    if stale_paths:
+        print(f"--- 正在清理 {len(stale_paths)} 个已删除/变更文件的旧向量 ---")
+        for path in stale_paths:
+            delete_ids_in_batches(summary_collection, manifest[path].get("summary_ids", []))
+            delete_ids_in_batches(chunk_collection, manifest[path].get("chunk_ids", []))
+            if lexical_index is not None:
+                lexical_index.delete(manifest[path].get("chunk_ids", []))
+            if metadata_index is not None:
+                metadata_index.delete(manifest[path].get("chunk_ids", []))
+            if near_dup is not None:
+                near_dup.delete(manifest[path].get("summary_ids", []) + manifest[path].get("chunk_ids", []))
+        if TABULAR_STORAGE_MODE == "duckdb":
+            drop_tabular_sources(stale_paths)
+        # 向量库已变化，使语义答案缓存中基于旧索引的答案失效
+        bump_index_version()
+    new_manifest = dict(unchanged)
+    if not to_process:
+        save_manifest(new_manifest)
+        prune_excel_parse_cache(new_manifest)
+        write_summary_snapshot(summary_collection)
+        print("\n--- 增量注入完成（仅清理） ---")
+        return
+
+    file_hashes = {path: fingerprint["hash"] for path, fingerprint in to_process.items()}
+    pipeline_paths = list(to_process)
+    file_ids, loaded_count = {}, 0
+
+    # 3a. 表格列式存储模式：Excel 文件写入DuckDB，每行只嵌入一次，不经过摘要管道
+    if TABULAR_STORAGE_MODE == "duckdb":
+        tabular_paths = [path for path in pipeline_paths if os.path.splitext(path)[1].lower() in EXCEL_EXTENSIONS]
+        pipeline_paths = [path for path in pipeline_paths if path not in tabular_paths]
+        if tabular_paths:
+            tabular_ids, row_count = ingest_tabular_files(
+                tabular_paths, file_hashes, chunk_collection, embedding_function, lexical_index, metadata_index
+            )
+            file_ids.update(tabular_ids)
+            loaded_count += row_count
+            print(f"\n表格列式存储: 写入 {len(tabular_ids)} 个文件、{row_count} 行（每行一个向量）。")
+
+    # 3b. 流式管道：加载器 -> 异步摘要/进程池切分 -> 批量嵌入写入
+    # 文档逐个产出，各阶段由有界队列连接，结果攒满一批即写入，内存峰值由批次大小决定。
+    if pipeline_paths:
+        max_pending = max(1, os.cpu_count() - 1) * MAX_PENDING_DOCS_PER_PROCESS
+        print(f"--- 摘要并发上限 {SUMMARY_MAX_CONCURRENCY}，使用 {INGEST_SPLIT_PROCESSES} 个进程切分文本 ---")
+        sink = ChromaBatchSink(summary_collection, chunk_collection, lexical_index=lexical_index,
+                               metadata_index=metadata_index, near_dup=near_dup)
+        documents = iter_documents_from_files(pipeline_paths, file_hashes, failed_paths=sink.failed_paths)
+        with ProcessPoolExecutor(max_workers=INGEST_SPLIT_PROCESSES, initializer=init_split_worker) as split_executor:
+            pipeline_count = asyncio.run(run_pipeline(documents, sink, split_executor, max_pending))
+        if sink.failed_paths or (near_dup is not None and near_dup.orphaned_sources):
+            discard_failed_files(sink, summary_collection, chunk_collection, lexical_index, metadata_index, near_dup)
+        file_ids.update(sink.file_ids)
+        loaded_count += pipeline_count
+        print(f"\n共处理 {pipeline_count} 份原始文档/数据行，写入 {sink.summary_count} 条摘要、{sink.chunk_count} 个区块。")
+        if near_dup is not None:
+            report_near_duplicates(sink, near_dup, summary_collection, chunk_collection)
+
+    if loaded_count == 0:
+        print("未能成功加载任何文档。" )
+        save_manifest(new_manifest)
+        return
+    if not file_ids:
+        print("未能成功处理任何文档，注入中止。" )
+        save_manifest(new_manifest)
+        return
+
+    # 4. 更新清单（加载或处理失败的文件不写入清单，下次运行时会重试）
+    for path, fingerprint in to_process.items():
+        if path in file_ids:
+            new_manifest[path] = {**fingerprint, **file_ids[path]}
+    save_manifest(new_manifest)
+    prune_excel_parse_cache(new_manifest)
+    bump_index_version()
+    write_summary_snapshot(summary_collection)
+
+    report_embedding_stats(embedding_function)
 
     print("\n--- 并行化数据注入完成 ---")
     print(f"知识库已成功构建在 '{PERSIST_PATH}' 中。" )
 
 # --- 辅助函数定义 ---
-def load_documents_from_directory(directory_path):
-    """逐个加载目录中的文档。"""
-    # ... (此处省略与之前版本相同的完整代码)
-    documents = []
-    loader_map = {'.pdf': PyPDFLoader, '.txt': TextLoader, '.md': UnstructuredMarkdownLoader, '.docx': UnstructuredWordDocumentLoader, '.doc': UnstructuredWordDocumentLoader}
+def prune_excel_parse_cache(manifest):
+    """删除清单中已不存在的表格文件版本的 Excel 解析缓存，避免缓存无限增长。"""
+    removed = prune_excel_cache(entry["hash"] for entry in manifest.values())
+    if removed:
+        print(f"--- 已清理 {removed} 份过期的 Excel 解析缓存 ---")
+
+def write_summary_snapshot(summary_collection):
+    """写入内存摘要索引的快照（须在更新索引版本之后），检索进程据此直接加载而无需自行重建。"""
+    if SUMMARY_INDEX_ENABLED:
+        print(f"摘要向量快照: {write_snapshot(summary_collection)} 个向量。")
+
+def report_embedding_stats(embedding_function):
+    """打印嵌入缓存命中率与本地嵌入后端的吞吐量（如可用）。"""
+    if hasattr(embedding_function, "stats"):
+        stats = embedding_function.stats()
+        print(f"嵌入缓存: 内存命中 {stats['memory_hits']}，磁盘命中 {stats['disk_hits']}，"
+              f"未命中 {stats['misses']} (命中率 {stats['hit_rate']:.1%})")
+    model = getattr(embedding_function, "base", embedding_function)
+    if hasattr(model, "throughput"):
+        stats = model.throughput()
+        print(f"嵌入吞吐量 [{stats['backend']}]: {stats['texts_per_sec']:.1f} texts/sec, "
+              f"{stats['tokens_per_sec']:.1f} tokens/sec (共 {stats['texts']} 条)")
+
+def list_supported_files(directory_path):
+    """递归列出目录中所有受支持的文件（按路径排序，保证清单稳定）。"""
     supported_files = []
     for root, _, files in os.walk(directory_path):
         for file in files:
             ext = os.path.splitext(file)[1].lower()
-            if ext in loader_map or ext in ['.xlsx', '.xls']:
+            if ext in LOADER_MAP or ext in EXCEL_EXTENSIONS:
                 supported_files.append(os.path.join(root, file))
+    return sorted(supported_files)
 
-    for file_path in tqdm(supported_files, desc="加载文档"):
+def iter_documents_from_files(file_paths, file_hashes=None, failed_paths=None):
+    """
+    逐个加载给定文件列表中的文档，以生成器方式逐条产出，避免一次性物化全部文档。
+
+    Args:
+        file_paths (list): 待加载的文件路径。
+        file_hashes (dict, optional): 文件路径到内容哈希的映射，用作Excel解析缓存的键。
+        failed_paths (set, optional): 加载失败的文件路径会加入该集合（失败前可能已产出部分文档）。
+    """
+    file_hashes = file_hashes or {}
+    for file_path in file_paths:
         ext = os.path.splitext(file_path)[1].lower()
         try:
-            if ext in ['.xlsx', '.xls']:
-                df = pd.read_excel(file_path)
-                for index, row in df.iterrows():
-                    content_parts = []
-                    metadata = {"source": file_path, "row_index": index, "data_type": "tabular"}
-                    for col_name in df.columns:
-                        value = row[col_name]
-                        value_str = str(value) if not pd.isna(value) else ""
-                        content_parts.append(f"{col_name}: {value_str}")
-                        if col_name in EXCEL_METADATA_COLUMNS:
-                            metadata[col_name] = value_str
-                    doc = Document(page_content="\n".join(content_parts), metadata=metadata)
-                    documents.append(doc)
-            elif ext in loader_map:
-                loader = loader_map[ext](file_path, encoding='utf-8') if ext == ".txt" else loader_map[ext](file_path)
-                loaded_docs = loader.load()
+            if ext in EXCEL_EXTENSIONS:
+                # 列式分块加载，覆盖工作簿中的所有工作表
+                yield from iter_excel_documents(file_path, file_hashes.get(file_path))
+            elif ext in LOADER_MAP:
+                loader = LOADER_MAP[ext](file_path, encoding='utf-8') if ext == ".txt" else LOADER_MAP[ext](file_path)
                 # 为叙事型文档打上标签
-                for doc in loaded_docs:
+                for doc in loader.lazy_load():
                     doc.metadata["data_type"] = "narrative"
-                documents.extend(loaded_docs)
+                    yield doc
         except Exception as e:
             print(f"加载文件 {file_path} 失败: {e}")
-    return documents
+            if failed_paths is not None:
+                failed_paths.add(file_path)
+
+def load_documents_from_files(file_paths):
+    """加载给定文件列表中的全部文档并返回列表。"""
+    return list(iter_documents_from_files(tqdm(file_paths, desc="加载文档")))
+
+def load_documents_from_directory(directory_path):
+    """逐个加载目录中的文档。"""
+    return load_documents_from_files(list_supported_files(directory_path))
 
 if __name__ == "__main__":
     # 在Windows上使用多进程时，必须将主逻辑放在 if __name__ == '__main__': 下
     multiprocessing.freeze_support() 
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="将 data 目录中的文档注入向量数据库。")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="删除旧的向量数据库并全量重建。默认只增量处理新增、变更和删除的文件。"
+    )
+    args = parser.parse_args()
+    main(full_rebuild=args.full)
\ No newline at end of file
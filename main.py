@@ -3,9 +3,11 @@
 @desc: Agentic RAG系统主入口（已集成记忆管理指令）
 """
 
+import time
 import uuid
-from agentic_rag.graph import build_graph
+from agentic_rag.graph import build_graph, stream_run, ANSWER_NODES, GRAPH_RECURSION_LIMIT
 from agentic_rag import memory
+from config import CLI_STREAM_RESPONSE
 
 # 线程ID，用于LangGraph的持久化，这里我们用一个简单的UUID
 thread_id = str(uuid.uuid4())
@@ -51,6 +53,36 @@ def handle_memory_commands(query: str) -> bool:
         
     return False
 
+def run_streaming(graph, inputs, graph_config) -> dict:
+    """流式运行工作流：答案token到达即打印，并报告从提交问题到首个token的耗时。返回最终状态。"""
+    start = time.perf_counter()
+    time_to_first_token = None
+    answer_in_progress = False
+    ttft_reported = False
+    final_state = None
+    for event, data in stream_run(graph, inputs, config=graph_config):
+        if event == "token":
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            if not answer_in_progress:
+                answer_in_progress = True
+                print("\n答案: ", end="", flush=True)
+            print(data["text"], end="", flush=True)
+        elif event == "node" and data["node"] in ANSWER_NODES:
+            # 答案已完整输出，换行后再显示后续节点的日志
+            print()
+            if answer_in_progress and not ttft_reported:
+                print(f"--- 首个token延迟（自提交问题起）: {time_to_first_token:.2f} 秒 ---")
+                ttft_reported = True
+            answer_in_progress = False
+        elif event == "node" and data["node"] == "check_answer_cache" and data["update"].get("answer_cache_hit"):
+            print(f"\n答案(缓存): {data['update']['response']}")
+        elif event == "node" and data["node"] == "grade_relevance" and data["update"].get("is_relevant") is False:
+            print("--- 上面的答案未通过相关性评估，将重新生成 ---")
+        elif event == "final":
+            final_state = data
+    return final_state
+
 def main():
     """主函数，运行Agentic RAG流程。"""
     # 在启动时确保记忆库已初始化
@@ -78,7 +110,12 @@ def main():
         # 如果不是指令，则正常执行Agent工作流
         inputs = {"query": query}
         print("\n--- 系统开始处理 ---")
-        graph_config = {"recursion_limit": 10, **config}
+        graph_config = {"recursion_limit": GRAPH_RECURSION_LIMIT, **config}
+        if CLI_STREAM_RESPONSE:
+            final_state = run_streaming(graph, inputs, graph_config)
+            print("--- 系统处理结束 ---")
+            continue
+
         final_state = graph.invoke(inputs, config=graph_config)
         print("--- 系统处理结束 ---")
 
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: Agentic RAG系统的HTTP服务入口（ASGI）
+
+基于 FastAPI 暴露异步编译的工作流图：
+- POST /chat          一次性返回最终答案。
+- POST /chat/stream   以 Server-Sent Events 流式推送节点进度（event: node）与答案token（event: token），
+                      最后推送完整答案（event: answer）。
+- GET  /health        当前工作进程的运行数与排队数。
+
+请求体: {"query": "...", "session_id": "可选"}。同一 session_id 的多轮问题通过LangGraph检查点共享对话历史，
+并按顺序执行。不提供 session_id 的请求是单轮问答，在不带检查点的图上运行，不保存会话状态
+（响应中的 session_id 为 null），避免每个这样的请求都在检查点存储中留下一个永不清理的会话。
+
+每个工作进程在启动时加载一次嵌入模型、向量库集合与长期记忆库，所有请求共享。
+每个进程同时执行的图运行数受 SERVER_MAX_CONCURRENT_RUNS 限制，超出的请求排队，队列满或等待超时返回 503。
+等待同一会话前一个请求结束的时间同样计入排队数与排队超时。
+
+用法:
+    python server.py
+    # 或: uvicorn server:app --workers 2
+
+使用本地桩LLM进行测试（无需真实的模型服务）:
+    python ./evaluation/stub_llm_server.py --port 8765
+    OPENAI_API_KEY=stub OPENAI_API_BASE=http://127.0.0.1:8765/v1 python server.py
+"""
+
+import json
+import asyncio
+import weakref
+from contextlib import asynccontextmanager, AsyncExitStack
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from agentic_rag.graph import build_graph, astream_run, GRAPH_RECURSION_LIMIT
+from agentic_rag.state import new_turn_input
+from agentic_rag.chains import get_embedding_function
+from agentic_rag.local_router import get_local_router
+from agentic_rag.answer_cache import get_answer_cache
+from agentic_rag.reranker import get_reranker
+from agentic_rag import memory
+from config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_CONCURRENT_RUNS, SERVER_MAX_QUEUED_REQUESTS,
+    SERVER_QUEUE_TIMEOUT, SERVER_CHECKPOINTER, SERVER_CHECKPOINT_PATH, RERANKER_ENABLED
+)
+
+class ChatRequest(BaseModel):
+    query: str
+    session_id: str = None
+
+class QueueFullError(Exception):
+    """排队请求数已达上限，或排队等待超时。"""
+
+class RunLimiter:
+    """限制同时执行的图运行数，超出的请求在有界队列中等待。"""
+
+    def __init__(self, max_concurrent=SERVER_MAX_CONCURRENT_RUNS, max_queued=SERVER_MAX_QUEUED_REQUESTS,
+                 timeout=SERVER_QUEUE_TIMEOUT):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.running = 0
+        self.queued = 0
+
+    def is_full(self) -> bool:
+        return self.queued >= self.max_queued
+
+    @asynccontextmanager
+    async def slot(self, session_lock: asyncio.Lock = None):
+        """
+        占用一个运行槽位。提供 session_lock 时先取会话锁再占槽位：排在同一会话后面的请求不占用槽位，
+        避免一个会话挤占其他会话；两段等待都计入排队数，并共用 timeout。
+        """
+        if self.is_full():
+            raise QueueFullError(f"服务繁忙：已有 {self.queued} 个请求在排队")
+        self.queued += 1
+        locked = False
+        try:
+            async with asyncio.timeout(self.timeout):
+                if session_lock is not None:
+                    await session_lock.acquire()
+                    locked = True
+                await self._semaphore.acquire()
+        except BaseException as e:
+            if locked:
+                session_lock.release()
+            if isinstance(e, TimeoutError):
+                raise QueueFullError(f"排队等待超过 {self.timeout} 秒") from None
+            raise
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            if locked:
+                session_lock.release()
+
+class AgentService:
+    """每个工作进程一个实例：持有编译后的异步图（带检查点与不带检查点各一个）与并发限制。"""
+
+    def __init__(self, graph, stateless_graph, limiter: RunLimiter):
+        self.graph = graph
+        # 不提供 session_id 的单轮请求使用不带检查点的图
+        self.stateless_graph = stateless_graph
+        self.limiter = limiter
+        # 同一会话的请求按顺序执行，避免并发修改同一个检查点（会话锁由 RunLimiter.slot 获取）
+        self._session_locks = weakref.WeakValueDictionary()
+
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[session_id] = lock
+        return lock
+
+    @staticmethod
+    def run_config(session_id: str = None) -> dict:
+        if session_id is None:
+            return {"recursion_limit": GRAPH_RECURSION_LIMIT}
+        return {"recursion_limit": GRAPH_RECURSION_LIMIT, "configurable": {"thread_id": session_id}}
+
+    def graph_for(self, session_id: str = None):
+        return self.graph if session_id is not None else self.stateless_graph
+
+    def run_slot(self, session_id: str = None):
+        """会话请求按顺序执行；单轮请求之间没有共享状态，无需加锁。"""
+        return self.limiter.slot(None if session_id is None else self.session_lock(session_id))
+
+    async def final_state(self, session_id: str) -> dict:
+        snapshot = await self.graph.aget_state(self.run_config(session_id))
+        return snapshot.values
+
+    async def run(self, query: str, session_id: str = None) -> dict:
+        async with self.run_slot(session_id):
+            state = await self.graph_for(session_id).ainvoke(new_turn_input(query), config=self.run_config(session_id))
+            return state if session_id is None else await self.final_state(session_id)
+
+    async def stream(self, query: str, session_id: str = None):
+        """依次产出 (事件名, 数据) 二元组。"""
+        async with self.run_slot(session_id):
+            yield "session", {"session_id": session_id}
+            graph = self.graph_for(session_id)
+            async for event, data in astream_run(graph, new_turn_input(query), config=self.run_config(session_id)):
+                if event == "final":
+                    yield "answer", answer_payload(session_id, data)
+                elif event == "node":
+                    payload = {"node": data["node"]}
+                    if data["update"].get("route"):
+                        payload["route"] = data["update"]["route"]
+                    yield "node", payload
+                else:
+                    yield event, data
+
+def answer_payload(session_id: str, state: dict) -> dict:
+    return {
+        "session_id": session_id,
+        "response": state.get("response"),
+        "route": state.get("route"),
+        "time_to_first_token": state.get("time_to_first_token"),
+        "cached": bool(state.get("answer_cache_hit")),
+        "context_stats": state.get("context_stats"),
+    }
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def create_checkpointer(stack: AsyncExitStack):
+    """按配置创建检查点存储。进程内存储无法在多个工作进程之间共享会话。"""
+    if SERVER_CHECKPOINTER == "sqlite":
+        try:
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        except ImportError:
+            raise ImportError("SERVER_CHECKPOINTER = 'sqlite' 需要安装 langgraph-checkpoint-sqlite")
+        return await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(SERVER_CHECKPOINT_PATH))
+
+    from langgraph.checkpoint.memory import InMemorySaver
+    if SERVER_WORKERS > 1:
+        print("警告: 进程内检查点无法在多个工作进程间共享，同一会话的请求可能落到不同进程而丢失历史。")
+    return InMemorySaver()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """工作进程启动时加载一次模型与存储，所有请求共享。"""
+    print("--- 初始化服务工作进程 ---")
+    async with AsyncExitStack() as stack:
+        await asyncio.to_thread(memory.initialize_memory_db)
+        await asyncio.to_thread(get_embedding_function)
+        if RERANKER_ENABLED:
+            await asyncio.to_thread(get_reranker)
+        checkpointer = await create_checkpointer(stack)
+        app.state.service = AgentService(
+            build_graph(async_mode=True, checkpointer=checkpointer), build_graph(async_mode=True), RunLimiter()
+        )
+        print("--- 服务已就绪 ---")
+        yield
+
+app = FastAPI(title="Agentic RAG", lifespan=lifespan)
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    service = app.state.service
+    session_id = request.session_id or None
+    try:
+        state = await service.run(request.query, session_id)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return answer_payload(session_id, state)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    service = app.state.service
+    session_id = request.session_id or None
+    if service.limiter.is_full():
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+
+    async def event_stream():
+        try:
+            async for event, data in service.stream(request.query, session_id):
+                yield format_sse(event, data)
+        except QueueFullError as e:
+            yield format_sse("error", {"session_id": session_id, "error": str(e)})
+        except Exception as e:
+            print(f"会话 {session_id} 处理失败: {e}")
+            yield format_sse("error", {"session_id": session_id, "error": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/health")
+async def health():
+    limiter = app.state.service.limiter
+    return {
+        "status": "ok",
+        "running": limiter.running,
+        "queued": limiter.queued,
+        "max_concurrent_runs": limiter.max_concurrent,
+        "max_queued_requests": limiter.max_queued,
+        "router": get_local_router().stats(),
+        "answer_cache": get_answer_cache().stats(),
+        "reranker": get_reranker().stats() if RERANKER_ENABLED else None,
+    }
+
+if __name__ == "__main__":
+    uvicorn.run("server:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 测试共用的桩：LLM 使用 evaluation/stub_llm_server.py 中的固定输出（进程内，无需启动HTTP服务），
+嵌入模型、长期记忆库与本地路由全部替换为内存实现。
+
+检索模块在导入时会连接向量库，这里在导入 agentic_rag.nodes 之前用空模块代替，各测试再按需替换检索函数。
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+
+
+def install_retriever_stub():
+    if "agentic_rag.hierarchical_retriever" not in sys.modules:
+        retriever_stub = types.ModuleType("agentic_rag.hierarchical_retriever")
+        for name in ("hierarchical_retriever", "direct_chunk_retriever", "exact_match_retriever", "tabular_sql_retriever"):
+            setattr(retriever_stub, name, lambda *args, **kwargs: [])
+        sys.modules["agentic_rag.hierarchical_retriever"] = retriever_stub
+
+
+def make_stub_chat_model(route="direct"):
+    """返回一个按 stub_llm_server.stub_completion 作答、支持流式输出的聊天模型。"""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+    from evaluation.stub_llm_server import stub_completion, STREAM_CHUNK_CHARS
+
+    class StubChatModel(BaseChatModel):
+        route: str = "direct"
+
+        @property
+        def _llm_type(self) -> str:
+            return "stub"
+
+        def _content(self, messages):
+            return stub_completion([{"content": message.content} for message in messages], self.route)
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._content(messages)))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            content = self._content(messages)
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=content[start:start + STREAM_CHUNK_CHARS]))
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    return StubChatModel(route=route)
+
+
+class FakeRouter:
+    def record(self, source):
+        pass
+
+
+@pytest.fixture
+def stub_nodes(monkeypatch):
+    """
+    替换 agentic_rag.nodes 依赖的外部服务，返回 nodes 模块。
+    LLM 默认路由为 'direct'，可通过 stub_nodes.use_route(route) 修改。
+    """
+    pytest.importorskip("langgraph")
+    install_retriever_stub()
+    from agentic_rag import nodes, chains, context_packer
+
+    def use_route(route):
+        llm = make_stub_chat_model(route)
+        monkeypatch.setattr(chains, "get_chain_llm", lambda name: llm)
+        monkeypatch.setattr(nodes, "get_chain_llm", lambda name: llm)
+
+    use_route("direct")
+    monkeypatch.setattr(nodes, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(nodes, "LOCAL_ROUTER_ENABLED", False)
+    monkeypatch.setattr(nodes, "RERANKER_ENABLED", False)
+    monkeypatch.setattr(nodes, "embed_query_text", lambda text: [0.0])
+    monkeypatch.setattr(nodes.memory, "retrieve_memories", lambda *args, **kwargs: [])
+    monkeypatch.setattr(nodes.memory, "add_memory", lambda *args, **kwargs: None)
+    monkeypatch.setattr(nodes, "get_local_router", FakeRouter)
+    monkeypatch.setattr(nodes, "log_route_decision", lambda *args, **kwargs: None)
+    # 离线环境下不尝试下载 tiktoken 编码，按字符数估算token
+    monkeypatch.setattr(context_packer, "_encoding", False)
+    for name in ("hierarchical_retriever", "direct_chunk_retriever", "exact_match_retriever", "tabular_sql_retriever"):
+        monkeypatch.setattr(nodes, name, lambda *args, **kwargs: [])
+    nodes.use_route = use_route
+    yield nodes
+    del nodes.use_route
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 语义答案缓存按对话上下文区分条目。
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+from agentic_rag.answer_cache import SemanticAnswerCache, context_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SemanticAnswerCache(threshold=0.95, version_path=str(tmp_path / "index_version"))
+
+
+def test_follow_up_does_not_hit_other_session(cache):
+    first_session = context_key([("Human", "阿莫西林胶囊是什么？"), ("AI", "一种抗生素。")])
+    second_session = context_key([("Human", "布洛芬缓释胶囊是什么？"), ("AI", "一种解热镇痛药。")])
+    cache.store("它的用法用量是什么？", [1.0, 0.0], "阿莫西林的用法用量", "hierarchical_search", 1.0, first_session)
+
+    entry, _ = cache.lookup([1.0, 0.0], second_session)
+    assert entry is None
+    entry, _ = cache.lookup([1.0, 0.0], first_session)
+    assert entry["response"] == "阿莫西林的用法用量"
+
+
+def test_standalone_questions_are_shared_across_sessions(cache):
+    assert context_key([]) == context_key(None) == ""
+    cache.store("阿莫西林的用法用量是什么？", [0.0, 1.0], "口服，一次0.5g", "hierarchical_search", 1.0)
+
+    entry, similarity = cache.lookup([0.0, 1.0], context_key([]))
+    assert entry["response"] == "口服，一次0.5g"
+    assert similarity == pytest.approx(1.0)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 异步编译的图（build_graph(async_mode=True)）与同步图对同一问题得到相同的最终状态。
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+from langchain_core.documents import Document
+
+# 与运行时刻有关的字段不参与比较
+TIMING_KEYS = ("time_to_first_token", "started_at")
+
+
+def comparable(state):
+    return {key: value for key, value in state.items() if key not in TIMING_KEYS}
+
+
+@pytest.mark.parametrize("route", ["direct", "hierarchical_search", "direct_chunk_search"])
+def test_async_graph_matches_sync_graph(stub_nodes, monkeypatch, route):
+    from agentic_rag.graph import build_graph, GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+    from evaluation.stub_llm_server import STUB_ANSWER
+
+    stub_nodes.use_route(route)
+    monkeypatch.setattr(stub_nodes, "hierarchical_retriever", lambda *args, **kwargs: [Document(page_content="摘要层区块", metadata={"source": "a.txt"})])
+    monkeypatch.setattr(stub_nodes, "direct_chunk_retriever", lambda *args, **kwargs: [Document(page_content="直接检索区块", metadata={"source": "b.txt"})])
+    config = {"recursion_limit": GRAPH_RECURSION_LIMIT}
+
+    sync_state = build_graph(fanout=False).invoke(new_turn_input("某药品的用法用量"), config=config)
+    async_state = asyncio.run(build_graph(async_mode=True, fanout=False).ainvoke(new_turn_input("某药品的用法用量"), config=config))
+
+    assert sync_state["response"] == STUB_ANSWER
+    assert sync_state["route"] == route
+    assert bool(sync_state["documents"]) == (route != "direct")
+    assert comparable(async_state) == comparable(sync_state)
+    assert (async_state["time_to_first_token"] is None) == (sync_state["time_to_first_token"] is None)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 上下文打包：不超过token预算，去除近重复片段并保留得分最高的一个，按得分排序。
+"""
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.documents import Document
+
+from agentic_rag import context_packer
+from agentic_rag.context_packer import pack_context, count_tokens, rank_and_deduplicate, to_passages
+
+
+@pytest.fixture(autouse=True)
+def char_token_count(monkeypatch):
+    # 离线环境下不尝试下载 tiktoken 编码，按字符数估算token（中文每字一个token）
+    monkeypatch.setattr(context_packer, "_encoding", False)
+
+
+def document(text, source, score=None):
+    metadata = {"source": source}
+    if score is not None:
+        metadata["rerank_score"] = score
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_budget_is_enforced_and_last_passage_truncated():
+    documents = [document("甲" * 100, "a.txt"), document("乙" * 100, "b.txt"), document("丙" * 100, "c.txt")]
+
+    context, stats = pack_context(documents, budget=180, compress=False)
+
+    assert count_tokens(context) <= 180
+    assert stats["passages"] == 2
+    assert "甲" * 100 in context
+    assert "乙" in context and "乙" * 100 not in context
+    assert "丙" not in context
+    assert stats["original_tokens"] > stats["packed_tokens"]
+    assert stats["tokens_saved"] == stats["original_tokens"] - stats["packed_tokens"]
+
+
+def test_small_remaining_budget_drops_passage():
+    documents = [document("甲" * 100, "a.txt"), document("乙" * 100, "b.txt")]
+
+    context, stats = pack_context(documents, budget=120, compress=False)
+
+    # 第一个片段之后剩余预算少于 MIN_PASSAGE_TOKENS，不再放入截断的片段
+    assert stats["passages"] == 1
+    assert "乙" not in context
+
+
+def test_near_duplicates_keep_highest_score():
+    base = "阿莫西林胶囊用于敏感菌所致的呼吸道感染，成人一次0.5克，每6至8小时一次。"
+    documents = [
+        document(base, "low.txt", score=0.4),
+        document(base.replace("0.5克", "0.5 克"), "high.txt", score=0.9),
+        document("布洛芬缓释胶囊用于缓解轻至中度疼痛。", "other.txt", score=0.6),
+    ]
+
+    context, stats = pack_context(documents, budget=1000, compress=False)
+
+    assert stats["duplicates_removed"] == 1
+    assert stats["passages"] == 2
+    assert context.startswith("[1] 来源: high.txt\n")
+    assert "[2] 来源: other.txt" in context
+    assert "low.txt" not in context
+
+
+def test_order_without_scores_is_kept_and_web_results_are_formatted():
+    passages = rank_and_deduplicate(to_passages([document("第二", "b.txt"), document("第一", "a.txt")]))
+    assert [passage["source"] for passage in passages] == ["b.txt", "a.txt"]
+
+    web = {"query": "q", "results": [
+        {"url": "https://a.example", "title": "标题A", "content": "内容A", "score": 0.2},
+        {"url": "https://b.example", "title": "标题B", "content": "内容B", "score": 0.8},
+    ]}
+    context, stats = pack_context(web, budget=1000, compress=False)
+    assert context == "[1] 来源: https://b.example\n标题B\n内容B\n\n[2] 来源: https://a.example\n标题A\n内容A"
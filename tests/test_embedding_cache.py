@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 磁盘嵌入缓存在向量文件末尾残留半行或未登记的行时，仍按正确的行号写入与读取。
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chromadb")
+from agentic_rag.embedding_cache import EmbeddingStore
+
+
+def test_put_many_after_partial_write(tmp_path):
+    store = EmbeddingStore("test-model", root=str(tmp_path), dtype="float32")
+    store.put_many(["a", "b"], np.array([[1.0, 2.0], [3.0, 4.0]]))
+
+    # 模拟崩溃：末尾留下一行未登记的向量和半行数据
+    with open(store.vectors_path, 'ab') as f:
+        f.write(np.array([9.0, 9.0, 9.0], dtype=np.float32).tobytes())
+
+    store.put_many(["c"], np.array([[5.0, 6.0]]))
+    vectors = store.get_many(["a", "b", "c"])
+    assert vectors["c"].tolist() == [5.0, 6.0]
+    assert vectors["a"].tolist() == [1.0, 2.0]
+
+
+def test_index_rows_beyond_file_are_dropped(tmp_path):
+    store = EmbeddingStore("test-model", root=str(tmp_path), dtype="float32")
+    store.put_many(["a", "b"], np.array([[1.0, 2.0], [3.0, 4.0]]))
+
+    # 模拟未落盘的写入：索引记录了第二行，但文件只剩第一行
+    with open(store.vectors_path, 'r+b') as f:
+        f.truncate(2 * 4)
+
+    store.put_many(["c"], np.array([[5.0, 6.0]]))
+    vectors = store.get_many(["a", "b", "c"])
+    assert "b" not in vectors
+    assert vectors["c"].tolist() == [5.0, 6.0]
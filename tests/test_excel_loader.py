@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: Excel 表头去重与解析缓存清理。
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("pandas")
+from agentic_rag import excel_loader
+
+
+def test_duplicate_headers_are_numbered_like_pandas():
+    names = excel_loader._header_names(["药品名称", None, "规格", "规格", "规格", excel_loader.ROW_COLUMN])
+    assert names == ["药品名称", "Unnamed: 1", "规格", "规格.1", "规格.2", f"{excel_loader.ROW_COLUMN}_"]
+
+
+def test_prune_cache_keeps_only_known_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_loader, "EXCEL_PARQUET_CACHE_PATH", str(tmp_path))
+    for content_hash in ("current", "stale"):
+        os.makedirs(excel_loader._cache_dir(content_hash))
+    os.makedirs(tmp_path / "current.v0")
+
+    assert excel_loader.prune_cache(["current"]) == 2
+    assert os.listdir(tmp_path) == [os.path.basename(excel_loader._cache_dir("current"))]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 工作流图的内循环：文档不相关时切换到下一个检索策略。
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+from langchain_core.documents import Document
+
+
+class FakeDocumentGrader:
+    """只有包含“相关”字样的文档被判定为相关。"""
+
+    def invoke(self, inputs):
+        return {"is_relevant": all(document.page_content.startswith("相关") for document in inputs["documents"])}
+
+    async def ainvoke(self, inputs):
+        return self.invoke(inputs)
+
+
+@pytest.fixture
+def switching_nodes(stub_nodes, monkeypatch):
+    stub_nodes.use_route("hierarchical_search")
+    monkeypatch.setattr(stub_nodes, "get_document_relevance_grader_chain", FakeDocumentGrader)
+    monkeypatch.setattr(stub_nodes, "hierarchical_retriever", lambda *args, **kwargs: [Document(page_content="无关的摘要层结果")])
+    monkeypatch.setattr(stub_nodes, "direct_chunk_retriever", lambda *args, **kwargs: [Document(page_content="相关的区块")])
+    return stub_nodes
+
+
+def assert_switched(state):
+    from evaluation.stub_llm_server import STUB_ANSWER
+
+    assert state["route"] == "direct_chunk_search"
+    assert state["tried_routes"] == ["hierarchical_search", "direct_chunk_search"]
+    assert state["documents_are_relevant"] is True
+    assert [document.page_content for document in state["documents"]] == ["相关的区块"]
+    assert state["response"] == STUB_ANSWER
+
+
+def test_irrelevant_documents_switch_route(switching_nodes):
+    from agentic_rag.graph import build_graph, GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+
+    graph = build_graph(fanout=False)
+    assert_switched(graph.invoke(new_turn_input("某药品的说明书"), config={"recursion_limit": GRAPH_RECURSION_LIMIT}))
+
+
+def test_irrelevant_documents_switch_route_async(switching_nodes):
+    from agentic_rag.graph import build_graph, GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+
+    graph = build_graph(async_mode=True, fanout=False)
+    state = asyncio.run(graph.ainvoke(new_turn_input("某药品的说明书"), config={"recursion_limit": GRAPH_RECURSION_LIMIT}))
+    assert_switched(state)
+
+
+# --- 并发扇出检索 ---
+
+def fanout_state(route):
+    return {"query": "国药准字H20000001", "route": route, "query_embeddings": {}}
+
+
+def test_fanout_prefers_routed_strategy_and_skips_losers(switching_nodes, monkeypatch):
+    import time
+
+    graded = []
+    web_done = []
+
+    class SlowWebSearch:
+        def invoke(self, inputs):
+            time.sleep(0.2)
+            web_done.append(True)
+            return [Document(page_content="相关的网络结果")]
+
+    class RecordingGrader(FakeDocumentGrader):
+        def invoke(self, inputs):
+            graded.extend(document.page_content for document in inputs["documents"])
+            return super().invoke(inputs)
+
+    monkeypatch.setattr(switching_nodes, "get_web_search_tool", SlowWebSearch)
+    monkeypatch.setattr(switching_nodes, "get_document_relevance_grader_chain", RecordingGrader)
+
+    update = switching_nodes.fanout_retrieve_node(fanout_state("direct_chunk_search"))
+    assert update["route"] == "direct_chunk_search"
+    assert update["documents_are_relevant"] is True
+
+    # 已在执行的网络搜索会完成，但选出结果后不再评估它的文档
+    deadline = time.time() + 2
+    while not web_done and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    assert "相关的网络结果" not in graded
+
+
+def test_fanout_exact_match_reports_routed_strategy(switching_nodes, monkeypatch):
+    monkeypatch.setattr(switching_nodes, "exact_match_retriever", lambda *args, **kwargs: [Document(page_content="相关的精确匹配")])
+
+    update = switching_nodes.fanout_retrieve_node(fanout_state("hierarchical_search"))
+    assert update["route"] == "hierarchical_search"
+    assert [document.page_content for document in update["documents"]] == ["相关的精确匹配"]
+
+    update = asyncio.run(switching_nodes.afanout_retrieve_node(fanout_state("hierarchical_search")))
+    assert update["route"] == "hierarchical_search"
+
+
+def test_stopped_strategy_skips_retrieval_and_grading(switching_nodes, monkeypatch):
+    import threading
+
+    stop = threading.Event()
+    stop.set()
+    monkeypatch.setattr(switching_nodes, "direct_chunk_retriever", lambda *args, **kwargs: pytest.fail("不应检索"))
+    assert switching_nodes.retrieve_and_grade("direct_chunk_search", "q", "q", [0.0], stop) == ([], False)
+    assert asyncio.run(switching_nodes.aretrieve_and_grade("direct_chunk_search", "q", "q", [0.0], stop)) == ([], False)
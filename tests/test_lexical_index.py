@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 词法倒排索引：中文二元组分词、BM25排序、增量删除，以及与向量检索结果的RRF融合顺序。
+"""
+
+import math
+
+import pytest
+
+from agentic_rag.lexical_index import LexicalIndex, tokenize, is_code_query, reciprocal_rank_fusion
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(path=str(tmp_path / "lexical.sqlite"), k1=1.5, b=0.75, max_df_ratio=1.0)
+    yield index
+    index.close()
+
+
+def test_tokenize_cjk_bigrams_and_codes():
+    assert tokenize("阿莫西林胶囊") == ["阿莫", "莫西", "西林", "林胶", "胶囊"]
+    assert tokenize("药 H20003263 与 ISO-9001") == ["药", "h20003263", "与", "iso-9001"]
+    assert tokenize("规格1.5g") == ["规格", "1.5g"]
+    assert tokenize("") == []
+
+
+def test_is_code_query():
+    assert is_code_query(" H20003263 ")
+    assert not is_code_query("阿莫西林")
+    assert not is_code_query("ABC")
+    assert not is_code_query("H2000 3263")
+
+
+def test_bm25_ranking(index):
+    index.upsert(
+        ["a", "b", "c"],
+        ["阿莫西林胶囊 阿莫西林", "阿莫西林颗粒 说明书 适应症 用法用量", "布洛芬缓释胶囊"],
+        [{"source": "a.txt"}, None, None],
+    )
+
+    results = index.search("阿莫西林")
+    # 两个区块都命中，词频更高、更短的区块排在前面；不含查询词的区块不出现
+    assert [doc_id for doc_id, _ in results] == ["a", "b"]
+    assert results[0][1] > results[1][1] > 0
+
+    # 与 BM25 公式一致
+    doc_count, avg_length = 3, (8 + 12 + 6) / 3
+    expected = 0.0
+    for term in ("阿莫", "莫西", "西林"):
+        idf = math.log(1 + (doc_count - 2 + 0.5) / (2 + 0.5))
+        expected += idf * 2 * 2.5 / (2 + 1.5 * (1 - 0.75 + 0.75 * 8 / avg_length))
+    assert results[0][1] == pytest.approx(expected)
+
+    assert index.get_documents(["a"]) == {"a": ("阿莫西林胶囊 阿莫西林", {"source": "a.txt"})}
+
+
+def test_upsert_replaces_and_delete_updates_statistics(index):
+    index.upsert(["a", "b"], ["阿莫西林", "布洛芬"])
+    index.upsert(["a"], ["对乙酰氨基酚"])
+    assert index.count() == 2
+    assert index.search("阿莫西林") == []
+    assert [doc_id for doc_id, _ in index.search("氨基酚")] == ["a"]
+
+    index.delete(["a", "missing"])
+    assert index.count() == 1
+    assert index.search("氨基酚") == []
+    assert [doc_id for doc_id, _ in index.search("布洛芬")] == ["b"]
+
+
+def test_reciprocal_rank_fusion_order():
+    dense = ["a", "b", "c"]
+    lexical = ["c", "d", "a"]
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 并列（保持首次出现的顺序），b: 1/62, d: 1/62
+    assert reciprocal_rank_fusion([dense, lexical], k=60) == ["a", "c", "b", "d"]
+    # 只在一个列表中排第一的结果低于在两个列表中都出现的结果
+    assert reciprocal_rank_fusion([["x", "y"], ["y"]], k=60) == ["y", "x"]
+    assert reciprocal_rank_fusion([[], []]) == []
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 本地最近质心路由：按保存的质心文件预测路由与置信度，嵌入模型不一致或没有模型文件时停用。
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from agentic_rag import local_router
+from agentic_rag.local_router import LocalRouter
+
+
+@pytest.fixture(autouse=True)
+def stub_model_id(monkeypatch):
+    monkeypatch.setattr(local_router, "current_model_id", lambda: "stub-model")
+
+
+def save_model(path, model_id="stub-model"):
+    np.savez(path, labels=np.array(["direct", "web_search"]),
+             centroids=np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float32), model_id=np.array(model_id))
+
+
+def test_predict_nearest_centroid(tmp_path):
+    path = str(tmp_path / "router.npz")
+    save_model(path)
+    router = LocalRouter(model_path=path, threshold=0.8, temperature=0.05)
+
+    route, confidence = router.predict([2.0, 0.1, 0.0])
+    assert route == "direct"
+    assert confidence > 0.99
+
+    # 与两个质心等距时置信度为 0.5，低于阈值，应交给LLM路由
+    route, confidence = router.predict([1.0, 1.0, 0.0])
+    assert confidence == pytest.approx(0.5)
+    assert confidence < router.threshold
+
+
+def test_model_id_mismatch_disables_router(tmp_path):
+    path = str(tmp_path / "router.npz")
+    save_model(path, model_id="other-model")
+    router = LocalRouter(model_path=path)
+
+    assert router.predict([1.0, 0.0, 0.0]) == (None, 0.0)
+
+
+def test_missing_model_file_and_reload(tmp_path):
+    path = str(tmp_path / "router.npz")
+    router = LocalRouter(model_path=path)
+    assert router.predict([1.0, 0.0, 0.0]) == (None, 0.0)
+
+    # 重新训练后的模型文件在下一次预测时自动加载
+    save_model(path)
+    os.utime(path, (1, 1))
+    assert router.predict([0.0, 1.0, 0.0])[0] == "web_search"
+
+
+def test_train_builds_centroids_from_golden_set_and_llm_log(tmp_path, monkeypatch):
+    from agentic_rag import chains
+
+    vectors = {"天气": [0.0, 1.0, 0.0], "新闻": [0.0, 0.9, 0.1], "你好": [1.0, 0.0, 0.0], "药品说明": [0.0, 0.0, 1.0]}
+    monkeypatch.setattr(chains, "embed_query_text", lambda text: vectors[text])
+    golden = tmp_path / "golden.csv"
+    golden.write_text("question,ideal_route\n天气,web_search\n你好,direct\n药品说明,vectorstore\n", encoding="utf-8")
+    log = str(tmp_path / "decisions.jsonl")
+    local_router.log_route_decision("新闻", "web_search", "llm", 0.0, log_path=log)
+    # 本地路由自己的决策不作为训练样本
+    local_router.log_route_decision("你好", "web_search", "local", 0.9, log_path=log)
+
+    path = str(tmp_path / "router.npz")
+    local_router.train(model_path=path, golden_path=str(golden), log_path=log)
+
+    router = LocalRouter(model_path=path)
+    assert router.predict([0.0, 0.0, 1.0])[0] == "hierarchical_search"
+    assert router.predict([1.0, 0.0, 0.0])[0] == "direct"
+    assert router.predict([0.0, 1.0, 0.05])[0] == "web_search"
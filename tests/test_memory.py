@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 长期记忆的向量化混合评分与逐条计算的旧公式一致；检索命中的访问时间合并后由写线程批量写入。
+"""
+
+import math
+import datetime
+
+import pytest
+
+pytest.importorskip("chromadb")
+from agentic_rag.memory import MemoryStore, SQL_CREATE_TABLE, SQL_INSERT, hybrid_scores
+
+
+def legacy_score(distance, importance, last_accessed_at, now):
+    """旧实现中逐条计算的混合得分。"""
+    last_accessed = datetime.datetime.fromisoformat(last_accessed_at)
+    hours_since_accessed = (now - last_accessed).total_seconds() / 3600
+    recency_score = 1.0 / (1.0 + math.log1p(hours_since_accessed))
+    return (1.0 / (1.0 + distance)) * (1 + 0.1 * importance) * (1 + 0.5 * recency_score)
+
+
+class FakeCollection:
+    """按固定顺序返回候选记忆及其距离的记忆集合。"""
+
+    def __init__(self, distances):
+        self.distances = distances
+
+    def query(self, query_embeddings, n_results):
+        items = list(self.distances.items())[:n_results]
+        return {"ids": [[str(memory_id) for memory_id, _ in items]], "distances": [[d for _, d in items]]}
+
+
+ROWS = [
+    ("偏好中文回答", "preference", 8, 0.2),
+    ("项目使用Python", "fact", 5, 30.0),
+    ("上周讨论过部署", "event", 3, 24 * 7.0),
+    ("喜欢简洁的代码", "preference", 10, 24 * 90.0),
+]
+DISTANCES = {1: 0.9, 2: 0.3, 3: 0.5, 4: 1.4}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MemoryStore(db_path=str(tmp_path / "memory.sqlite"), persist_path=str(tmp_path),
+                        collection=FakeCollection(DISTANCES), touch_flush_interval=60)
+    now = datetime.datetime.now()
+    rows = []
+    for text, type, importance, hours in ROWS:
+        accessed = str(now - datetime.timedelta(hours=hours))
+        rows.append((text, type, importance, accessed, accessed))
+
+    def insert_all(conn):
+        conn.execute(SQL_CREATE_TABLE)
+        conn.executemany(SQL_INSERT, rows)
+        conn.commit()
+    store.submit_write(insert_all).result()
+    return store
+
+
+def test_hybrid_scores_match_legacy_formula():
+    now = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    distances = [0.0, 0.25, 1.3, 2.0]
+    importances = [1, 5, 7, 10]
+    last_accessed = [str(now - datetime.timedelta(hours=h)) for h in (0.0, 1.5, 48.0, 24 * 365.0)]
+
+    scores = hybrid_scores(distances, importances, last_accessed, now)
+
+    expected = [legacy_score(d, i, a, now) for d, i, a in zip(distances, importances, last_accessed)]
+    assert scores.tolist() == pytest.approx(expected, rel=1e-12)
+
+
+def test_retrieve_ranks_like_legacy_formula(store):
+    now = datetime.datetime.now()
+    with store.read_connection() as conn:
+        rows = conn.execute("SELECT * FROM memories").fetchall()
+    expected = sorted(
+        ((legacy_score(DISTANCES[row['id']], row['importance'], row['last_accessed_at'], now), row['id']) for row in rows),
+        reverse=True,
+    )[:2]
+
+    memories = store.retrieve("", top_k=2, query_embedding=[0.0], oversample=2)
+
+    assert [mem['id'] for mem in memories] == [memory_id for _, memory_id in expected]
+    assert [mem['score'] for mem in memories] == pytest.approx([score for score, _ in expected], rel=1e-6)
+
+
+def test_access_times_are_coalesced_and_flushed(store):
+    def last_accessed():
+        with store.read_connection() as conn:
+            return {row['id']: row['last_accessed_at'] for row in conn.execute("SELECT id, last_accessed_at FROM memories")}
+
+    before = last_accessed()
+    first = store.retrieve("", top_k=1, query_embedding=[0.0])
+    second = store.retrieve("", top_k=1, query_embedding=[0.0])
+    assert first[0]['id'] == second[0]['id']
+    # 检索本身不写库，访问时间先在内存中合并
+    assert last_accessed() == before
+    assert list(store._pending_touches) == [first[0]['id']]
+
+    store.flush_touches()
+
+    after = last_accessed()
+    assert after[first[0]['id']] > before[first[0]['id']]
+    assert {k: v for k, v in after.items() if k != first[0]['id']} == {k: v for k, v in before.items() if k != first[0]['id']}
+    assert store._pending_touches == {}
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 精确元数据索引：查找键提取（含数字且不少于6个字符的编码片段）与按编码、完整值查找区块。
+"""
+
+import pytest
+
+from agentic_rag.metadata_index import MetadataIndex, extract_codes, metadata_keys, normalize_key
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(path=str(tmp_path / "metadata.sqlite"), columns=["药品名称", "批准文号", "本位码"])
+    yield index
+    index.close()
+
+
+def test_extract_codes_requires_six_chars_with_a_digit():
+    assert extract_codes("国药准字H20003263") == ["H20003263"]
+    # 6个字符且含数字：保留；5个字符或不含数字：忽略
+    assert extract_codes("批号 a12345 与 b1234") == ["A12345"]
+    assert extract_codes("ABCDEFGH 规格 0.25g 2023年") == []
+    assert extract_codes("ISO-9001 编码") == ["ISO-9001"]
+
+
+def test_metadata_keys():
+    assert metadata_keys(" 国药准字 H20003263 ") == {"国药准字H20003263", "H20003263"}
+    assert metadata_keys("阿莫西林胶囊") == {"阿莫西林胶囊"}
+    assert metadata_keys("  ") == set()
+    assert normalize_key("h2000 3263") == "H20003263"
+
+
+def test_lookup_by_code_and_full_value(index):
+    index.upsert(
+        ["row_1", "row_2", "row_3"],
+        [
+            {"药品名称": "阿莫西林胶囊", "批准文号": "国药准字H20003263", "生产企业": "甲药厂"},
+            {"药品名称": "布洛芬缓释胶囊", "本位码": 86900123456789},
+            {"source": "notes.txt"},
+        ],
+    )
+
+    assert index.lookup("H20003263 的生产企业是什么") == [("row_1", "批准文号", "国药准字H20003263")]
+    assert index.lookup("国药准字h20003263") == [("row_1", "批准文号", "国药准字H20003263")]
+    assert index.lookup("阿莫西林胶囊") == [("row_1", "药品名称", "阿莫西林胶囊")]
+    assert index.lookup("86900123456789") == [("row_2", "本位码", "86900123456789")]
+    # 未索引的列与普通问题不会命中
+    assert index.lookup("甲药厂") == []
+    assert index.count() == 2
+
+
+def test_upsert_replaces_and_delete_removes(index):
+    index.upsert(["row_1"], [{"批准文号": "国药准字H20003263"}])
+    index.upsert(["row_1"], [{"批准文号": "国药准字Z44021940"}])
+    assert index.lookup("H20003263") == []
+    assert index.lookup("Z44021940") == [("row_1", "批准文号", "国药准字Z44021940")]
+
+    index.delete(["row_1"])
+    assert index.lookup("Z44021940") == []
+    assert index.count() == 0
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 近重复索引只在规范条目写入后登记签名，失败的待定条目被丢弃时报告受影响的副本来源。
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+from agentic_rag.near_dedup import NearDuplicateIndex
+
+LEAFLET = "本品用于缓解轻至中度疼痛，如头痛、关节痛、偏头痛、牙痛、肌肉痛、神经痛、痛经。" * 4
+
+
+@pytest.fixture
+def index(tmp_path):
+    near_dup = NearDuplicateIndex(path=str(tmp_path / "near_dup.sqlite"))
+    yield near_dup
+    near_dup.close()
+
+
+def test_pending_entry_matches_within_run_and_persists_after_register(index, tmp_path):
+    assert index.find_or_add("chunk", "a_chunk_0", "a.pdf", LEAFLET) is None
+    assert index.find_or_add("chunk", "b_chunk_0", "b.pdf", LEAFLET) == "a_chunk_0"
+
+    # 未登记的待定条目不会被持久化
+    reopened = NearDuplicateIndex(path=str(tmp_path / "near_dup.sqlite"))
+    assert reopened.find_or_add("chunk", "c_chunk_0", "c.pdf", LEAFLET) is None
+    reopened.close()
+
+    index.register("chunk", ["a_chunk_0"])
+    reopened = NearDuplicateIndex(path=str(tmp_path / "near_dup.sqlite"))
+    assert reopened.find_or_add("chunk", "c_chunk_0", "c.pdf", LEAFLET) == "a_chunk_0"
+    reopened.close()
+
+
+def test_discard_reports_orphaned_alias_sources(index):
+    assert index.find_or_add("doc", "a.pdf", "a.pdf", LEAFLET) is None
+    assert index.find_or_add("doc", "b.pdf", "b.pdf", LEAFLET) == "a.pdf"
+
+    assert index.discard("doc", ["a.pdf"]) == {"b.pdf"}
+    assert index.orphaned_sources == {"b.pdf"}
+    # 被丢弃的条目不再作为别名目标
+    assert index.find_or_add("doc", "c.pdf", "c.pdf", LEAFLET) is None
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 本地重排序器按最高分把检索结果判定为相关、不相关或不确定，并按得分筛选保留的文档。
+"""
+
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.documents import Document
+
+from agentic_rag.reranker import LocalReranker
+
+# 文档内容即其得分
+SCORES = {"高": 0.9, "较高": 0.5, "中": 0.2, "低": 0.1, "极低": 0.01}
+
+
+class StubCrossEncoder:
+    def __init__(self, model_path, device=None, max_length=None):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        self.calls.append(pairs)
+        return [SCORES[text] for _, text in pairs]
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    module = types.ModuleType("sentence_transformers")
+    module.CrossEncoder = StubCrossEncoder
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    return LocalReranker(model_path="stub", top_n=2, keep_threshold=0.3, accept_threshold=0.7, reject_threshold=0.05)
+
+
+def documents(*texts):
+    return [Document(page_content=text, metadata={"source": text}) for text in texts]
+
+
+def test_accept_keeps_top_n_above_keep_threshold(reranker):
+    kept, relevant = reranker.filter("问题", documents("中", "高", "较高", "低"))
+
+    assert relevant is True
+    assert [document.page_content for document in kept] == ["高", "较高"]
+    assert kept[0].metadata == {"source": "高", "rerank_score": 0.9}
+    assert reranker.model.calls == [[("问题", "中"), ("问题", "高"), ("问题", "较高"), ("问题", "低")]]
+
+
+def test_reject_when_best_score_below_reject_threshold(reranker):
+    assert reranker.filter("问题", documents("极低")) == ([], False)
+
+
+def test_ambiguous_keeps_documents_not_clearly_rejected(reranker):
+    kept, relevant = reranker.filter("问题", documents("极低", "低", "较高", "中"))
+
+    assert relevant is None
+    assert [document.page_content for document in kept] == ["较高", "中"]
+
+
+def test_empty_input_and_stats(reranker):
+    assert reranker.filter("问题", []) == ([], False)
+    reranker.filter("问题", documents("高"))
+    reranker.filter("问题", documents("极低"))
+    reranker.filter("问题", documents("中"))
+
+    assert reranker.stats() == {"accepted": 1, "rejected": 1, "ambiguous": 1, "skip_llm_rate": pytest.approx(2 / 3)}
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: HTTP服务的会话处理：不提供 session_id 的请求不写入检查点；等待会话锁计入排队数与排队超时。
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("langgraph")
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+@pytest.fixture
+def service(stub_nodes):
+    from agentic_rag.graph import build_graph
+    from server import AgentService, RunLimiter
+
+    checkpointer = InMemorySaver()
+    service = AgentService(
+        build_graph(async_mode=True, checkpointer=checkpointer, fanout=False),
+        build_graph(async_mode=True, fanout=False),
+        RunLimiter(max_concurrent=2, max_queued=2, timeout=5),
+    )
+    service.checkpointer = checkpointer
+    return service
+
+
+def test_sessionless_requests_do_not_create_threads(service):
+    from evaluation.stub_llm_server import STUB_ANSWER
+
+    async def scenario():
+        first = await service.run("第一个问题")
+        second = await service.run("第二个问题")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["response"] == STUB_ANSWER
+    # 单轮请求之间互不共享历史
+    assert [entry[1] for entry in second["conversation_history"] if entry[0] == "Human"] == ["第二个问题"]
+    assert not service.checkpointer.storage
+
+
+def test_session_requests_keep_history(service):
+    async def scenario():
+        await service.run("第一个问题", "session-1")
+        return await service.run("第二个问题", "session-1")
+
+    state = asyncio.run(scenario())
+    assert [entry[1] for entry in state["conversation_history"] if entry[0] == "Human"] == ["第一个问题", "第二个问题"]
+    assert list(service.checkpointer.storage) == ["session-1"]
+
+
+def test_sessionless_stream_reports_no_session(service):
+    async def scenario():
+        return [event async for event in service.stream("问题")]
+
+    events = asyncio.run(scenario())
+    assert events[0] == ("session", {"session_id": None})
+    assert events[-1][0] == "answer" and events[-1][1]["session_id"] is None
+    assert not service.checkpointer.storage
+
+
+def test_session_lock_wait_is_queued_and_times_out():
+    from server import RunLimiter, QueueFullError
+
+    async def scenario():
+        limiter = RunLimiter(max_concurrent=4, max_queued=1, timeout=0.05)
+        lock = asyncio.Lock()
+        async with limiter.slot(lock):
+            waiter = asyncio.create_task(limiter.slot(lock).__aenter__())
+            await asyncio.sleep(0)
+            # 等待会话锁的请求计入排队数，队列满后新请求直接被拒绝
+            assert limiter.queued == 1 and limiter.is_full()
+            with pytest.raises(QueueFullError):
+                async with limiter.slot(asyncio.Lock()):
+                    pass
+            with pytest.raises(QueueFullError):
+                await waiter
+        assert (limiter.queued, limiter.running, lock.locked()) == (0, 0, False)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_wait_releases_session_lock():
+    from server import RunLimiter
+
+    async def scenario():
+        limiter = RunLimiter(max_concurrent=1, max_queued=2, timeout=5)
+        lock = asyncio.Lock()
+        async with limiter.slot():
+            # 会话锁已取得、等待运行槽位时被取消：会话锁应被释放
+            waiter = asyncio.create_task(limiter.slot(lock).__aenter__())
+            await asyncio.sleep(0)
+            assert lock.locked() and limiter.queued == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        assert (limiter.queued, limiter.running, lock.locked()) == (0, 0, False)
+
+    asyncio.run(scenario())
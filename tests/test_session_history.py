@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 同一会话（thread_id）的多轮问题通过检查点共享对话历史。
+"""
+
+import pytest
+
+pytest.importorskip("langgraph")
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+@pytest.fixture
+def stub_graph(stub_nodes):
+    from agentic_rag.graph import build_graph
+    return build_graph(checkpointer=InMemorySaver(), fanout=False)
+
+
+def history_of(state):
+    # 检查点序列化后元组会变为列表
+    return [tuple(entry) for entry in state["conversation_history"]]
+
+
+def test_history_grows_across_turns(stub_graph):
+    from agentic_rag.graph import GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+    from evaluation.stub_llm_server import STUB_ANSWER
+
+    config = {"recursion_limit": GRAPH_RECURSION_LIMIT, "configurable": {"thread_id": "session-1"}}
+
+    first = stub_graph.invoke(new_turn_input("第一个问题"), config=config)
+    assert history_of(first) == [("Human", "第一个问题"), ("AI", STUB_ANSWER)]
+
+    second = stub_graph.invoke(new_turn_input("第二个问题"), config=config)
+    assert history_of(second) == [
+        ("Human", "第一个问题"), ("AI", STUB_ANSWER),
+        ("Human", "第二个问题"), ("AI", STUB_ANSWER),
+    ]
+
+    other = stub_graph.invoke(new_turn_input("另一个会话"), config={**config, "configurable": {"thread_id": "session-2"}})
+    assert [text for role, text in history_of(other) if role == "Human"] == ["另一个会话"]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 流式运行（stream_run / astream_run）逐个产出答案token，并在最终状态中记录首个token的耗时。
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+from langchain_core.documents import Document
+
+
+def assert_streamed(events, answer_node):
+    from agentic_rag.graph import ANSWER_NODES
+    from evaluation.stub_llm_server import STUB_ANSWER, STREAM_CHUNK_CHARS
+
+    names = [event for event, _ in events]
+    tokens = [data for event, data in events if event == "token"]
+    # 桩模型按 STREAM_CHUNK_CHARS 个字符一块输出，每块是一个token事件
+    assert len(tokens) == -(-len(STUB_ANSWER) // STREAM_CHUNK_CHARS)
+    assert "".join(token["text"] for token in tokens) == STUB_ANSWER
+    assert {token["node"] for token in tokens} == {answer_node}
+    assert answer_node in ANSWER_NODES
+    # 只有答案节点的LLM输出作为token传出（路由、评估等链的JSON输出不会出现）
+    assert all(not token["text"].startswith("{") for token in tokens)
+
+    # token在答案节点完成之前产出，最终状态在最后
+    answer_done = next(i for i, (event, data) in enumerate(events) if event == "node" and data["node"] == answer_node)
+    assert names.index("token") < answer_done
+    assert names[-1] == "final"
+    final_state = events[-1][1]
+    assert final_state["response"] == STUB_ANSWER
+    assert isinstance(final_state["time_to_first_token"], float)
+    assert final_state["time_to_first_token"] >= 0
+
+
+@pytest.mark.parametrize("route, answer_node", [("direct", "direct_response"), ("direct_chunk_search", "generate_response")])
+def test_stream_run_emits_tokens(stub_nodes, monkeypatch, route, answer_node):
+    from agentic_rag.graph import build_graph, stream_run, GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+
+    stub_nodes.use_route(route)
+    monkeypatch.setattr(stub_nodes, "direct_chunk_retriever", lambda *args, **kwargs: [Document(page_content="区块", metadata={"source": "a.txt"})])
+
+    graph = build_graph(fanout=False)
+    events = list(stream_run(graph, new_turn_input("问题"), config={"recursion_limit": GRAPH_RECURSION_LIMIT}))
+    assert_streamed(events, answer_node)
+
+
+@pytest.mark.parametrize("route, answer_node", [("direct", "direct_response"), ("direct_chunk_search", "generate_response")])
+def test_astream_run_emits_tokens(stub_nodes, monkeypatch, route, answer_node):
+    from agentic_rag.graph import build_graph, astream_run, GRAPH_RECURSION_LIMIT
+    from agentic_rag.state import new_turn_input
+
+    stub_nodes.use_route(route)
+    monkeypatch.setattr(stub_nodes, "direct_chunk_retriever", lambda *args, **kwargs: [Document(page_content="区块", metadata={"source": "a.txt"})])
+
+    async def collect():
+        graph = build_graph(async_mode=True, fanout=False)
+        return [event async for event in astream_run(graph, new_turn_input("问题"), config={"recursion_limit": GRAPH_RECURSION_LIMIT})]
+
+    assert_streamed(asyncio.run(collect()), answer_node)
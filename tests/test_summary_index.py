@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 内存摘要向量索引的前k个结果与暴力余弦相似度一致；维度不一致时返回 None；索引版本变化后重建快照。
+"""
+
+import numpy as np
+import pytest
+
+from agentic_rag.answer_cache import bump_index_version
+from agentic_rag.summary_index import SummaryIndex
+
+
+class FakeSummaryCollection:
+    """按 Chroma 的 count()/get() 接口分页返回摘要向量。"""
+
+    def __init__(self, embeddings):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.gets = 0
+
+    def count(self):
+        return len(self.embeddings)
+
+    def get(self, limit, offset, include):
+        self.gets += 1
+        rows = range(offset, min(offset + limit, len(self.embeddings)))
+        return {
+            "ids": [f"doc_{i}" for i in rows],
+            "embeddings": self.embeddings[offset:offset + limit].tolist(),
+            "metadatas": [{"source": f"file_{i}.txt"} for i in rows],
+        }
+
+
+@pytest.fixture
+def paths(tmp_path):
+    version_path = str(tmp_path / "index_version")
+    bump_index_version(version_path)
+    return str(tmp_path / "summary_index"), version_path
+
+
+def brute_force_top_k(embeddings, query, k):
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    top = np.argsort(-scores)[:k]
+    return [(f"file_{i}.txt", float(scores[i])) for i in top]
+
+
+def test_search_matches_brute_force_cosine(paths):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((200, 16)) * rng.uniform(0.5, 3.0, size=(200, 1))
+    index = SummaryIndex(FakeSummaryCollection(embeddings), path=paths[0], version_path=paths[1])
+
+    for query in rng.standard_normal((20, 16)):
+        hits = index.search(query, n_results=5)
+        expected = brute_force_top_k(embeddings, query, 5)
+        assert [source for source, _ in hits] == [source for source, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+    assert len(index.search(rng.standard_normal(16), n_results=500)) == 200
+
+
+def test_dimension_mismatch_returns_none(paths):
+    index = SummaryIndex(FakeSummaryCollection(np.eye(4)), path=paths[0], version_path=paths[1])
+
+    assert index.search([1.0, 0.0, 0.0], n_results=2) is None
+    assert index.search([1.0, 0.0, 0.0, 0.0], n_results=1) == [("file_0.txt", pytest.approx(1.0))]
+
+
+def test_snapshot_is_reused_until_index_version_changes(paths):
+    collection = FakeSummaryCollection(np.eye(3))
+    SummaryIndex(collection, path=paths[0], version_path=paths[1]).refresh()
+    assert collection.gets == 1
+
+    # 另一个进程加载同一版本的快照，无需读取摘要集合
+    index = SummaryIndex(collection, path=paths[0], version_path=paths[1])
+    assert index.search([0.0, 1.0, 0.0], n_results=1)[0][0] == "file_1.txt"
+    assert collection.gets == 1
+
+    collection.embeddings = np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0]], dtype=np.float32)
+    bump_index_version(paths[1])
+    assert index.search([0.0, 1.0, 0.0], n_results=1)[0][0] == "file_0.txt"
+    assert collection.gets == 2
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 表格列式存储：按列推断类型（编码与标识符列保留为字符串），查询只接受单条只读语句。
+"""
+
+import pytest
+
+pytest.importorskip("duckdb")
+import pandas as pd
+
+from agentic_rag.tabular_store import TabularStore, unique_columns, table_name_for
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TabularStore(path=str(tmp_path / "tabular.duckdb"))
+    frame = pd.DataFrame({
+        "名称": ["阿莫西林", "布洛芬", "维生素C"],
+        "数量": ["10", "-3", ""],
+        "价格": ["1.5", "20", "0.5"],
+        "日期": ["2024-01-01", "2024-02-15 08:30:00", ""],
+        "编码": ["00123", "00456", "10789"],
+        "批准文号": ["20003263", "20003264", "20003265"],
+        "混合": ["12", "abc", "3"],
+    })
+    table = store.begin_sheet("药品.xlsx", "Sheet1", frame.columns)
+    store.append(table, frame)
+    store.finish_sheet(table, "药品.xlsx", "Sheet1")
+    yield store
+    store.close()
+
+
+def test_infer_column_types(store):
+    (table,) = store.tables()
+    assert table["table_name"] == table_name_for("药品.xlsx", "Sheet1")
+    assert table["row_count"] == 3
+    assert dict(table["columns"]) == {
+        "名称": "VARCHAR",
+        "数量": "BIGINT",
+        "价格": "DOUBLE",
+        "日期": "TIMESTAMP",
+        # 带前导零的编码与标识符列保留为字符串
+        "编码": "VARCHAR",
+        "批准文号": "VARCHAR",
+        "混合": "VARCHAR",
+    }
+
+
+def test_query_typed_values(store):
+    table = store.tables()[0]["table_name"]
+    columns, rows, truncated = store.query(
+        f'SELECT "名称", "数量", "编码" FROM {table} WHERE "价格" > 1 ORDER BY "价格";'
+    )
+    assert columns == ["名称", "数量", "编码"]
+    assert rows == [("阿莫西林", 10, "00123"), ("布洛芬", -3, "00456")]
+    assert not truncated
+
+    _, rows, truncated = store.query(f"SELECT * FROM {table}", max_rows=2)
+    assert len(rows) == 2 and truncated
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM tabular_tables",
+    "DROP TABLE tabular_tables",
+    "SELECT 1; DROP TABLE tabular_tables",
+    "SELECT 1; SELECT 2;",
+    "  ",
+])
+def test_query_rejects_non_select_and_multiple_statements(store, sql):
+    with pytest.raises(ValueError):
+        store.query(sql)
+    assert len(store.tables()) == 1
+
+
+def test_unique_columns_and_drop_source(store):
+    assert unique_columns(["a", "a", "_row_index", "b", "a"]) == ["a", "a.1", "_row_index_", "b", "a.2"]
+    assert store.drop_source("药品.xlsx") == 1
+    assert store.tables() == []